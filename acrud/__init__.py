@@ -1,9 +1,12 @@
+import os
+import threading
 from pathlib import Path
-from typing import Any, Dict, Optional
+from typing import Any, Dict, Optional, Union
 import configparser
 from importlib import import_module
 
-from acrud.storage.base import StorageBase
+from acrud.storage.base import AsyncStorageBase, StorageBase
+from acrud.storage.utils import get_config_option
 
 
 class StorageConfig:
@@ -15,17 +18,61 @@ class StorageConfig:
 
 class StorageFactory:
     @staticmethod
-    def create_storage(config: StorageConfig) -> StorageBase:
+    def create_storage(config: StorageConfig) -> Union[StorageBase, AsyncStorageBase]:
         storage_type = config.storage_type.lower()
         package = "acrud.storage"
+        # `ASYNC = true` selects the asyncio flavour of the backend
+        prefix = "Async" if get_config_option(config, "ASYNC", False, bool) else ""
+        if prefix:
+            # Only coalescing has an asyncio flavour
+            unsupported = [
+                name
+                for name in ("PACK", "BUFFERED_WRITES", "CACHE")
+                if get_config_option(config, name, False, bool)
+            ]
+            if unsupported:
+                raise ValueError(
+                    f"{', '.join(unsupported)} cannot be combined with ASYNC. "
+                    "Only COALESCE supports async storage."
+                )
         # Dynamically import the appropriate storage module
         try:
             module = import_module(package + "." + storage_type, package)
-            storage_class = getattr(module, f"{storage_type.capitalize()}Storage")
-            return storage_class(config)
+            storage_class = getattr(
+                module, f"{prefix}{storage_type.capitalize()}Storage"
+            )
+            storage = storage_class(config)
         except (ImportError, AttributeError) as e:
             raise ValueError(f"Unsupported storage type: {config.storage_type}") from e
 
+        # `PACK = true` packs small files into larger objects. Packs are made from the
+        # batches of queued writes, so it implies `BUFFERED_WRITES`.
+        pack = get_config_option(config, "PACK", False, bool)
+        if pack:
+            from acrud.storage.packed import PackedStorage
+
+            storage = PackedStorage.from_config(storage, config)
+
+        # `BUFFERED_WRITES = true` queues writes and makes them in the background
+        if pack or get_config_option(config, "BUFFERED_WRITES", False, bool):
+            from acrud.storage.buffered import BufferedStorage
+
+            storage = BufferedStorage.from_config(storage, config)
+
+        # `COALESCE = true` shares concurrent reads of the same file
+        if get_config_option(config, "COALESCE", False, bool):
+            from acrud.storage import coalesce
+
+            storage = getattr(coalesce, f"{prefix}CoalescingStorage")(storage)
+
+        # `CACHE = true` wraps the backend in a read-through cache
+        if get_config_option(config, "CACHE", False, bool):
+            from acrud.storage.cache import CachedStorage
+
+            storage = CachedStorage.from_config(storage, config)
+
+        return storage
+
 
 def find_config_file() -> Optional[Path]:
     """Search for storage.config file in current and parent directories."""
@@ -42,12 +89,14 @@ def find_config_file() -> Optional[Path]:
     )
 
 
-def load_config() -> Dict[str, Any]:
-    """Load configuration from storage.config file."""
-    config_file = find_config_file()
+def load_config(config_file: Optional[Union[str, os.PathLike]] = None) -> Dict[str, Any]:
+    """Load configuration from a storage.config file, by default the nearest one."""
+    if config_file is None:
+        config_file = find_config_file()
 
     config = configparser.ConfigParser()
-    config.read(config_file)
+    if not config.read(config_file):
+        raise FileNotFoundError(f"Cannot read config file: {config_file}")
 
     if "DEFAULT" not in config:
         raise ValueError("Invalid config file format: missing DEFAULT section")
@@ -55,10 +104,43 @@ def load_config() -> Dict[str, Any]:
     return dict(config["DEFAULT"])
 
 
-# Create the storage instance on module import
-try:
-    config_dict = load_config()
-    config = StorageConfig(config_dict)
-    storage = StorageFactory.create_storage(config)
-except Exception as e:
-    raise ImportError(f"Failed to initialize storage: {str(e)}")
+def connect(
+    config: Optional[Union[StorageConfig, Dict[str, Any], str, os.PathLike]] = None
+) -> Union[StorageBase, AsyncStorageBase]:
+    """
+    Create a storage instance.
+
+    Args:
+        config (Optional[Union[StorageConfig, Dict[str, Any], str, os.PathLike]], optional):
+            The configuration, as a `StorageConfig`, a dict of options or the path to a
+            config file. Defaults to the nearest storage.config file.
+
+    Returns:
+        Union[StorageBase, AsyncStorageBase]: The storage instance.
+    """
+    if not isinstance(config, (StorageConfig, dict)):
+        config = load_config(config)
+    if isinstance(config, dict):
+        config = StorageConfig(config)
+    return StorageFactory.create_storage(config)
+
+
+_lock = threading.Lock()
+_default_storage = None
+
+
+def default_storage() -> Union[StorageBase, AsyncStorageBase]:
+    """
+    Get the storage configured by the nearest storage.config file.
+    It is created on the first call, so importing the package stays cheap, and shared
+    by every later call.
+
+    Returns:
+        Union[StorageBase, AsyncStorageBase]: The storage instance.
+    """
+    global _default_storage
+
+    with _lock:
+        if _default_storage is None:
+            _default_storage = connect()
+    return _default_storage
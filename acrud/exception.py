@@ -1,21 +1,28 @@
-from .storage.base import StorageBase
+import errno
+from typing import TYPE_CHECKING
 
+if TYPE_CHECKING:
+    from .storage.base import StorageBase
 
-def lookup_handler(storage: StorageBase, file_path: str):
 
-    # Split the file path by '/'
-    split_file_path = file_path.split("/")
+class NotFoundError(FileNotFoundError, LookupError):
+    """
+    Raised when a file does not exist.
+    It is both a `LookupError`, as storages have always raised, and a
+    `FileNotFoundError`, with the missing path as `filename`.
+    """
 
-    for index, path in enumerate(split_file_path):
+    def __init__(self, file_path: str) -> None:
+        super().__init__(errno.ENOENT, "File not found", file_path)
 
-        if path == "":
-            pass
+    def __reduce__(self):
+        return type(self), (self.filename,)
 
-        short_file_path = "/".join(split_file_path[: index + 1])
 
-        try:
-            folders = storage.list_subdirectories_in_directory(short_file_path)
-        except FileNotFoundError:
-            raise LookupError(f"File not found. No such directory as {short_file_path}")
-
-    raise LookupError(f"File not found.")
+def lookup_handler(storage: "StorageBase", file_path: str):
+    """
+    Raise the error for a missing file.
+    The error is built from the path alone, without listing any directory, so a miss
+    costs nothing beyond the failed lookup itself.
+    """
+    raise NotFoundError(file_path)
@@ -2,3 +2,9 @@ SUPPORTS_CSV = True
 SUPPORTS_JSON = True
 SUPPORTS_PICKLE = True
 SUPPORTS_PDF = True
+SUPPORTS_MSGPACK = True
+SUPPORTS_TABULAR = True
+
+# "orjson" falls back to the standard library "json" when it is not installed
+JSON_CODEC = "orjson"
+PICKLE_PROTOCOL = 5
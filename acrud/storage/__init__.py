@@ -1,3 +1,25 @@
-from .s3 import S3Storage
-from .local import LocalStorage
-from .base import StorageBase
+from importlib import import_module
+
+from .base import NOT_MODIFIED, FileStat, StorageBase, StorageEntry, AsyncStorageBase
+
+# Backends import their client libraries, e.g. boto3, so they are imported on first use
+_LAZY_IMPORTS = {
+    "S3Storage": ".s3",
+    "AsyncS3Storage": ".s3",
+    "LocalStorage": ".local",
+    "AsyncLocalStorage": ".local",
+    "BufferedStorage": ".buffered",
+    "CachedStorage": ".cache",
+    "CoalescingStorage": ".coalesce",
+    "AsyncCoalescingStorage": ".coalesce",
+    "PackedStorage": ".packed",
+    "TieredStorage": ".tiered",
+}
+
+
+def __getattr__(name: str):
+    if name not in _LAZY_IMPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(import_module(_LAZY_IMPORTS[name], __name__), name)
+    globals()[name] = value
+    return value
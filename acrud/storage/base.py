@@ -1,9 +1,89 @@
+import codecs
+import csv
+import io
+import mimetypes
+import shutil
 from abc import ABC, abstractmethod
-from typing import Any, Optional, Tuple
+from datetime import datetime
+from typing import (
+    Any,
+    Awaitable,
+    BinaryIO,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+    Union,
+)
+
+from ..exception import NotFoundError
+from .stream import CHUNK_SIZE
+
+
+def _raise_first(results: list) -> None:
+    # Batch operations return errors as results, raise the first one
+    for result in results:
+        if isinstance(result, Exception):
+            raise result
+
+
+class _NotModified:
+    """
+    Returned by a conditional read when the file has not changed.
+    """
+
+    def __repr__(self) -> str:
+        return "NOT_MODIFIED"
+
+    def __bool__(self) -> bool:
+        return False
+
+
+NOT_MODIFIED = _NotModified()
+
+
+class StorageEntry(NamedTuple):
+    """
+    A file or directory found by `StorageBase.walk`.
+    `size` and `mtime` are `None` for directories on S3, and for every entry when
+    `walk` is called with `stat=False`. `meta_version` is a token that changes whenever
+    the file's metadata changes, e.g. the ETag of its metadata object on S3, or `None`
+    where the backend does not know one.
+    """
+
+    path: str
+    size: Optional[int]
+    mtime: Optional[float]
+    is_dir: bool
+    has_metadata: bool
+    meta_version: Optional[str] = None
+
+
+class FileStat(NamedTuple):
+    """
+    The attributes of a file, as returned by `StorageBase.stat`.
+    `version` is the token `read_file_with_version` would return, e.g. the ETag on S3.
+    `content_type` is guessed from the extension where the backend does not store one.
+    """
+
+    path: str
+    size: int
+    mtime: float
+    version: Optional[str]
+    content_type: Optional[str]
+    has_metadata: bool
 
 
 class StorageBase(ABC):
 
+    max_workers: int = 16
+    query_index_path: str = ":memory:"
+    query_refresh_ttl: float = 10.0
+
     @abstractmethod
     def ping() -> dict:
         pass
@@ -27,19 +107,341 @@ class StorageBase(ABC):
         """
         pass
 
-    def read_file(self, file_path: str) -> Tuple[Any, Optional[dict]]:
+    def read_file(
+        self,
+        file_path: str,
+        if_none_match: Optional[str] = None,
+        if_modified_since: Optional[datetime] = None,
+        stream: bool = False,
+    ) -> Union[Tuple[Any, Optional[dict]], _NotModified]:
         """
         Read a file.
         The data will be converted to the appropriate type.
 
         Args:
             file_path (str): The path to the file.
+            if_none_match (Optional[str], optional): Return `NOT_MODIFIED` if the file
+                still has this version token.
+            if_modified_since (Optional[datetime], optional): Return `NOT_MODIFIED` if the
+                file has not been modified since this time.
+            stream (bool, optional): Return a lazy iterator over the rows of a CSV file
+                (or the lines of a text file) instead of loading it. Defaults to False.
 
         Returns:
-            Tuple[Any, Optional[dict]]: The data and, if available, the metadata.
+            Union[Tuple[Any, Optional[dict]], _NotModified]: The data and, if available,
+                the metadata.
         """
         pass
 
+    def read_file_with_version(
+        self,
+        file_path: str,
+        if_none_match: Optional[str] = None,
+        if_modified_since: Optional[datetime] = None,
+    ) -> Union[Tuple[Any, Optional[dict], Optional[str]], _NotModified]:
+        """
+        Read a file along with a version token identifying its current contents.
+        If the file still matches `if_none_match`, or has not changed since
+        `if_modified_since`, `NOT_MODIFIED` is returned without transferring the data.
+
+        Backends without version support return `None` as the token and ignore the
+        conditions.
+
+        Args:
+            file_path (str): The path to the file.
+            if_none_match (Optional[str], optional): A version token from a previous read.
+            if_modified_since (Optional[datetime], optional): Only read the file if it
+                was modified after this time.
+
+        Returns:
+            Union[Tuple[Any, Optional[dict], Optional[str]], _NotModified]: The data, the
+                metadata and the version token, or `NOT_MODIFIED`.
+        """
+        data, meta_data = self.read_file(file_path)
+        return data, meta_data, None
+
+    def exists(self, file_path: str) -> bool:
+        """
+        Check whether a file exists, without reading it.
+
+        Args:
+            file_path (str): The path to the file.
+
+        Returns:
+            bool: Whether the file exists.
+        """
+        try:
+            self.stat(file_path)
+        except LookupError:
+            return False
+        return True
+
+    def stat(self, file_path: str) -> FileStat:
+        """
+        Get the size, modification time, version and content type of a file, and
+        whether it has metadata, without reading it.
+        Backends answer with one lookup of the file; this default lists its directory.
+
+        Args:
+            file_path (str): The path to the file.
+
+        Returns:
+            FileStat: The attributes of the file.
+
+        Raises:
+            NotFoundError: If the file does not exist.
+        """
+        file_path = file_path.strip("/")
+        directory = file_path.rpartition("/")[0]
+        for entry in self.walk(directory, recursive=False):
+            if entry.path == file_path and not entry.is_dir:
+                return FileStat(
+                    file_path,
+                    entry.size,
+                    entry.mtime,
+                    None,
+                    mimetypes.guess_type(file_path)[0],
+                    entry.has_metadata,
+                )
+        raise NotFoundError(file_path)
+
+    def read_meta_data(self, file_path: str) -> Optional[dict]:
+        """
+        Read only the metadata of a file.
+
+        Args:
+            file_path (str): The path to the file.
+
+        Returns:
+            Optional[dict]: The metadata, if available.
+        """
+        return self.read_file(file_path)[1]
+
+    def list_meta_data(self, file_path: str) -> Dict[str, dict]:
+        """
+        Read the metadata of every file directly inside a directory.
+
+        Args:
+            file_path (str): The path to the directory.
+
+        Returns:
+            Dict[str, dict]: File paths mapped to their metadata. Files without
+                metadata are left out.
+        """
+        meta_data = {}
+        for entry in self.walk(file_path, recursive=False, stat=False):
+            if entry.has_metadata:
+                meta_data[entry.path] = self.read_meta_data(entry.path)
+        return meta_data
+
+    def query(
+        self,
+        file_path: str = "",
+        filter: Optional[dict] = None,
+        refresh: Optional[bool] = None,
+    ) -> Dict[str, dict]:
+        """
+        Find files by their metadata, without reading their data.
+        Metadata is kept in a SQLite index at `query_index_path`, which is brought up to
+        date by walking the directory and reading only new or changed metadata. A
+        directory is walked at most once every `query_refresh_ttl` seconds, so changes
+        made since the last walk may not show up until then.
+
+        Args:
+            file_path (str, optional): The path to the directory. Defaults to the root.
+            filter (Optional[dict], optional): Field names mapped to a value, or to a
+                dict of operators and values, e.g. `{"source": "x", "year": {">=": 2020}}`.
+                Defaults to every file with metadata.
+            refresh (Optional[bool], optional): Pass True to walk the directory first
+                regardless of when it was last walked, or False to query the index as
+                it is, which takes milliseconds. Defaults to walking it if the last
+                walk is older than `query_refresh_ttl`.
+
+        Returns:
+            Dict[str, dict]: The paths of the matching files mapped to their metadata.
+        """
+        query_index = self.__dict__.get("_query_index")
+        if query_index is None:
+            from .query import QueryIndex
+
+            query_index = self.__dict__.setdefault(
+                "_query_index", QueryIndex(self.query_index_path)
+            )
+        if refresh is None:
+            query_index.refresh(self, file_path, max_age=self.query_refresh_ttl)
+        elif refresh:
+            query_index.refresh(self, file_path)
+        return query_index.query(file_path, filter)
+
+    def read_range(self, file_path: str, start: int, end: Optional[int] = None) -> bytes:
+        """
+        Read part of a file without fetching the rest of it.
+        The bytes are as stored, so those of a compressed file are still compressed.
+
+        Args:
+            file_path (str): The path to the file.
+            start (int): The offset of the first byte.
+            end (Optional[int], optional): The offset after the last byte. Defaults to
+                the end of the file.
+
+        Returns:
+            bytes: The raw bytes in `[start, end)`, fewer if the file is shorter.
+        """
+        raise NotImplementedError
+
+    def head(self, file_path: str, n_bytes: int) -> bytes:
+        """
+        Read the first `n_bytes` of a file, as stored, like `read_range`.
+
+        Args:
+            file_path (str): The path to the file.
+            n_bytes (int): The number of bytes to read.
+
+        Returns:
+            bytes: The raw bytes, fewer if the file is shorter.
+        """
+        return self.read_range(file_path, 0, n_bytes)
+
+    def read_csv_header(self, file_path: str, n_bytes: int = 64 * 1024) -> List[str]:
+        """
+        Read the column names of a CSV file.
+        Only the start of the file is fetched, doubling the amount read until the whole
+        first row is available.
+
+        Args:
+            file_path (str): The path to the file.
+            n_bytes (int, optional): The number of bytes to fetch first. Defaults to 64 KiB.
+
+        Returns:
+            List[str]: The fields of the first row, or an empty list for an empty file.
+        """
+        compression = getattr(self, "compression", None)
+        while True:
+            data = self.head(file_path, n_bytes)
+            if compression is not None and compression.is_compressed(file_path, data):
+                # Compressed files cannot be cut into ranges, so decompress the start
+                with self.open_read(file_path) as stream:
+                    text = io.TextIOWrapper(stream, encoding="utf-8", newline="")
+                    return next(csv.reader(text), [])
+            end_of_file = len(data) < n_bytes
+            # Hold back a multi-byte character cut off at the end of the range
+            text = codecs.getincrementaldecoder("utf-8")().decode(data, end_of_file)
+
+            reader = csv.reader(io.StringIO(text, newline=""))
+            row = next(reader, [])
+            # A quoted field may contain newlines, so check the row was terminated
+            if end_of_file or text.count("\n") >= reader.line_num:
+                return row
+            n_bytes *= 2
+
+    def open_read(self, file_path: str) -> BinaryIO:
+        """
+        Open a file for reading as a binary stream.
+        The file is fetched in chunks as the stream is read, so it is never held in
+        memory as a whole.
+
+        Args:
+            file_path (str): The path to the file.
+
+        Returns:
+            BinaryIO: A readable stream of the raw file contents.
+        """
+        raise NotImplementedError
+
+    def open_random_access(self, file_path: str) -> BinaryIO:
+        """
+        Open a file for reading as a seekable binary stream that only fetches the ranges
+        that are read.
+
+        Args:
+            file_path (str): The path to the file.
+
+        Returns:
+            BinaryIO: A seekable stream of the raw file contents.
+        """
+        raise NotImplementedError
+
+    def read_table(
+        self,
+        file_path: str,
+        columns: Optional[List[str]] = None,
+        filter: Optional[dict] = None,
+    ) -> Any:
+        """
+        Read a `.parquet` or `.arrow` file as an Arrow table, fetching only the columns
+        and, for Parquet, the row groups that are needed. Use `to_pandas()` on the result
+        for a DataFrame.
+
+        Args:
+            file_path (str): The path to the file.
+            columns (Optional[List[str]], optional): The columns to read. Defaults to all.
+            filter (Optional[dict], optional): The rows to keep, in the form used by
+                `query`, e.g. `{"year": {">=": 2020}}`. Defaults to all.
+
+        Returns:
+            pyarrow.Table: The table.
+        """
+        from . import tabular
+
+        with self.open_random_access(file_path) as source:
+            return tabular.read_table(source, file_path, columns, filter)
+
+    def read_pdf_pages(self, file_path: str, pages: Optional[Iterable[int]] = None) -> list:
+        """
+        Read some pages of a PDF file without parsing the rest of the document.
+        Only the parts of the file the pages need are fetched, when they are used, so
+        the file stays open until the result is closed, e.g. by a `with` block.
+
+        Args:
+            file_path (str): The path to the file.
+            pages (Optional[Iterable[int]], optional): The zero-based page numbers.
+                Defaults to all pages.
+
+        Returns:
+            PdfPages: A list of the `PageObject`s, in the order requested, with a
+                `close` method.
+        """
+        from . import pdf
+
+        source = self.open_random_access(file_path)
+        try:
+            return pdf.read_pages(source, pages)
+        except BaseException:
+            source.close()
+            raise
+
+    def read_pdf_info(self, file_path: str) -> dict:
+        """
+        Read the page count and document information of a PDF file without loading any
+        page.
+
+        Args:
+            file_path (str): The path to the file.
+
+        Returns:
+            dict: `{"pages": int, "metadata": dict}`, e.g. the title and author.
+        """
+        from . import pdf
+
+        with self.open_random_access(file_path) as source:
+            return pdf.read_info(source)
+
+    def open_write(self, file_path: str, meta_data: Optional[dict] = None) -> BinaryIO:
+        """
+        Open a file for writing as a binary stream.
+        The file, and its meta data if provided, is only created once the stream is
+        closed. If the stream is used as a context manager and the block raises, nothing
+        is written.
+
+        Args:
+            file_path (str): The path to the file.
+            meta_data (Optional[dict], optional): The meta data to save. Defaults
+
+        Returns:
+            BinaryIO: A writable stream for the raw file contents.
+        """
+        raise NotImplementedError
+
     def update_file(
         self, file_path: str, data: Any, meta_data: Optional[dict] = None
     ) -> None:
@@ -67,6 +469,77 @@ class StorageBase(ABC):
             None
         """
 
+    def copy_file(self, file_path: str, new_file_path: str) -> None:
+        """
+        Copy a file and its metadata.
+        The raw contents are copied, so the data is never decoded. Backends override
+        this to copy without transferring the data at all.
+
+        Args:
+            file_path (str): The path to the file.
+            new_file_path (str): The path to copy it to.
+
+        Returns:
+            None
+        """
+        meta_data = self.read_meta_data(file_path)
+        with self.open_read(file_path) as source:
+            with self.open_write(new_file_path, meta_data) as target:
+                shutil.copyfileobj(source, target, CHUNK_SIZE)
+
+    def move_file(self, file_path: str, new_file_path: str) -> None:
+        """
+        Move, or rename, a file and its metadata.
+
+        Args:
+            file_path (str): The path to the file.
+            new_file_path (str): The path to move it to.
+
+        Returns:
+            None
+        """
+        self.copy_file(file_path, new_file_path)
+        self.delete_file(file_path)
+
+    def move_directory(self, file_path: str, new_file_path: str) -> None:
+        """
+        Move every file below a directory to another directory, keeping their paths
+        relative to it. Files already in the target directory are kept unless a file
+        with the same path is moved over them.
+        Files are moved in parallel using a pool of `max_workers` threads. A failed file
+        does not stop the others; once all have been tried the first error is raised.
+
+        Args:
+            file_path (str): The path to the directory.
+            new_file_path (str): The path to move it to.
+
+        Returns:
+            None
+        """
+        moves = [
+            (entry.path, new_path)
+            for entry, new_path in self._plan_move(file_path, new_file_path)
+            if not entry.is_dir
+        ]
+        _raise_first(self._map(self.move_file, moves))
+
+    def _check_move(self, file_path: str, new_file_path: str) -> Tuple[str, str]:
+        source, target = file_path.strip("/"), new_file_path.strip("/")
+        if not source:
+            raise ValueError("Cannot move the root directory.")
+        if target == source or target.startswith(f"{source}/"):
+            raise ValueError(f"Cannot move {source} into itself.")
+        return source, target
+
+    def _plan_move(
+        self, file_path: str, new_file_path: str
+    ) -> Iterator[Tuple[StorageEntry, str]]:
+        # Every entry below the directory, with the path it moves to
+        source, target = self._check_move(file_path, new_file_path)
+        for entry in self.walk(source, stat=False):
+            relative_path = entry.path[len(source) + 1 :]
+            yield entry, f"{target}/{relative_path}" if target else relative_path
+
     @abstractmethod
     def list_files_in_directory(file_path: str) -> list:
         pass
@@ -74,3 +547,252 @@ class StorageBase(ABC):
     @abstractmethod
     def list_subdirectories_in_directory(file_path: str) -> list:
         pass
+
+    def iter_files_in_directory(self, file_path: str) -> Iterator[str]:
+        """
+        Lazily list the files directly inside a directory.
+
+        Args:
+            file_path (str): The path to the directory.
+
+        Returns:
+            Iterator[str]: The file names, without extensions.
+        """
+        return iter(self.list_files_in_directory(file_path))
+
+    def iter_subdirectories_in_directory(self, file_path: str) -> Iterator[str]:
+        """
+        Lazily list the directories directly inside a directory.
+
+        Args:
+            file_path (str): The path to the directory.
+
+        Returns:
+            Iterator[str]: The directory names.
+        """
+        return iter(self.list_subdirectories_in_directory(file_path))
+
+    def walk(
+        self, file_path: str = "", recursive: bool = True, stat: bool = True
+    ) -> Iterator[StorageEntry]:
+        """
+        Lazily iterate over the files and directories below a directory.
+        Metadata files and hidden entries are skipped; whether a file has metadata is
+        reported on its entry instead.
+
+        Args:
+            file_path (str, optional): The path to the directory. Defaults to the root.
+            recursive (bool, optional): Descend into subdirectories. Defaults to True.
+            stat (bool, optional): Fill in `size` and `mtime` where this needs an extra
+                system call. Defaults to True.
+
+        Returns:
+            Iterator[StorageEntry]: One entry per file or directory, in no particular order.
+        """
+        raise NotImplementedError
+
+    def create_files(self, items: Iterable[Tuple[str, Any, Optional[dict]]]) -> list:
+        """
+        Save many files in parallel using a pool of `max_workers` threads.
+        A failed item does not stop the others; its result is the exception it raised.
+
+        Args:
+            items (Iterable[Tuple[str, Any, Optional[dict]]]): `(file_path, data, meta_data)` tuples.
+
+        Returns:
+            list: One result per item, in input order. `None` on success.
+        """
+        return self._map(self.create_file, items)
+
+    def read_files(self, file_paths: Iterable[str]) -> list:
+        """
+        Read many files in parallel using a pool of `max_workers` threads.
+        A failed item does not stop the others; its result is the exception it raised.
+
+        Args:
+            file_paths (Iterable[str]): The paths to the files.
+
+        Returns:
+            list: One `(data, meta_data)` tuple per path, in input order.
+        """
+        return self._map(self.read_file, ((path,) for path in file_paths))
+
+    def delete_files(self, file_paths: Iterable[str]) -> list:
+        """
+        Delete many files in parallel using a pool of `max_workers` threads.
+        A failed item does not stop the others; its result is the exception it raised.
+
+        Args:
+            file_paths (Iterable[str]): The paths to the files.
+
+        Returns:
+            list: One result per path, in input order. `None` on success.
+        """
+        return self._map(self.delete_file, ((path,) for path in file_paths))
+
+    def _map(self, func: Callable[..., Any], arguments: Iterable[tuple]) -> list:
+        arguments = [tuple(args) for args in arguments]
+        if not arguments:
+            return []
+
+        def _call(args: tuple) -> Any:
+            try:
+                return func(*args)
+            except Exception as e:
+                return e
+
+        from concurrent.futures import ThreadPoolExecutor
+
+        workers = max(1, min(self.max_workers, len(arguments)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(_call, arguments))
+
+
+class AsyncStorageBase(ABC):
+    """
+    The asyncio counterpart to `StorageBase`.
+    Every CRUD method is a coroutine, and the batch variants fan out over many files
+    with at most `max_concurrency` operations in flight at once.
+    """
+
+    max_concurrency: int = 64
+
+    @abstractmethod
+    async def ping(self) -> dict:
+        pass
+
+    async def create_file(
+        self, file_path: str, data: Any, meta_data: Optional[dict] = None
+    ) -> None:
+        """
+        Save a file.
+        The data must be of a supported type.
+        The meta data, if provided, must be a dictionary.
+
+        Args:
+            file_path (str): The path to the file.
+            data (Any): The data to save.
+            meta_data (Optional[dict], optional): The meta data to save. Defaults
+
+        Returns:
+            None
+        """
+        pass
+
+    async def read_file(self, file_path: str) -> Tuple[Any, Optional[dict]]:
+        """
+        Read a file.
+        The data will be converted to the appropriate type.
+
+        Args:
+            file_path (str): The path to the file.
+
+        Returns:
+            Tuple[Any, Optional[dict]]: The data and, if available, the metadata.
+        """
+        pass
+
+    async def update_file(
+        self, file_path: str, data: Any, meta_data: Optional[dict] = None
+    ) -> None:
+        """
+        Update a file and its metadata.
+
+        Args:
+            file_path (str): The path to the file.
+            data (Any): The data to save.
+
+        Returns:
+            None
+        """
+        pass
+
+    async def delete_file(self, file_path: str) -> None:
+        """
+        Delete a file.
+
+        Args:
+            file_path (str): The path to the file.
+
+        Returns:
+            None
+        """
+
+    @abstractmethod
+    async def list_files_in_directory(self, file_path: str) -> list:
+        pass
+
+    @abstractmethod
+    async def list_subdirectories_in_directory(self, file_path: str) -> list:
+        pass
+
+    async def create_files(
+        self,
+        items: Iterable[Tuple[str, Any, Optional[dict]]],
+        return_exceptions: bool = False,
+    ) -> List[Any]:
+        """
+        Save many files concurrently.
+
+        Args:
+            items (Iterable[Tuple[str, Any, Optional[dict]]]): `(file_path, data, meta_data)` tuples.
+            return_exceptions (bool, optional): As in `asyncio.gather`. Defaults to False.
+
+        Returns:
+            List[Any]: One result per item, in input order.
+        """
+        return await self._gather(self.create_file, items, return_exceptions)
+
+    async def read_files(
+        self, file_paths: Iterable[str], return_exceptions: bool = False
+    ) -> List[Any]:
+        """
+        Read many files concurrently.
+
+        Args:
+            file_paths (Iterable[str]): The paths to the files.
+            return_exceptions (bool, optional): As in `asyncio.gather`. Defaults to False.
+
+        Returns:
+            List[Any]: One `(data, meta_data)` tuple per path, in input order.
+        """
+        return await self._gather(
+            self.read_file, ((path,) for path in file_paths), return_exceptions
+        )
+
+    async def delete_files(
+        self, file_paths: Iterable[str], return_exceptions: bool = False
+    ) -> List[Any]:
+        """
+        Delete many files concurrently.
+
+        Args:
+            file_paths (Iterable[str]): The paths to the files.
+            return_exceptions (bool, optional): As in `asyncio.gather`. Defaults to False.
+
+        Returns:
+            List[Any]: One result per path, in input order.
+        """
+        return await self._gather(
+            self.delete_file, ((path,) for path in file_paths), return_exceptions
+        )
+
+    async def _gather(
+        self,
+        func: Callable[..., Awaitable[Any]],
+        arguments: Iterable[tuple],
+        return_exceptions: bool,
+    ) -> List[Any]:
+        import asyncio
+
+        # The semaphore is created per call so it is bound to the running loop
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def _run(args: tuple) -> Any:
+            async with semaphore:
+                return await func(*args)
+
+        return await asyncio.gather(
+            *(_run(tuple(args)) for args in arguments),
+            return_exceptions=return_exceptions,
+        )
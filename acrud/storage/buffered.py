@@ -0,0 +1,467 @@
+import atexit
+import threading
+import time
+import weakref
+from collections import OrderedDict, namedtuple
+from datetime import datetime
+from typing import Any, BinaryIO, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from .base import FileStat, StorageBase, StorageEntry, _NotModified
+from . import utils
+
+BufferInfo = namedtuple("BufferInfo", ["pending", "written", "coalesced", "failed"])
+
+DEFAULT_BUFFER_MAX_PENDING = 1000
+DEFAULT_BUFFER_BATCH_SIZE = 100
+DEFAULT_BUFFER_LINGER = 0.0
+
+# Pending operations. A file deleted and then created again before either is written
+# is replaced, i.e. deleted and then created, so it does not keep its old metadata.
+# A file created and then deleted may never have reached the backend, so a missing
+# file is not an error when that delete is written.
+_CREATE = "create"
+_DELETE = "delete"
+_REPLACE = "replace"
+
+# Buffers not yet closed, flushed when the interpreter exits. The set holds weak
+# references, so a buffer dropped without being closed can still be collected.
+_open_buffers = weakref.WeakSet()
+
+
+@atexit.register
+def _close_open_buffers() -> None:
+    for buffer in list(_open_buffers):
+        buffer.close()
+
+
+class BufferedStorage(StorageBase):
+    """
+    A write-behind buffer around any `StorageBase`.
+
+    `create_file`, `update_file` and `delete_file` queue the operation and return at
+    once. A background thread takes up to `batch_size` queued operations at a time and
+    hands them to the backend's batch methods, `create_files` and `delete_files`, which
+    run them on the backend's worker pool. Operations queued while a batch is written
+    are committed together in the next one.
+
+    A file written again before its turn is only written once, with the latest data.
+    At most `max_pending` operations are queued; further writes wait for room.
+    Reads of a file with a queued operation wait for it, so a caller always reads its
+    own writes. `flush` waits until everything queued before it is written and raises
+    the first error since the last flush.
+    """
+
+    def __init__(
+        self,
+        storage: StorageBase,
+        max_pending: int = DEFAULT_BUFFER_MAX_PENDING,
+        batch_size: int = DEFAULT_BUFFER_BATCH_SIZE,
+        linger: float = DEFAULT_BUFFER_LINGER,
+    ) -> None:
+        self.storage = storage
+        self.max_pending = max(1, max_pending)
+        self.batch_size = max(1, batch_size)
+        self.linger = linger
+        self.max_workers = storage.max_workers
+
+        # file_path -> (sequence number, operation, data, meta_data, whether the first
+        # queued operation was a create), oldest first
+        self._pending = OrderedDict()
+        # file_path -> sequence number of the operations being written
+        self._in_flight: Dict[str, int] = {}
+        self._sequence = 0
+        self._errors: List[Exception] = []
+        self._written = 0
+        self._coalesced = 0
+        self._failed = 0
+        self._closed = False
+        self._thread = None
+        self._worker_error: Optional[BaseException] = None
+        self._condition = threading.Condition()
+        _open_buffers.add(self)
+
+    @classmethod
+    def from_config(cls, storage: StorageBase, config) -> "BufferedStorage":
+        return cls(
+            storage,
+            max_pending=utils.get_config_option(
+                config, "BUFFER_MAX_PENDING", DEFAULT_BUFFER_MAX_PENDING, int
+            ),
+            batch_size=utils.get_config_option(
+                config, "BUFFER_BATCH_SIZE", DEFAULT_BUFFER_BATCH_SIZE, int
+            ),
+            linger=utils.get_config_option(
+                config, "BUFFER_LINGER", DEFAULT_BUFFER_LINGER, float
+            ),
+        )
+
+    def __getattr__(self, name: str) -> Any:
+        # Expose backend specific attributes, e.g. `root_dir` or `client`
+        if name == "storage":
+            raise AttributeError(name)
+        return getattr(self.storage, name)
+
+    def __enter__(self) -> "BufferedStorage":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def ping(self) -> dict:
+        return self.storage.ping()
+
+    def create_file(
+        self, file_path: str, data: Any, meta_data: Optional[dict] = None
+    ) -> None:
+        """
+        Queue a file to be saved.
+        The data is saved as it is when the write runs, so it must not be changed
+        afterwards.
+
+        Args:
+            file_path (str): The path to the file.
+            data (Any): The data to save.
+            meta_data (Optional[dict], optional): The meta data to save. Defaults
+
+        Returns:
+            None
+        """
+        self._enqueue(file_path, _CREATE, data, meta_data)
+
+    def update_file(
+        self, file_path: str, data: Any, meta_data: Optional[dict] = None
+    ) -> None:
+        self._enqueue(file_path, _CREATE, data, meta_data)
+
+    def delete_file(self, file_path: str) -> None:
+        """
+        Queue a file to be deleted.
+        A delete that fails, e.g. because the file does not exist, is reported by `flush`.
+
+        Args:
+            file_path (str): The path to the file.
+
+        Returns:
+            None
+        """
+        self._enqueue(file_path, _DELETE, None, None)
+
+    def create_files(self, items: Iterable[Tuple[str, Any, Optional[dict]]]) -> list:
+        results = []
+        for file_path, data, meta_data in items:
+            self._enqueue(file_path, _CREATE, data, meta_data)
+            results.append(None)
+        return results
+
+    def delete_files(self, file_paths: Iterable[str]) -> list:
+        results = []
+        for file_path in file_paths:
+            self._enqueue(file_path, _DELETE, None, None)
+            results.append(None)
+        return results
+
+    def read_file(
+        self,
+        file_path: str,
+        if_none_match: Optional[str] = None,
+        if_modified_since: Optional[datetime] = None,
+        stream: bool = False,
+    ) -> Union[Tuple[Any, Optional[dict]], _NotModified]:
+        self._wait_for(file_path)
+        return self.storage.read_file(
+            file_path, if_none_match, if_modified_since, stream=stream
+        )
+
+    def read_file_with_version(
+        self,
+        file_path: str,
+        if_none_match: Optional[str] = None,
+        if_modified_since: Optional[datetime] = None,
+    ) -> Union[Tuple[Any, Optional[dict], Optional[str]], _NotModified]:
+        self._wait_for(file_path)
+        return self.storage.read_file_with_version(
+            file_path, if_none_match, if_modified_since
+        )
+
+    def read_meta_data(self, file_path: str) -> Optional[dict]:
+        self._wait_for(file_path)
+        return self.storage.read_meta_data(file_path)
+
+    def exists(self, file_path: str) -> bool:
+        self._wait_for(file_path)
+        return self.storage.exists(file_path)
+
+    def stat(self, file_path: str) -> FileStat:
+        self._wait_for(file_path)
+        return self.storage.stat(file_path)
+
+    def read_range(self, file_path: str, start: int, end: Optional[int] = None) -> bytes:
+        self._wait_for(file_path)
+        return self.storage.read_range(file_path, start, end)
+
+    def open_read(self, file_path: str) -> BinaryIO:
+        self._wait_for(file_path)
+        return self.storage.open_read(file_path)
+
+    def open_random_access(self, file_path: str) -> BinaryIO:
+        self._wait_for(file_path)
+        return self.storage.open_random_access(file_path)
+
+    def read_table(
+        self,
+        file_path: str,
+        columns: Optional[List[str]] = None,
+        filter: Optional[dict] = None,
+    ) -> Any:
+        self._wait_for(file_path)
+        return self.storage.read_table(file_path, columns, filter)
+
+    def open_write(self, file_path: str, meta_data: Optional[dict] = None) -> BinaryIO:
+        # Streams write straight to the backend, after any queued write of the file
+        self._wait_for(file_path)
+        return self.storage.open_write(file_path, meta_data)
+
+    def copy_file(self, file_path: str, new_file_path: str) -> None:
+        self._wait_for(file_path)
+        self._wait_for(new_file_path)
+        self.storage.copy_file(file_path, new_file_path)
+
+    def move_file(self, file_path: str, new_file_path: str) -> None:
+        self._wait_for(file_path)
+        self._wait_for(new_file_path)
+        self.storage.move_file(file_path, new_file_path)
+
+    def move_directory(self, file_path: str, new_file_path: str) -> None:
+        self._drain()
+        self.storage.move_directory(file_path, new_file_path)
+
+    def list_meta_data(self, file_path: str) -> Dict[str, dict]:
+        self._drain()
+        return self.storage.list_meta_data(file_path)
+
+    def query(
+        self,
+        file_path: str = "",
+        filter: Optional[dict] = None,
+        refresh: Optional[bool] = None,
+    ) -> Dict[str, dict]:
+        self._drain()
+        return self.storage.query(file_path, filter, refresh)
+
+    def list_files_in_directory(self, file_path: str) -> list:
+        self._drain()
+        return self.storage.list_files_in_directory(file_path)
+
+    def list_subdirectories_in_directory(self, file_path: str) -> list:
+        self._drain()
+        return self.storage.list_subdirectories_in_directory(file_path)
+
+    def iter_files_in_directory(self, file_path: str) -> Iterator[str]:
+        self._drain()
+        return self.storage.iter_files_in_directory(file_path)
+
+    def iter_subdirectories_in_directory(self, file_path: str) -> Iterator[str]:
+        self._drain()
+        return self.storage.iter_subdirectories_in_directory(file_path)
+
+    def walk(
+        self, file_path: str = "", recursive: bool = True, stat: bool = True
+    ) -> Iterator[StorageEntry]:
+        self._drain()
+        return self.storage.walk(file_path, recursive, stat)
+
+    def flush(self) -> None:
+        """
+        Wait until every operation queued before this call has been written.
+        Files are as durable as the backend makes them, e.g. acknowledged by S3.
+
+        Returns:
+            None
+
+        Raises:
+            Exception: The first error raised by a write since the last flush. The
+                other writes are still made.
+        """
+        self._drain()
+        with self._condition:
+            errors, self._errors = self._errors, []
+        if errors:
+            raise errors[0]
+
+    def close(self) -> None:
+        """
+        Flush the queued operations and stop the background thread. Further writes
+        raise an error.
+
+        Returns:
+            None
+        """
+        with self._condition:
+            if self._closed:
+                return
+            self._closed = True
+            self._condition.notify_all()
+            thread = self._thread
+        _open_buffers.discard(self)
+        if thread is not None:
+            # The thread writes everything queued before it exits
+            thread.join()
+        self.flush()
+
+    def buffer_info(self) -> BufferInfo:
+        """
+        Report buffer statistics, in the style of `functools.lru_cache`.
+
+        Returns:
+            BufferInfo: The operations queued or being written, those written, those
+                replaced by a later write of the same file, and those that failed.
+        """
+        with self._condition:
+            return BufferInfo(
+                len(self._pending) + len(self._in_flight),
+                self._written,
+                self._coalesced,
+                self._failed,
+            )
+
+    def _enqueue(
+        self, file_path: str, operation: str, data: Any, meta_data: Optional[dict]
+    ) -> None:
+        with self._condition:
+            if self._closed:
+                raise ValueError("The buffered storage is closed.")
+            # Replacing a queued operation takes no room, anything else may wait
+            while (
+                file_path not in self._pending
+                and len(self._pending) >= self.max_pending
+            ):
+                self._check_worker()
+                self._condition.wait()
+            self._check_worker()
+
+            previous = self._pending.pop(file_path, None)
+            created_first = operation != _DELETE
+            if previous is not None:
+                created_first = previous[4]
+                if operation == _CREATE and previous[1] != _CREATE:
+                    operation = _REPLACE
+                if operation != _DELETE and previous[1] != _DELETE and meta_data is None:
+                    # The file keeps the metadata the replaced write would have saved
+                    meta_data = previous[3]
+                self._coalesced += 1
+            self._sequence += 1
+            self._pending[file_path] = (
+                self._sequence,
+                operation,
+                data,
+                meta_data,
+                created_first,
+            )
+
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+            self._condition.notify_all()
+
+    def _run(self) -> None:
+        try:
+            self._process()
+        except BaseException as e:
+            # Callers waiting for the queue would otherwise wait forever
+            with self._condition:
+                self._worker_error = e
+                self._condition.notify_all()
+            raise
+
+    def _process(self) -> None:
+        while True:
+            with self._condition:
+                if not self._pending:
+                    # The thread stops when the queue is empty, so it does not keep an
+                    # idle buffer alive. The next write starts a new one.
+                    self._thread = None
+                    return
+                # Give a burst of writes the chance to share a batch
+                deadline = time.monotonic() + self.linger
+                while len(self._pending) < self.batch_size and not self._closed:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                batch = []
+                while self._pending and len(batch) < self.batch_size:
+                    file_path, (sequence, *operation) = self._pending.popitem(
+                        last=False
+                    )
+                    self._in_flight[file_path] = sequence
+                    # (file_path, operation, data, meta_data, created_first)
+                    batch.append((file_path, *operation))
+                # Writers waiting for room can go on
+                self._condition.notify_all()
+
+            self._write(batch)
+
+    def _write(self, batch: list) -> None:
+        deletes = [(path, created) for path, op, _, _, created in batch if op != _CREATE]
+        creates = [
+            (path, data, meta) for path, op, data, meta, _ in batch if op != _DELETE
+        ]
+
+        # Deletes go first, so replaced files are deleted before they are created
+        results = []
+        if deletes:
+            deleted = self._call(self.storage.delete_files, [path for path, _ in deletes])
+            results.extend(
+                None if created and isinstance(result, LookupError) else result
+                for (_, created), result in zip(deletes, deleted)
+            )
+        if creates:
+            results.extend(self._call(self.storage.create_files, creates))
+
+        with self._condition:
+            for result in results:
+                if isinstance(result, Exception):
+                    self._errors.append(result)
+                    self._failed += 1
+                else:
+                    self._written += 1
+            for file_path, *_ in batch:
+                del self._in_flight[file_path]
+            self._condition.notify_all()
+
+    def _call(self, method, arguments: list) -> list:
+        try:
+            return method(arguments)
+        except Exception as e:
+            return [e] * len(arguments)
+
+    def _wait_for(self, file_path: str) -> None:
+        # Wait until the queued operations of a file have been written
+        with self._condition:
+            while file_path in self._pending or file_path in self._in_flight:
+                self._check_worker()
+                self._condition.wait()
+
+    def _drain(self) -> None:
+        # Wait until everything queued so far has been written
+        with self._condition:
+            target = self._sequence
+            while self._oldest() <= target:
+                self._check_worker()
+                self._condition.wait()
+
+    def _check_worker(self) -> None:
+        # Called with the condition held. Queued operations are never written once the
+        # background thread has died.
+        if self._worker_error is not None:
+            raise RuntimeError(
+                "The background thread of the buffered storage stopped."
+            ) from self._worker_error
+
+    def _oldest(self) -> float:
+        # The sequence number of the oldest operation not yet written. Rewriting a
+        # file moves it to the back of the queue, so the queue is in sequence order.
+        oldest = min(self._in_flight.values(), default=float("inf"))
+        if self._pending:
+            oldest = min(oldest, next(iter(self._pending.values()))[0])
+        return oldest
@@ -0,0 +1,382 @@
+import sys
+import time
+import threading
+from collections import OrderedDict, namedtuple
+from datetime import datetime
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional, Set, Tuple, Union
+
+from .base import NOT_MODIFIED, FileStat, StorageBase, StorageEntry, _NotModified
+from . import utils
+
+CacheInfo = namedtuple("CacheInfo", ["hits", "misses", "maxsize", "currsize"])
+
+DEFAULT_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+
+_SCALARS = (str, bytes, bytearray, int, float, complex, bool, type(None))
+
+
+def _sizeof(obj: Any) -> Optional[int]:
+    """
+    Approximate the memory used by a decoded object made of builtin containers and
+    scalars, walking the containers recursively.
+    Returns `None` for any other object, e.g. a table or an array, whose
+    `sys.getsizeof` need not include the buffers it holds.
+    """
+    if isinstance(obj, _SCALARS):
+        return sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        items = [item for pair in obj.items() for item in pair]
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        items = obj
+    else:
+        return None
+
+    size = sys.getsizeof(obj)
+    for item in items:
+        item_size = _sizeof(item)
+        if item_size is None:
+            return None
+        size += item_size
+    return size
+
+
+class CachedStorage(StorageBase):
+    """
+    A read-through cache around any `StorageBase`.
+
+    Decoded `(data, meta_data)` tuples are kept in memory up to `max_bytes`, evicting
+    the least recently used entries first, and optionally expire after `ttl` seconds.
+    Expired entries are revalidated against the backend's version token.
+    Writes and deletes made through this instance invalidate the affected entry.
+
+    Cached values are shared between callers, so they must be treated as read-only.
+    """
+
+    def __init__(
+        self,
+        storage: StorageBase,
+        max_bytes: int = DEFAULT_CACHE_MAX_BYTES,
+        ttl: Optional[float] = None,
+    ) -> None:
+        self.storage = storage
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.max_workers = storage.max_workers
+
+        # file_path -> ((data, meta_data), size, expiry time, version token)
+        self._entries = OrderedDict()
+        self._size = 0
+        self._hits = 0
+        self._misses = 0
+        self._lock = threading.Lock()
+
+        # Reads in flight, and keys written while such a read was in flight. A read
+        # that overlaps a write must not store its (possibly stale) result.
+        self._in_flight: Dict[str, int] = {}
+        self._stale: Set[str] = set()
+
+    @classmethod
+    def from_config(cls, storage: StorageBase, config) -> "CachedStorage":
+        return cls(
+            storage,
+            max_bytes=utils.get_config_option(
+                config, "CACHE_MAX_BYTES", DEFAULT_CACHE_MAX_BYTES, int
+            ),
+            ttl=utils.get_config_option(config, "CACHE_TTL", None, float),
+        )
+
+    def __getattr__(self, name: str) -> Any:
+        # Expose backend specific attributes, e.g. `root_dir` or `client`
+        if name == "storage":
+            raise AttributeError(name)
+        return getattr(self.storage, name)
+
+    def ping(self) -> dict:
+        return self.storage.ping()
+
+    def create_file(
+        self, file_path: str, data: Any, meta_data: Optional[dict] = None
+    ) -> None:
+        try:
+            self.storage.create_file(file_path, data, meta_data)
+        finally:
+            self.invalidate(file_path)
+
+    def read_file(
+        self,
+        file_path: str,
+        if_none_match: Optional[str] = None,
+        if_modified_since: Optional[datetime] = None,
+        stream: bool = False,
+    ) -> Union[Tuple[Any, Optional[dict]], _NotModified]:
+        """
+        Read a file, serving it from the cache when possible.
+        Once an entry's TTL has passed it is revalidated with a conditional read, so an
+        unchanged file is not transferred again. Its metadata is read again either way.
+        Conditional and streaming reads made by the caller bypass the cache.
+
+        Args:
+            file_path (str): The path to the file.
+
+        Returns:
+            Union[Tuple[Any, Optional[dict]], _NotModified]: The data and, if available,
+                the metadata.
+        """
+        if if_none_match is not None or if_modified_since is not None or stream:
+            return self.storage.read_file(
+                file_path, if_none_match, if_modified_since, stream=stream
+            )
+        return self._read(file_path)[:2]
+
+    def read_file_with_version(
+        self,
+        file_path: str,
+        if_none_match: Optional[str] = None,
+        if_modified_since: Optional[datetime] = None,
+    ) -> Union[Tuple[Any, Optional[dict], Optional[str]], _NotModified]:
+        """
+        Read a file along with the backend's version token, serving both from the cache
+        when possible. `NOT_MODIFIED` is returned if the cached version matches
+        `if_none_match`. Reads conditional on `if_modified_since` bypass the cache.
+
+        Args:
+            file_path (str): The path to the file.
+            if_none_match (Optional[str], optional): A version token from a previous read.
+            if_modified_since (Optional[datetime], optional): Only read the file if it
+                was modified after this time.
+
+        Returns:
+            Union[Tuple[Any, Optional[dict], Optional[str]], _NotModified]: The data, the
+                metadata and the version token, or `NOT_MODIFIED`.
+        """
+        if if_modified_since is not None:
+            return self.storage.read_file_with_version(
+                file_path, if_none_match, if_modified_since
+            )
+        result = self._read(file_path)
+        if if_none_match is not None and result[2] == if_none_match:
+            return NOT_MODIFIED
+        return result
+
+    def _read(self, file_path: str) -> Tuple[Any, Optional[dict], Optional[str]]:
+        with self._lock:
+            entry = self._entries.get(file_path)
+            if entry is not None:
+                value, _, expires, version = entry
+                if expires >= time.monotonic():
+                    self._entries.move_to_end(file_path)
+                    self._hits += 1
+                    return (*value, version)
+                self._remove(file_path)
+            self._misses += 1
+            self._in_flight[file_path] = self._in_flight.get(file_path, 0) + 1
+
+        result = None
+        size = None
+        try:
+            if entry is not None and entry[3] is not None:
+                # The entry has expired, ask the backend whether it changed
+                result = self.storage.read_file_with_version(
+                    file_path, if_none_match=entry[3]
+                )
+                if result is NOT_MODIFIED:
+                    # The metadata can change without the data, so it is read again
+                    meta_data = self.storage.read_meta_data(file_path)
+                    result = (entry[0][0], meta_data, entry[3])
+            else:
+                result = self.storage.read_file_with_version(file_path)
+            size = self._entry_size(file_path, result[0], result[1])
+        finally:
+            with self._lock:
+                self._in_flight[file_path] -= 1
+                stale = file_path in self._stale
+                if self._in_flight[file_path] == 0:
+                    del self._in_flight[file_path]
+                    self._stale.discard(file_path)
+                if size is not None and not stale:
+                    self._insert(file_path, result[:2], result[2], size)
+
+        return result
+
+    def exists(self, file_path: str) -> bool:
+        return self.storage.exists(file_path)
+
+    def stat(self, file_path: str) -> FileStat:
+        return self.storage.stat(file_path)
+
+    def read_meta_data(self, file_path: str) -> Optional[dict]:
+        return self.storage.read_meta_data(file_path)
+
+    def list_meta_data(self, file_path: str) -> Dict[str, dict]:
+        return self.storage.list_meta_data(file_path)
+
+    def query(
+        self,
+        file_path: str = "",
+        filter: Optional[dict] = None,
+        refresh: Optional[bool] = None,
+    ) -> Dict[str, dict]:
+        return self.storage.query(file_path, filter, refresh)
+
+    def read_range(self, file_path: str, start: int, end: Optional[int] = None) -> bytes:
+        return self.storage.read_range(file_path, start, end)
+
+    def open_random_access(self, file_path: str) -> BinaryIO:
+        return self.storage.open_random_access(file_path)
+
+    def read_table(
+        self,
+        file_path: str,
+        columns: Optional[List[str]] = None,
+        filter: Optional[dict] = None,
+    ) -> Any:
+        return self.storage.read_table(file_path, columns, filter)
+
+    def open_read(self, file_path: str) -> BinaryIO:
+        return self.storage.open_read(file_path)
+
+    def open_write(self, file_path: str, meta_data: Optional[dict] = None) -> BinaryIO:
+        stream = self.storage.open_write(file_path, meta_data)
+        stream.add_commit_callback(lambda: self.invalidate(file_path))
+        return stream
+
+    def update_file(
+        self, file_path: str, data: Any, meta_data: Optional[dict] = None
+    ) -> None:
+        try:
+            self.storage.update_file(file_path, data, meta_data)
+        finally:
+            self.invalidate(file_path)
+
+    def delete_file(self, file_path: str) -> None:
+        try:
+            self.storage.delete_file(file_path)
+        finally:
+            self.invalidate(file_path)
+
+    def copy_file(self, file_path: str, new_file_path: str) -> None:
+        try:
+            self.storage.copy_file(file_path, new_file_path)
+        finally:
+            self.invalidate(new_file_path)
+
+    def move_file(self, file_path: str, new_file_path: str) -> None:
+        try:
+            self.storage.move_file(file_path, new_file_path)
+        finally:
+            self.invalidate(file_path)
+            self.invalidate(new_file_path)
+
+    def move_directory(self, file_path: str, new_file_path: str) -> None:
+        try:
+            self.storage.move_directory(file_path, new_file_path)
+        finally:
+            self.invalidate_directory(file_path)
+            self.invalidate_directory(new_file_path)
+
+    def list_files_in_directory(self, file_path: str) -> list:
+        return self.storage.list_files_in_directory(file_path)
+
+    def list_subdirectories_in_directory(self, file_path: str) -> list:
+        return self.storage.list_subdirectories_in_directory(file_path)
+
+    def iter_files_in_directory(self, file_path: str) -> Iterator[str]:
+        return self.storage.iter_files_in_directory(file_path)
+
+    def iter_subdirectories_in_directory(self, file_path: str) -> Iterator[str]:
+        return self.storage.iter_subdirectories_in_directory(file_path)
+
+    def walk(
+        self, file_path: str = "", recursive: bool = True, stat: bool = True
+    ) -> Iterator[StorageEntry]:
+        return self.storage.walk(file_path, recursive, stat)
+
+    def invalidate(self, file_path: str) -> None:
+        """
+        Drop a file from the cache.
+
+        Args:
+            file_path (str): The path to the file.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            self._remove(file_path)
+            if file_path in self._in_flight:
+                self._stale.add(file_path)
+
+    def invalidate_directory(self, file_path: str) -> None:
+        """
+        Drop every file below a directory from the cache.
+
+        Args:
+            file_path (str): The path to the directory.
+
+        Returns:
+            None
+        """
+        prefix = f"{file_path.strip('/')}/"
+        with self._lock:
+            for path in [path for path in self._entries if path.startswith(prefix)]:
+                self._remove(path)
+            self._stale.update(path for path in self._in_flight if path.startswith(prefix))
+
+    def cache_info(self) -> CacheInfo:
+        """
+        Report cache statistics, in the style of `functools.lru_cache`.
+
+        Returns:
+            CacheInfo: The hit and miss counters, the byte budget and the bytes in use.
+        """
+        with self._lock:
+            return CacheInfo(self._hits, self._misses, self.max_bytes, self._size)
+
+    def cache_clear(self) -> None:
+        """
+        Empty the cache and reset the statistics.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+            self._hits = 0
+            self._misses = 0
+
+    def _entry_size(
+        self, file_path: str, data: Any, meta_data: Optional[dict]
+    ) -> Optional[int]:
+        # Other objects are charged the size of the stored file instead, which is only
+        # known from a `stat`. If that fails the file is not cached.
+        size = _sizeof(data)
+        if size is None:
+            try:
+                size = self.storage.stat(file_path).size
+            except Exception:
+                return None
+        return size + (_sizeof(meta_data) or 0)
+
+    def _insert(
+        self,
+        file_path: str,
+        value: Tuple[Any, Optional[dict]],
+        version: Optional[str],
+        size: int,
+    ) -> None:
+        if size > self.max_bytes:
+            return
+
+        self._remove(file_path)
+        expires = time.monotonic() + self.ttl if self.ttl is not None else float("inf")
+        self._entries[file_path] = (value, size, expires, version)
+        self._size += size
+
+        # Evict least recently used entries until we are within budget
+        while self._size > self.max_bytes:
+            _, (_, evicted_size, _, _) = self._entries.popitem(last=False)
+            self._size -= evicted_size
+
+    def _remove(self, file_path: str) -> None:
+        entry = self._entries.pop(file_path, None)
+        if entry is not None:
+            self._size -= entry[1]
@@ -0,0 +1,416 @@
+import threading
+from collections import namedtuple
+from datetime import datetime
+from typing import (
+    Any,
+    BinaryIO,
+    Callable,
+    Dict,
+    Hashable,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
+
+from .base import (
+    AsyncStorageBase,
+    FileStat,
+    StorageBase,
+    StorageEntry,
+    _NotModified,
+)
+
+CoalesceInfo = namedtuple("CoalesceInfo", ["calls", "coalesced", "in_flight"])
+
+
+class _Call:
+    """
+    A read in flight, which the threads that asked for the same read wait on.
+    """
+
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class CoalescingStorage(StorageBase):
+    """
+    Collapses concurrent reads of the same file into one call to the backend.
+
+    The first thread to read a file makes the call; threads that ask for the same read
+    while it is in flight wait for it and receive its result, or its exception, instead
+    of downloading and decoding the file again. Results are shared between callers, so
+    they must be treated as read-only.
+
+    A write, delete or move through this instance detaches the reads in flight for the
+    affected files, so reads that start after it see the change.
+    """
+
+    def __init__(self, storage: StorageBase) -> None:
+        self.storage = storage
+        self.max_workers = storage.max_workers
+
+        # (method, file_path, conditions) -> the call in flight
+        self._calls: Dict[Tuple, _Call] = {}
+        self._count = 0
+        self._coalesced = 0
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name: str) -> Any:
+        # Expose backend specific attributes, e.g. `root_dir` or `client`
+        if name == "storage":
+            raise AttributeError(name)
+        return getattr(self.storage, name)
+
+    def ping(self) -> dict:
+        return self.storage.ping()
+
+    def create_file(
+        self, file_path: str, data: Any, meta_data: Optional[dict] = None
+    ) -> None:
+        try:
+            self.storage.create_file(file_path, data, meta_data)
+        finally:
+            self.forget(file_path)
+
+    def read_file(
+        self,
+        file_path: str,
+        if_none_match: Optional[str] = None,
+        if_modified_since: Optional[datetime] = None,
+        stream: bool = False,
+    ) -> Union[Tuple[Any, Optional[dict]], _NotModified]:
+        """
+        Read a file, sharing the call with concurrent reads of the same file.
+        Streaming reads return a stream per caller, so they are not coalesced.
+
+        Args:
+            file_path (str): The path to the file.
+
+        Returns:
+            Union[Tuple[Any, Optional[dict]], _NotModified]: The data and, if available,
+                the metadata.
+        """
+        if stream:
+            return self.storage.read_file(file_path, stream=True)
+        return self._coalesce(
+            ("read_file", file_path, if_none_match, if_modified_since),
+            self.storage.read_file,
+            file_path,
+            if_none_match,
+            if_modified_since,
+        )
+
+    def read_file_with_version(
+        self,
+        file_path: str,
+        if_none_match: Optional[str] = None,
+        if_modified_since: Optional[datetime] = None,
+    ) -> Union[Tuple[Any, Optional[dict], Optional[str]], _NotModified]:
+        return self._coalesce(
+            ("read_file_with_version", file_path, if_none_match, if_modified_since),
+            self.storage.read_file_with_version,
+            file_path,
+            if_none_match,
+            if_modified_since,
+        )
+
+    def read_meta_data(self, file_path: str) -> Optional[dict]:
+        return self._coalesce(
+            ("read_meta_data", file_path), self.storage.read_meta_data, file_path
+        )
+
+    def exists(self, file_path: str) -> bool:
+        return self._coalesce(("exists", file_path), self.storage.exists, file_path)
+
+    def stat(self, file_path: str) -> FileStat:
+        return self._coalesce(("stat", file_path), self.storage.stat, file_path)
+
+    def list_meta_data(self, file_path: str) -> Dict[str, dict]:
+        return self.storage.list_meta_data(file_path)
+
+    def query(
+        self,
+        file_path: str = "",
+        filter: Optional[dict] = None,
+        refresh: Optional[bool] = None,
+    ) -> Dict[str, dict]:
+        return self.storage.query(file_path, filter, refresh)
+
+    def read_range(self, file_path: str, start: int, end: Optional[int] = None) -> bytes:
+        return self.storage.read_range(file_path, start, end)
+
+    def open_random_access(self, file_path: str) -> BinaryIO:
+        return self.storage.open_random_access(file_path)
+
+    def read_table(
+        self,
+        file_path: str,
+        columns: Optional[List[str]] = None,
+        filter: Optional[dict] = None,
+    ) -> Any:
+        return self.storage.read_table(file_path, columns, filter)
+
+    def open_read(self, file_path: str) -> BinaryIO:
+        return self.storage.open_read(file_path)
+
+    def open_write(self, file_path: str, meta_data: Optional[dict] = None) -> BinaryIO:
+        stream = self.storage.open_write(file_path, meta_data)
+        stream.add_commit_callback(lambda: self.forget(file_path))
+        return stream
+
+    def update_file(
+        self, file_path: str, data: Any, meta_data: Optional[dict] = None
+    ) -> None:
+        try:
+            self.storage.update_file(file_path, data, meta_data)
+        finally:
+            self.forget(file_path)
+
+    def delete_file(self, file_path: str) -> None:
+        try:
+            self.storage.delete_file(file_path)
+        finally:
+            self.forget(file_path)
+
+    def delete_files(self, file_paths: Iterable[str]) -> list:
+        # Keep the backend's batching, e.g. S3 multi-object deletes
+        file_paths = list(file_paths)
+        try:
+            return self.storage.delete_files(file_paths)
+        finally:
+            for file_path in file_paths:
+                self.forget(file_path)
+
+    def copy_file(self, file_path: str, new_file_path: str) -> None:
+        try:
+            self.storage.copy_file(file_path, new_file_path)
+        finally:
+            self.forget(new_file_path)
+
+    def move_file(self, file_path: str, new_file_path: str) -> None:
+        try:
+            self.storage.move_file(file_path, new_file_path)
+        finally:
+            self.forget(file_path)
+            self.forget(new_file_path)
+
+    def move_directory(self, file_path: str, new_file_path: str) -> None:
+        try:
+            self.storage.move_directory(file_path, new_file_path)
+        finally:
+            self.forget_directory(file_path)
+            self.forget_directory(new_file_path)
+
+    def list_files_in_directory(self, file_path: str) -> list:
+        return self.storage.list_files_in_directory(file_path)
+
+    def list_subdirectories_in_directory(self, file_path: str) -> list:
+        return self.storage.list_subdirectories_in_directory(file_path)
+
+    def iter_files_in_directory(self, file_path: str) -> Iterator[str]:
+        return self.storage.iter_files_in_directory(file_path)
+
+    def iter_subdirectories_in_directory(self, file_path: str) -> Iterator[str]:
+        return self.storage.iter_subdirectories_in_directory(file_path)
+
+    def walk(
+        self, file_path: str = "", recursive: bool = True, stat: bool = True
+    ) -> Iterator[StorageEntry]:
+        return self.storage.walk(file_path, recursive, stat)
+
+    def forget(self, file_path: str) -> None:
+        """
+        Stop sharing the reads of a file that are in flight, so later reads call the
+        backend again. Callers already waiting still get their result.
+
+        Args:
+            file_path (str): The path to the file.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            for key in [key for key in self._calls if key[1] == file_path]:
+                del self._calls[key]
+
+    def forget_directory(self, file_path: str) -> None:
+        """
+        Stop sharing the reads in flight of every file below a directory.
+
+        Args:
+            file_path (str): The path to the directory.
+
+        Returns:
+            None
+        """
+        prefix = f"{file_path.strip('/')}/"
+        with self._lock:
+            for key in [key for key in self._calls if key[1].startswith(prefix)]:
+                del self._calls[key]
+
+    def coalesce_info(self) -> CoalesceInfo:
+        """
+        Report how many reads were collapsed.
+
+        Returns:
+            CoalesceInfo: The calls made to the backend, the reads that shared one of
+                them instead, and the calls in flight.
+        """
+        with self._lock:
+            return CoalesceInfo(self._count, self._coalesced, len(self._calls))
+
+    def _coalesce(self, key: Hashable, func: Callable[..., Any], *args: Any) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self._count += 1
+            else:
+                self._coalesced += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func(*args)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                # Unless a write has detached it already
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+            call.done.set()
+        return call.result
+
+
+class AsyncCoalescingStorage(AsyncStorageBase):
+    """
+    The asyncio counterpart to `CoalescingStorage`.
+    Concurrent reads of the same file await one task. A caller that is cancelled does
+    not cancel the task the others are waiting for.
+    """
+
+    def __init__(self, storage: AsyncStorageBase) -> None:
+        self.storage = storage
+        self.max_concurrency = storage.max_concurrency
+
+        # (method, file_path) -> the task in flight. Only touched from the event loop.
+        self._tasks: Dict[Tuple, Any] = {}
+        self._count = 0
+        self._coalesced = 0
+
+    def __getattr__(self, name: str) -> Any:
+        if name == "storage":
+            raise AttributeError(name)
+        return getattr(self.storage, name)
+
+    async def __aenter__(self) -> "AsyncCoalescingStorage":
+        if hasattr(self.storage, "__aenter__"):
+            await self.storage.__aenter__()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        if hasattr(self.storage, "__aexit__"):
+            await self.storage.__aexit__(*exc_info)
+
+    async def ping(self) -> dict:
+        return await self.storage.ping()
+
+    async def create_file(
+        self, file_path: str, data: Any, meta_data: Optional[dict] = None
+    ) -> None:
+        try:
+            await self.storage.create_file(file_path, data, meta_data)
+        finally:
+            self.forget(file_path)
+
+    async def read_file(self, file_path: str) -> Tuple[Any, Optional[dict]]:
+        """
+        Read a file, sharing the call with concurrent reads of the same file.
+
+        Args:
+            file_path (str): The path to the file.
+
+        Returns:
+            Tuple[Any, Optional[dict]]: The data and, if available, the metadata.
+        """
+        return await self._coalesce(
+            ("read_file", file_path), self.storage.read_file, file_path
+        )
+
+    async def update_file(
+        self, file_path: str, data: Any, meta_data: Optional[dict] = None
+    ) -> None:
+        try:
+            await self.storage.update_file(file_path, data, meta_data)
+        finally:
+            self.forget(file_path)
+
+    async def delete_file(self, file_path: str) -> None:
+        try:
+            await self.storage.delete_file(file_path)
+        finally:
+            self.forget(file_path)
+
+    async def list_files_in_directory(self, file_path: str) -> list:
+        return await self.storage.list_files_in_directory(file_path)
+
+    async def list_subdirectories_in_directory(self, file_path: str) -> list:
+        return await self.storage.list_subdirectories_in_directory(file_path)
+
+    def forget(self, file_path: str) -> None:
+        """
+        Stop sharing the reads of a file that are in flight.
+
+        Args:
+            file_path (str): The path to the file.
+
+        Returns:
+            None
+        """
+        for key in [key for key in self._tasks if key[1] == file_path]:
+            del self._tasks[key]
+
+    def coalesce_info(self) -> CoalesceInfo:
+        """
+        Report how many reads were collapsed.
+
+        Returns:
+            CoalesceInfo: The calls made to the backend, the reads that shared one of
+                them instead, and the calls in flight.
+        """
+        return CoalesceInfo(self._count, self._coalesced, len(self._tasks))
+
+    async def _coalesce(self, key: Hashable, func: Callable[..., Any], *args: Any) -> Any:
+        import asyncio
+
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func(*args))
+            self._tasks[key] = task
+            self._count += 1
+
+            def _done(task: "asyncio.Future") -> None:
+                if self._tasks.get(key) is task:
+                    del self._tasks[key]
+                # Mark the exception as retrieved if every caller was cancelled
+                if not task.cancelled():
+                    task.exception()
+
+            task.add_done_callback(_done)
+        else:
+            self._coalesced += 1
+        return await asyncio.shield(task)
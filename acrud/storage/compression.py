@@ -0,0 +1,317 @@
+import io
+import zlib
+from typing import BinaryIO, Iterable, Optional
+
+from .stream import CHUNK_SIZE, RawStreamWriter
+from . import utils
+
+# Imported by `_require` when a format is first used
+zstandard = None
+lz4_frame = None
+
+# Each format starts with a fixed magic number, which is how reads detect it
+MAGIC_NUMBERS = {
+    "zstd": b"\x28\xb5\x2f\xfd",
+    "gzip": b"\x1f\x8b",
+    "lz4": b"\x04\x22\x4d\x18",
+}
+
+DEFAULT_DICTIONARY_SIZE = 110 * 1024
+
+# Columnar files and PDFs compress their own contents and are read in ranges, and
+# packs hold files compressed one by one
+SKIP_EXTENSIONS = (".parquet", ".arrow", ".pdf", ".pack")
+
+
+def _require(method: str) -> None:
+    global zstandard, lz4_frame
+
+    if method not in MAGIC_NUMBERS:
+        raise ValueError(f"Unsupported compression: {method}")
+    try:
+        if method == "zstd" and zstandard is None:
+            package = "zstandard"
+            import zstandard
+        elif method == "lz4" and lz4_frame is None:
+            package = "lz4"
+            import lz4.frame as lz4_frame
+    except ImportError as e:
+        raise ImportError(
+            f"{method} compression requires {package}. "
+            f"Install it with `pip install {package}`."
+        ) from e
+
+
+def detect(data) -> Optional[str]:
+    """
+    Detect the compression of a file from its first bytes.
+
+    Args:
+        data: The start of the file, at least 4 bytes unless the file is shorter.
+
+    Returns:
+        Optional[str]: "zstd", "gzip" or "lz4", or `None` if the data is not compressed.
+    """
+    with memoryview(data) as view:
+        start = bytes(view[:4])
+    for method, magic in MAGIC_NUMBERS.items():
+        if start.startswith(magic):
+            return method
+    return None
+
+
+def train_dictionary(
+    samples: Iterable[bytes], dictionary_size: int = DEFAULT_DICTIONARY_SIZE
+) -> bytes:
+    """
+    Train a zstd dictionary on sample files.
+    Small files of the same shape, e.g. JSON records, compress several times better
+    with a dictionary. Save the result and point `COMPRESSION_DICTIONARY` at it.
+
+    Args:
+        samples (Iterable[bytes]): The raw contents of typical files.
+        dictionary_size (int, optional): The maximum dictionary size. Defaults to 110 KiB.
+
+    Returns:
+        bytes: The dictionary.
+    """
+    _require("zstd")
+    return zstandard.train_dictionary(dictionary_size, list(samples)).as_bytes()
+
+
+class Compression:
+    """
+    Compresses file contents after they are encoded and decompresses them before they
+    are decoded.
+
+    Files are compressed with `method` if their extension is in `extensions` (all
+    extensions when `None`) and they are at least `min_size` bytes. Reads decompress
+    the files whose type the settings apply to, detecting the format from its magic
+    number, so such files written with any method or level, or uncompressed, can be
+    read. Other files are returned as stored, even if they happen to start with a
+    magic number, e.g. a `.gz` archive.
+    """
+
+    def __init__(
+        self,
+        method: Optional[str] = None,
+        level: Optional[int] = None,
+        extensions: Optional[Iterable[str]] = None,
+        min_size: int = 0,
+        dictionary: Optional[bytes] = None,
+    ) -> None:
+        if method is not None:
+            _require(method)
+        self.method = method
+        self.level = level
+        self.extensions = (
+            None if extensions is None else {extension.lower() for extension in extensions}
+        )
+        self.min_size = min_size
+
+        self._dictionary = None
+        if dictionary is not None:
+            _require("zstd")
+            self._dictionary = zstandard.ZstdCompressionDict(dictionary)
+
+    @classmethod
+    def from_config(cls, config) -> "Compression":
+        """
+        Create the compression settings described by a `StorageConfig`.
+
+        Args:
+            config (StorageConfig): The storage configuration.
+
+        Returns:
+            Compression: The compression settings.
+        """
+        method = utils.get_config_option(config, "COMPRESSION", None, str.lower)
+        if method == "none":
+            method = None
+
+        extensions = utils.get_config_option(config, "COMPRESSION_EXTENSIONS")
+        if extensions is not None:
+            extensions = [
+                extension.strip().lstrip(".")
+                for extension in extensions.split(",")
+                if extension.strip()
+            ]
+
+        dictionary = None
+        dictionary_path = utils.get_config_option(config, "COMPRESSION_DICTIONARY")
+        if dictionary_path is not None:
+            with open(dictionary_path, "rb") as f:
+                dictionary = f.read()
+
+        return cls(
+            method=method,
+            level=utils.get_config_option(config, "COMPRESSION_LEVEL", None, int),
+            extensions=extensions,
+            min_size=utils.get_config_option(config, "COMPRESSION_MIN_SIZE", 0, int),
+            dictionary=dictionary,
+        )
+
+    def applies_to(self, file_path: str, size: Optional[int] = None) -> bool:
+        """
+        Whether a file would be compressed. `size` is `None` for streamed writes.
+        """
+        file_path = file_path.lower()
+        if self.method is None or file_path.endswith(SKIP_EXTENSIONS):
+            return False
+        if self.extensions is not None and file_path.split(".")[-1] not in self.extensions:
+            return False
+        return size is None or size >= self.min_size
+
+    def compress(self, file_path: str, data) -> bytes:
+        """
+        Compress the encoded contents of a file, if the settings apply to it.
+        """
+        if not self.applies_to(file_path, len(data)):
+            return data
+        compressor = self._compressor()
+        return compressor.compress(data) + compressor.flush()
+
+    def is_compressed(self, file_path: str, data) -> bool:
+        """
+        Whether a file was written compressed, judging by its first bytes.
+        """
+        return self.applies_to(file_path) and detect(data) is not None
+
+    def decompress(self, file_path: str, data):
+        """
+        Decompress the contents of a file, if they are compressed.
+        """
+        method = detect(data) if self.applies_to(file_path) else None
+        if method is None:
+            return data
+        _require(method)
+        if method == "gzip":
+            # wbits=31 reads the gzip header and trailer
+            decompressor = zlib.decompressobj(31)
+            return decompressor.decompress(data) + decompressor.flush()
+        if method == "lz4":
+            return lz4_frame.decompress(data)
+        decompressor = zstandard.ZstdDecompressor(dict_data=self._dictionary)
+        # Streamed frames do not record their size, which one-shot decompression needs
+        return decompressor.decompressobj().decompress(data)
+
+    def wrap_writer(self, file_path: str, raw: RawStreamWriter) -> RawStreamWriter:
+        """
+        Compress a streamed write, if the settings apply to the file.
+        """
+        if not self.applies_to(file_path):
+            return raw
+        return CompressingWriter(raw, self._compressor())
+
+    def wrap_reader(self, file_path: str, stream: BinaryIO) -> BinaryIO:
+        """
+        Decompress a streamed read, if the file is compressed.
+        """
+        if not self.applies_to(file_path):
+            return stream
+        method = detect(stream.peek(4))
+        if method is None:
+            return stream
+        _require(method)
+        return io.BufferedReader(
+            DecompressingReader(stream, self._decompressor(method)),
+            buffer_size=CHUNK_SIZE,
+        )
+
+    def _compressor(self):
+        if self.method == "gzip":
+            level = zlib.Z_DEFAULT_COMPRESSION if self.level is None else self.level
+            return zlib.compressobj(level, zlib.DEFLATED, 31)
+        if self.method == "lz4":
+            return _LZ4Compressor(0 if self.level is None else self.level)
+        return zstandard.ZstdCompressor(
+            level=3 if self.level is None else self.level, dict_data=self._dictionary
+        ).compressobj()
+
+    def _decompressor(self, method: str):
+        if method == "gzip":
+            return zlib.decompressobj(31)
+        if method == "lz4":
+            return lz4_frame.LZ4FrameDecompressor()
+        return zstandard.ZstdDecompressor(dict_data=self._dictionary).decompressobj()
+
+
+class _LZ4Compressor:
+    # Gives lz4 frames the same compress/flush interface as zlib and zstandard
+
+    def __init__(self, level: int) -> None:
+        self._compressor = lz4_frame.LZ4FrameCompressor(compression_level=level)
+        self._header = self._compressor.begin()
+
+    def compress(self, data) -> bytes:
+        header, self._header = self._header, b""
+        return header + self._compressor.compress(data)
+
+    def flush(self) -> bytes:
+        header, self._header = self._header, b""
+        return header + self._compressor.flush()
+
+
+class CompressingWriter(RawStreamWriter):
+    """
+    Compresses everything written before passing it on to another `RawStreamWriter`,
+    which is committed or discarded along with this one.
+    """
+
+    def __init__(self, raw: RawStreamWriter, compressor) -> None:
+        super().__init__()
+        self.raw = raw
+        self._compressor = compressor
+
+    def write(self, b) -> int:
+        self._write_all(self._compressor.compress(b))
+        return len(b)
+
+    def _write_all(self, data: bytes) -> None:
+        view = memoryview(data)
+        while view:
+            view = view[self.raw.write(view) :]
+
+    def commit(self) -> None:
+        self._write_all(self._compressor.flush())
+        self.raw.close()
+
+    def discard(self) -> None:
+        self.raw.abort()
+        self.raw.close()
+
+
+class DecompressingReader(io.RawIOBase):
+    """
+    A raw stream of the decompressed contents of another binary stream.
+    """
+
+    def __init__(self, stream: BinaryIO, decompressor) -> None:
+        super().__init__()
+        self._stream = stream
+        self._decompressor = decompressor
+        self._buffer = bytearray()
+        self._eof = False
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        while not self._buffer and not self._eof:
+            chunk = self._stream.read(CHUNK_SIZE)
+            if chunk:
+                self._buffer += self._decompressor.decompress(chunk)
+            else:
+                self._eof = True
+                if hasattr(self._decompressor, "flush"):
+                    self._buffer += self._decompressor.flush()
+
+        n = min(len(b), len(self._buffer))
+        b[:n] = self._buffer[:n]
+        del self._buffer[:n]
+        return n
+
+    def close(self) -> None:
+        if not self.closed:
+            self._stream.close()
+        super().close()
@@ -1,101 +1,347 @@
 # standard imports
-from typing import Type
+from typing import Any, Callable, Dict, NamedTuple, Type, Union
 from io import BytesIO
-
-# package imports
-from multimethod import multidispatch
+import math
+import mmap
+import pickle
+import struct
+import types
 
 # local imports
 from ..settings import (
     SUPPORTS_CSV,
     SUPPORTS_JSON,
+    SUPPORTS_MSGPACK,
     SUPPORTS_PICKLE,
     SUPPORTS_PDF,
+    SUPPORTS_TABULAR,
+    JSON_CODEC,
+    PICKLE_PROTOCOL,
 )
+from . import utils
 
-# Conditional imports dependent on supported file types
-if SUPPORTS_PDF:
-    from PyPDF2 import PdfReader, PdfWriter
+# Conditional imports dependent on supported file types. Codecs that are slow to
+# import, e.g. PyPDF2 and dill, are imported when a file of their type is first used
 if SUPPORTS_JSON:
     import json
-if SUPPORTS_PICKLE:
-    import dill
+
+    orjson = None
+    if JSON_CODEC == "orjson":
+        try:
+            import orjson
+        except ImportError:  # Fall back to the standard library
+            pass
+if SUPPORTS_MSGPACK:
+    msgpack = None
+
+# Raw file contents may arrive as bytes, a preallocated buffer or a memory map
+Buffer = Union[bytes, bytearray, memoryview, mmap.mmap]
+
+
+class Codec(NamedTuple):
+    """
+    Turns the data of one file type into bytes and back.
+    """
+
+    encode: Callable[[Any], bytes]
+    decode: Callable[[Buffer], Any]
+
+
+# File extensions mapped to their codec, see `register_codec`
+CODECS: Dict[str, Codec] = {}
+
+
+def register_codec(
+    extension: str, encode: Callable[[Any], bytes], decode: Callable[[Buffer], Any]
+) -> None:
+    """
+    Register the codec used to save and read files with an extension.
+    Extensions without a codec fall back to `convert` and `get_type`.
+
+    Args:
+        extension (str): The file extension, e.g. "json".
+        encode (Callable[[Any], bytes]): Turns data into bytes.
+        decode (Callable[[Buffer], Any]): Turns bytes, or any buffer, back into data.
+
+    Returns:
+        None
+    """
+    CODECS[extension.lstrip(".").lower()] = Codec(encode, decode)
+
+
+def encode(file_path: str, data: Any) -> bytes:
+    """
+    Encode data for a file, using the codec registered for its extension.
+    """
+    codec = CODECS.get(utils.get_extension(file_path))
+    if codec is None:
+        return _get_convert()(data, bytes)
+    return codec.encode(data)
+
+
+def decode(file_path: str, data: Buffer) -> Any:
+    """
+    Decode the contents of a file, using the codec registered for its extension.
+    """
+    codec = CODECS.get(utils.get_extension(file_path))
+    if codec is None:
+        return _get_convert()(data, get_type(file_path))
+    return codec.decode(data)
+
+
+# File extensions mapped to the type their contents decode to
+FILE_TYPES: Dict[str, Type] = {
+    "txt": str,
+    "csv": str,
+    "json": dict,
+    "pkl": object,
+    "msgpack": object,
+}
 
 
 def get_type(file_path: str) -> Type:
     """
     Get the type of the file based on the file extension.
     """
-    file_type = file_path.split(".")[-1]
-    match file_type:
-        case "txt":
-            return str
-        case "csv":
-            return str
-        case "json":
-            return dict
-        case "pkl":
-            return object
-        case "pdf":
-            return PdfReader
-
-
-@multidispatch
-def convert(data, return_type):
-    raise NotImplementedError(
-        f"Automatic conversion from {data.__class__} to {return_type} is not yet supported."
+    file_type = utils.get_extension(file_path)
+    if SUPPORTS_PDF and file_type == "pdf":
+        from PyPDF2 import PdfReader
+
+        return PdfReader
+    return FILE_TYPES.get(file_type)
+
+
+def references_buffer(file_path: str) -> bool:
+    """
+    Whether the data decoded from a file keeps reading from the buffer it came from.
+    Such buffers, e.g. a memory map, must stay open for the lifetime of the data.
+    """
+    file_type = utils.get_extension(file_path)
+    return (SUPPORTS_PDF and file_type == "pdf") or (
+        SUPPORTS_TABULAR and file_type == "arrow"
     )
 
 
 if SUPPORTS_CSV:
 
-    # Conversion to bytes
-    @convert.register
-    def _(data: str, return_type: Type[bytes]):
-        # Convert CSV (string) to bytes
-        return data.encode("utf-8")
+    def _text_dumps(data: Any) -> bytes:
+        if isinstance(data, str):
+            return data.encode("utf-8")
+        return _get_convert()(data, bytes)
 
-    # Conversion from bytes
-    @convert.register
-    def _(data: bytes, return_type: Type[str]):
-        # Convert bytes to CSV (string)
-        return data.decode("utf-8")
+    def _text_loads(data: Buffer) -> str:
+        return str(data, "utf-8")
+
+    register_codec("txt", _text_dumps, _text_loads)
+    register_codec("csv", _text_dumps, _text_loads)
 
 
 if SUPPORTS_JSON:
 
-    @convert.register
-    def _(data: dict, return_type: Type[bytes]):
-        # Convert JSON (dict) to bytes
+    def _has_non_finite(data: Any) -> bool:
+        # Whether any float in the data is NaN or infinite
+        if isinstance(data, float):
+            return not math.isfinite(data)
+        if isinstance(data, dict):
+            return any(_has_non_finite(value) for value in data.values())
+        if isinstance(data, (list, tuple)):
+            return any(_has_non_finite(item) for item in data)
+        return False
+
+    def _json_dumps(data: Any) -> bytes:
+        if isinstance(data, str):
+            # Already serialised
+            return data.encode("utf-8")
+        if orjson is not None:
+            try:
+                encoded = orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)
+            except TypeError:
+                # e.g. integers wider than 64 bits, which only the standard library handles
+                pass
+            else:
+                # orjson writes NaN and infinities as null, the standard library keeps
+                # them. Only output with a null can hold one, so most data is not walked.
+                if b"null" not in encoded or not _has_non_finite(data):
+                    return encoded
         return json.dumps(data).encode("utf-8")
 
-    @convert.register
-    def _(data: bytes, return_type: Type[dict]):
-        # Convert bytes to JSON (dict)
-        return json.loads(data.decode("utf-8"))
+    def _json_loads(data: Buffer) -> Any:
+        if orjson is not None:
+            try:
+                with memoryview(data) as view:
+                    return orjson.loads(view)
+            except orjson.JSONDecodeError:
+                # NaN and Infinity, which only the standard library reads
+                pass
+        return json.loads(str(data, "utf-8"))
+
+    register_codec("json", _json_dumps, _json_loads)
+
+    def encode_meta_data(meta_data: dict) -> bytes:
+        """
+        Encode the metadata of a file, which is always stored as JSON.
+        """
+        return _json_dumps(meta_data)
+
+    def decode_meta_data(data: Buffer) -> dict:
+        """
+        Decode the metadata of a file.
+        """
+        return _json_loads(data)
+
+
+if SUPPORTS_MSGPACK:
+
+    def _require_msgpack() -> None:
+        global msgpack
+
+        if msgpack is None:
+            try:
+                import msgpack
+            except ImportError as e:
+                raise ImportError(
+                    "Reading and writing .msgpack files requires msgpack. "
+                    "Install it with `pip install msgpack`."
+                ) from e
+
+    def _msgpack_dumps(data: Any) -> bytes:
+        _require_msgpack()
+        return msgpack.packb(data, use_bin_type=True)
+
+    def _msgpack_loads(data: Buffer) -> Any:
+        _require_msgpack()
+        with memoryview(data) as view:
+            return msgpack.unpackb(view, raw=False)
+
+    register_codec("msgpack", _msgpack_dumps, _msgpack_loads)
 
 
 if SUPPORTS_PICKLE:
 
-    @convert.register
-    def _(data: bytes, return_type: Type[object]):
-        # Pickle is already in bytes, return as is
-        return data
+    # Pickles with out-of-band buffers are framed as the magic, the buffer count, the
+    # pickle length and each buffer length, then the pickle and the raw buffers. Such
+    # files can only be read with `decode`, not with a plain `pickle.load`.
+    PICKLE_MAGIC = b"ACRUDPK5"
+    _COUNT = struct.Struct("<I")
+    _LENGTH = struct.Struct("<Q")
+
+    class _DefinedInMain(Exception):
+        pass
+
+    class _Pickler(pickle.Pickler):
+        # pickle stores classes and functions by reference, and those of `__main__`
+        # only exist in the process that wrote them, so they are left to dill, which
+        # stores them by value
+        def reducer_override(self, obj: Any) -> Any:
+            if (
+                isinstance(obj, (type, types.FunctionType))
+                and getattr(obj, "__module__", None) == "__main__"
+            ):
+                raise _DefinedInMain
+            return NotImplemented
+
+    def _pickle_dumps(data: Any) -> bytes:
+        buffers = []
+        try:
+            stream = BytesIO()
+            _Pickler(
+                stream,
+                protocol=PICKLE_PROTOCOL,
+                buffer_callback=buffers.append if PICKLE_PROTOCOL >= 5 else None,
+            ).dump(data)
+            payload = stream.getvalue()
+            raw_buffers = [buffer.raw() for buffer in buffers]
+        except (
+            pickle.PicklingError,
+            AttributeError,
+            TypeError,
+            BufferError,
+            _DefinedInMain,
+        ):
+            # Lambdas, closures, classes defined in `__main__` and the like need dill
+            import dill
 
-    @convert.register
-    def _(data: object, return_type: Type[bytes]):
-        # Convert object to bytes using pickle
-        buffer = BytesIO()
-        dill.dump(data, buffer)
-        buffer.seek(0)
-        return buffer.getvalue()
+            return dill.dumps(data)
+
+        if not raw_buffers:
+            return payload
+
+        # Large buffers, e.g. numpy arrays, are copied once here rather than into the
+        # pickle stream and again out of it
+        header = [PICKLE_MAGIC, _COUNT.pack(len(raw_buffers)), _LENGTH.pack(len(payload))]
+        header.extend(_LENGTH.pack(buffer.nbytes) for buffer in raw_buffers)
+        return b"".join([*header, payload, *raw_buffers])
+
+    def _pickle_loads(data: Buffer) -> Any:
+        with memoryview(data) as view:
+            if view[: len(PICKLE_MAGIC)] != PICKLE_MAGIC:
+                # A plain pickle, possibly written by dill, whose unpickler reads both
+                import dill
+
+                return dill.loads(view)
+
+            offset = len(PICKLE_MAGIC)
+            (count,) = _COUNT.unpack_from(view, offset)
+            offset += _COUNT.size
+            lengths = [
+                _LENGTH.unpack_from(view, offset + i * _LENGTH.size)[0]
+                for i in range(count + 1)
+            ]
+            offset += (count + 1) * _LENGTH.size
+
+            payload = view[offset : offset + lengths[0]]
+            offset += lengths[0]
+            buffers = []
+            for length in lengths[1:]:
+                buffer = view[offset : offset + length]
+                # Read-only sources such as memory maps are copied, so the objects stay
+                # writable and the source can be closed
+                buffers.append(bytearray(buffer) if view.readonly else buffer)
+                offset += length
+            return pickle.loads(payload, buffers=buffers)
+
+    register_codec("pkl", _pickle_dumps, _pickle_loads)
+
+
+if SUPPORTS_TABULAR:
+
+    # pyarrow is slow to import, so it is only loaded once a table is read or written
+
+    def _encode_parquet(data: Any) -> bytes:
+        from . import tabular
+
+        return tabular.encode_parquet(data)
+
+    def _decode_parquet(data: Buffer) -> Any:
+        from . import tabular
+
+        return tabular.decode_parquet(data)
+
+    def _encode_arrow(data: Any) -> bytes:
+        from . import tabular
+
+        return tabular.encode_arrow(data)
+
+    def _decode_arrow(data: Buffer) -> Any:
+        from . import tabular
+
+        return tabular.decode_arrow(data)
+
+    register_codec("parquet", _encode_parquet, _decode_parquet)
+    register_codec("arrow", _encode_arrow, _decode_arrow)
 
 
 if SUPPORTS_PDF:
 
-    @convert.register
-    def _(data, return_type: Type[bytes]):
-        # Convert PdfReader to bytes
+    def _pdf_dumps(data: "PdfReader") -> bytes:
+        from PyPDF2 import PdfWriter
+
+        from . import pdf
+
+        # An unchanged document is saved as it was read
+        if pdf.is_unmodified(data):
+            return pdf.source_bytes(data)
+
         output_buffer = BytesIO()
         pdf_writer = PdfWriter()
 
@@ -112,8 +358,95 @@ if SUPPORTS_PDF:
         output_buffer.seek(0)
         return output_buffer.getvalue()
 
-    @convert.register
-    def _(data: bytes, return_type: Type[PdfReader]):
-        # Convert bytes to PdfReader
+    def _pdf_loads(data: Buffer) -> "PdfReader":
+        from PyPDF2 import PdfReader
+
+        # A memory map is already a seekable stream
+        if isinstance(data, mmap.mmap):
+            return PdfReader(data)
         buffer = BytesIO(data)
         return PdfReader(buffer)
+
+    register_codec("pdf", _pdf_dumps, _pdf_loads)
+
+
+_convert = None
+
+
+def _get_convert() -> Callable[[Any, Type], Any]:
+    global _convert
+
+    # multimethod, and PyPDF2 for its overloads, are only imported once `convert` is
+    # used. A race builds it twice, which is harmless.
+    if _convert is None:
+        _convert = _build_convert()
+    return _convert
+
+
+def __getattr__(name: str) -> Any:
+    if name == "convert":
+        return _get_convert()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def _build_convert() -> Callable[[Any, Type], Any]:
+    from multimethod import multidispatch
+
+    @multidispatch
+    def convert(data, return_type):
+        raise NotImplementedError(
+            f"Automatic conversion from {data.__class__} to {return_type} is not yet supported."
+        )
+
+    if SUPPORTS_CSV:
+
+        # Conversion to bytes
+        @convert.register
+        def _(data: str, return_type: Type[bytes]):
+            # Convert CSV (string) to bytes
+            return data.encode("utf-8")
+
+        # Conversion from bytes
+        @convert.register
+        def _(data: Buffer, return_type: Type[str]):
+            # Convert bytes to CSV (string)
+            return str(data, "utf-8")
+
+    if SUPPORTS_JSON:
+
+        @convert.register
+        def _(data: dict, return_type: Type[bytes]):
+            # Convert JSON (dict) to bytes
+            return _json_dumps(data)
+
+        @convert.register
+        def _(data: Buffer, return_type: Type[dict]):
+            # Convert bytes to JSON (dict)
+            return _json_loads(data)
+
+    if SUPPORTS_PICKLE:
+
+        @convert.register
+        def _(data: Buffer, return_type: Type[object]):
+            # Convert bytes to an object
+            return _pickle_loads(data)
+
+        @convert.register
+        def _(data: object, return_type: Type[bytes]):
+            # Convert object to bytes using pickle
+            return _pickle_dumps(data)
+
+    if SUPPORTS_PDF:
+        from PyPDF2 import PdfReader
+
+        @convert.register
+        def _(data: PdfReader, return_type: Type[bytes]):
+            # Convert PdfReader to bytes
+            return _pdf_dumps(data)
+
+        @convert.register
+        def _(data: Buffer, return_type: Type[PdfReader]):
+            # Convert bytes to PdfReader
+            return _pdf_loads(data)
+
+    return convert
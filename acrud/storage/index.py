@@ -0,0 +1,306 @@
+import hashlib
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from .base import NOT_MODIFIED
+from .convert import decode_meta_data, encode_meta_data
+
+# Hidden, so listings and `walk` skip it
+INDEX_FILE_NAME = ".acrud_index.json"
+
+# How many times a conflicting update is retried before giving up
+MAX_UPDATE_ATTEMPTS = 10
+
+# How long a cached manifest is used before it is revalidated, in seconds
+DEFAULT_TTL = 1.0
+
+
+def split_file_path(file_path: str, file_name: str = INDEX_FILE_NAME) -> Tuple[str, str]:
+    """
+    Split a file path into the path of its directory's index and its name in the index.
+    """
+    directory, _, name = file_path.rpartition("/")
+    index_path = f"{directory}/{file_name}" if directory else file_name
+    return index_path, name
+
+
+def meta_data_version(meta_data: Optional[dict]) -> Optional[str]:
+    """
+    A version token for metadata held in a manifest, which has no version of its own.
+    """
+    if meta_data is None:
+        return None
+    return hashlib.sha1(encode_meta_data(meta_data)).hexdigest()
+
+
+class _QueuedUpdate:
+    """
+    A change to a manifest, waiting for the thread writing it.
+    """
+
+    def __init__(self, mutate: Callable[[dict], Optional[bool]]) -> None:
+        self.mutate = mutate
+        self.done = threading.Event()
+        self.error: Optional[BaseException] = None
+
+
+class IndexConflictError(Exception):
+    """
+    Raised when an index could not be updated because of concurrent writers.
+    """
+
+
+class MetadataIndex:
+    """
+    A per-directory manifest mapping file names to their metadata.
+
+    Each directory's manifest is a single JSON file, so one lookup resolves the metadata
+    of every file in it. Manifests are cached in memory and revalidated against the
+    backend's version token at most once every `ttl` seconds, so changes made by other
+    processes can take that long to show up.
+
+    Updates are optimistic: the manifest is re-read, modified and stored only if its
+    version has not changed in the meantime, and retried otherwise. Every update
+    rewrites the whole manifest, so its cost grows with the number of files in the
+    directory. Updates of the same manifest made concurrently, e.g. by the threads of
+    `create_files`, are batched: while one thread writes the manifest, the others queue
+    their changes, and the next write applies all of them at once. The backend provides
+    the two primitives:
+
+    - `load(index_path, version)` returns `NOT_MODIFIED` if the manifest still has
+      `version`, otherwise `(data, version)`, with `(None, None)` if it does not exist.
+    - `store(index_path, data, expected_version)` writes the manifest only if its current
+      version is `expected_version` (`None` meaning it must not exist yet), returning the
+      new version, or `None` on a conflict.
+
+    `seed(index_path)`, if given, returns the metadata a directory already has, e.g. in
+    metadata files written before the index was enabled. A directory's manifest starts
+    from it when it is first created, so enabling the index loses no metadata.
+
+    `file_name` names the manifests, so other per-directory manifests, e.g. those of
+    `PackedStorage`, can be kept the same way.
+    """
+
+    def __init__(
+        self,
+        load: Callable[[str, Optional[str]], object],
+        store: Callable[[str, bytes, Optional[str]], Optional[str]],
+        ttl: float = DEFAULT_TTL,
+        file_name: str = INDEX_FILE_NAME,
+        seed: Optional[Callable[[str], Dict[str, dict]]] = None,
+    ) -> None:
+        self._load = load
+        self._store = store
+        self._seed = seed
+        self.ttl = ttl
+        self.file_name = file_name
+
+        # index_path -> (files or None if there is no manifest, version, checked at)
+        self._cache = {}
+        # index_path -> updates queued while a thread is writing that manifest
+        self._queued: Dict[str, List[_QueuedUpdate]] = {}
+        self._lock = threading.Lock()
+
+    def lookup(self, file_path: str) -> Tuple[bool, Optional[dict]]:
+        """
+        Look up the metadata of a file.
+
+        Args:
+            file_path (str): The path to the file.
+
+        Returns:
+            Tuple[bool, Optional[dict]]: Whether the directory has a manifest, and the
+                metadata of the file if it has any.
+        """
+        index_path, name = split_file_path(file_path, self.file_name)
+        files = self._get(index_path)
+        if files is None:
+            return False, None
+        return True, files.get(name)
+
+    def get_directory(self, directory: str) -> Optional[Dict[str, dict]]:
+        """
+        Get the metadata of every file in a directory.
+
+        Args:
+            directory (str): The path to the directory.
+
+        Returns:
+            Optional[Dict[str, dict]]: File names mapped to metadata, or `None` if the
+                directory has no manifest.
+        """
+        index_path, _ = split_file_path(f"{directory.rstrip('/')}/", self.file_name)
+        files = self._get(index_path)
+        return None if files is None else dict(files)
+
+    def set(self, file_path: str, meta_data: dict) -> None:
+        index_path, name = split_file_path(file_path, self.file_name)
+
+        def _set(files: dict) -> None:
+            files[name] = meta_data
+
+        self._update(index_path, _set)
+
+    def remove(self, file_path: str) -> None:
+        index_path, name = split_file_path(file_path, self.file_name)
+
+        def _remove(files: dict) -> bool:
+            return files.pop(name, None) is not None
+
+        self._update(index_path, _remove)
+
+    def remove_many(self, file_paths: Iterable[str]) -> None:
+        """
+        Remove many files, updating each directory's manifest once.
+        """
+        names_by_index = {}
+        for file_path in file_paths:
+            index_path, name = split_file_path(file_path, self.file_name)
+            names_by_index.setdefault(index_path, set()).add(name)
+
+        for index_path, names in names_by_index.items():
+
+            def _remove(files: dict, names=names) -> bool:
+                removed = [files.pop(name) for name in names if name in files]
+                return bool(removed)
+
+            self._update(index_path, _remove)
+
+    def set_many(self, meta_data: Dict[str, Optional[dict]]) -> None:
+        """
+        Set the metadata of many files, updating each directory's manifest once.
+        Files mapped to `None` are removed.
+        """
+        values_by_index = {}
+        for file_path, value in meta_data.items():
+            index_path, name = split_file_path(file_path, self.file_name)
+            values_by_index.setdefault(index_path, {})[name] = value
+
+        for index_path, values in values_by_index.items():
+
+            def _set(files: dict, values=values) -> bool:
+                changed = False
+                for name, value in values.items():
+                    if value is not None:
+                        files[name] = value
+                        changed = True
+                    elif files.pop(name, None) is not None:
+                        changed = True
+                return changed
+
+            self._update(index_path, _set)
+
+    def invalidate(self, directory: str) -> None:
+        """
+        Forget the cached manifests of a directory and every directory below it, e.g.
+        after the directory was renamed.
+        """
+        # The root directory's manifests are all of them
+        prefix = f"{directory.rstrip('/')}/" if directory.strip("/") else ""
+        with self._lock:
+            for index_path in [path for path in self._cache if path.startswith(prefix)]:
+                del self._cache[index_path]
+
+    def replace_directory(self, directory: str, files: Dict[str, dict]) -> None:
+        """
+        Replace the manifest of a directory, e.g. when rebuilding it from sidecar files.
+        """
+
+        def _replace(current: dict) -> None:
+            current.clear()
+            current.update(files)
+
+        self.update_directory(directory, _replace)
+
+    def update_directory(
+        self, directory: str, mutate: Callable[[dict], Optional[bool]]
+    ) -> None:
+        """
+        Change the manifest of a directory with a read-modify-write, retried on
+        conflicts. `mutate` changes the dict of files in place and may return False
+        if it changed nothing. It can be called more than once.
+        """
+        index_path, _ = split_file_path(f"{directory.rstrip('/')}/", self.file_name)
+        self._update(index_path, mutate)
+
+    def _get(self, index_path: str) -> Optional[dict]:
+        with self._lock:
+            cached = self._cache.get(index_path)
+        if cached is not None and time.monotonic() - cached[2] < self.ttl:
+            return cached[0]
+        return self._refresh(index_path, cached)[0]
+
+    def _refresh(self, index_path: str, cached) -> Tuple[Optional[dict], Optional[str]]:
+        version = cached[1] if cached is not None else None
+        result = self._load(index_path, version)
+        if result is NOT_MODIFIED:
+            files, version = cached[0], cached[1]
+        else:
+            data, version = result
+            files = None if data is None else decode_meta_data(data)["files"]
+
+        with self._lock:
+            self._cache[index_path] = (files, version, time.monotonic())
+        return files, version
+
+    def _update(self, index_path: str, mutate: Callable[[dict], Optional[bool]]) -> None:
+        update = _QueuedUpdate(mutate)
+        with self._lock:
+            queued = self._queued.get(index_path)
+            if queued is not None:
+                queued.append(update)
+            else:
+                self._queued[index_path] = []
+        if queued is not None:
+            # Another thread is writing this manifest and applies the update next
+            update.done.wait()
+            if update.error is not None:
+                raise update.error
+            return
+
+        # Write this update, then whatever was queued meanwhile, until nothing is left
+        batch = [update]
+        while batch:
+            try:
+                self._write(index_path, [queued.mutate for queued in batch])
+            except BaseException as e:
+                for queued in batch:
+                    queued.error = e
+            for queued in batch:
+                queued.done.set()
+            with self._lock:
+                batch = self._queued[index_path]
+                if batch:
+                    self._queued[index_path] = []
+                else:
+                    del self._queued[index_path]
+
+        if update.error is not None:
+            raise update.error
+
+    def _write(
+        self, index_path: str, mutations: List[Callable[[dict], Optional[bool]]]
+    ) -> None:
+        for _ in range(MAX_UPDATE_ATTEMPTS):
+            with self._lock:
+                cached = self._cache.get(index_path)
+            files, version = self._refresh(index_path, cached)
+
+            if files is None and self._seed is not None:
+                files = self._seed(index_path)
+            files = dict(files or {})
+            # Every mutation runs, even once one has changed something
+            changes = [mutate(files) is not False for mutate in mutations]
+            if not any(changes):
+                # Nothing changed, e.g. removing a file without metadata
+                return
+
+            data = encode_meta_data({"version": 1, "files": files})
+            new_version = self._store(index_path, data, version)
+            if new_version is not None:
+                with self._lock:
+                    self._cache[index_path] = (files, new_version, time.monotonic())
+                return
+
+        raise IndexConflictError(f"Could not update {index_path}, too many concurrent writers.")
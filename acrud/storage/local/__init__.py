@@ -1 +1,10 @@
 from .local import LocalStorage
+
+
+def __getattr__(name: str):
+    # The asyncio backend is only imported when it is used
+    if name == "AsyncLocalStorage":
+        from .async_local import AsyncLocalStorage
+
+        return AsyncLocalStorage
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,74 @@
+import asyncio
+from typing import Optional, Tuple, Any
+
+from ..base import AsyncStorageBase
+from .. import utils
+from .local import LocalStorage
+
+
+class AsyncLocalStorage(AsyncStorageBase):
+    """
+    An asyncio CRUD interface for local storage.
+
+    Operating systems offer no portable non-blocking API for regular files, so each
+    operation runs on the event loop's default executor. The executor has a fixed
+    number of workers, and `max_concurrency` bounds how many batch operations queue
+    on it, so fanning out hundreds of reads does not start hundreds of threads.
+    """
+
+    def __init__(self, config) -> None:
+        self._storage = LocalStorage(config)
+        self.root_dir = self._storage.root_dir
+        self.max_concurrency = utils.get_config_option(
+            config, "MAX_CONCURRENCY", self.max_concurrency, int
+        )
+
+    async def ping(self) -> dict:
+        return {"response": "pong"}
+
+    async def create_file(
+        self, file_path: str, data: Any, meta_data: Optional[dict] = None
+    ) -> None:
+        """
+        Save a file to local storage without blocking the event loop.
+
+        Args:
+            file_path (str): The path to the file.
+            data (Any): The data to save.
+            meta_data (Optional[dict], optional): The meta data to save. Defaults
+
+        Returns:
+            None
+        """
+        await asyncio.to_thread(self._storage.create_file, file_path, data, meta_data)
+
+    async def read_file(self, file_path: str) -> Tuple[Any, Optional[dict]]:
+        """
+        Read a file from local storage without blocking the event loop.
+
+        Args:
+            file_path (str): The path to the file.
+
+        Returns:
+            Tuple[Any, Optional[dict]]: The data and, if available, the metadata.
+        """
+        return await asyncio.to_thread(self._storage.read_file, file_path)
+
+    async def update_file(
+        self, file_path: str, data: Any, meta_data: Optional[dict] = None
+    ) -> None:
+        # In Local we simply overwrite the file
+        await self.create_file(file_path, data, meta_data)
+
+    async def delete_file(self, file_path: str) -> None:
+        await asyncio.to_thread(self._storage.delete_file, file_path)
+
+    async def list_files_in_directory(self, file_path: str) -> list:
+        return await asyncio.to_thread(
+            self._storage.list_files_in_directory, file_path
+        )
+
+    async def list_subdirectories_in_directory(self, file_path: str) -> list:
+        return await asyncio.to_thread(
+            self._storage.list_subdirectories_in_directory, file_path
+        )
@@ -1,10 +1,129 @@
+import errno
+import mimetypes
+import mmap
 import os
-from typing import Optional, Tuple, Any
-
-from ..base import StorageBase
-from ..convert import convert, get_type
-from ...exception import lookup_handler
+import shutil
+import stat as stat_module
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple, Any, Union
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows
+    fcntl = None
+
+from ..base import (
+    NOT_MODIFIED,
+    FileStat,
+    StorageBase,
+    StorageEntry,
+    _NotModified,
+    _raise_first,
+)
+from ..compression import Compression
+from ..convert import (
+    decode,
+    decode_meta_data,
+    encode,
+    encode_meta_data,
+    references_buffer,
+)
+from ..stream import CHUNK_SIZE, StreamWriter, iter_file
+from ...exception import NotFoundError
+from ..index import (
+    DEFAULT_TTL,
+    INDEX_FILE_NAME,
+    MetadataIndex,
+    meta_data_version,
+)
 from .. import utils
+from .stream import LocalFileWriter, temporary_path
+
+DEFAULT_MMAP_THRESHOLD = 1024 * 1024
+
+INDEX_LOCK_FILE_NAME = ".acrud_index.lock"
+
+_thread_lock = threading.Lock()
+
+
+def _get_version(stat: os.stat_result) -> str:
+    # An ETag style token from the modification time and size
+    return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+
+def _get_index_version(stat: os.stat_result) -> str:
+    # Index files are replaced rather than rewritten, so the inode changes on every update
+    return f"{stat.st_ino:x}-{stat.st_mtime_ns:x}-{stat.st_size:x}"
+
+
+@contextmanager
+def _directory_lock(folder: str) -> Iterator[None]:
+    # Serialises index updates across threads and processes
+    if fcntl is None:
+        with _thread_lock:
+            yield
+        return
+    with open(os.path.join(folder, INDEX_LOCK_FILE_NAME), "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _copy(path: str, new_path: str) -> None:
+    # Copy under a temporary name, so readers never see a partial copy
+    os.makedirs(os.path.dirname(new_path), exist_ok=True)
+    tmp_path = temporary_path(new_path)
+    try:
+        shutil.copyfile(path, tmp_path)
+        os.replace(tmp_path, new_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _replace(path: str, new_path: str) -> None:
+    os.makedirs(os.path.dirname(new_path), exist_ok=True)
+    try:
+        os.replace(path, new_path)
+    except OSError as e:
+        # Renames cannot cross file systems
+        if e.errno != errno.EXDEV:
+            raise e
+        _copy(path, new_path)
+        os.remove(path)
+
+
+def _remove_empty_directories(directory: str) -> None:
+    # Remove directories left with nothing but index bookkeeping, deepest first
+    for folder, _, names in os.walk(directory, topdown=False):
+        if not set(names) <= {INDEX_FILE_NAME, INDEX_LOCK_FILE_NAME}:
+            continue
+        try:
+            for name in names:
+                os.remove(os.path.join(folder, name))
+            os.rmdir(folder)
+        except OSError:
+            # e.g. a file was written meanwhile
+            pass
+
+
+def _is_not_modified(
+    stat: os.stat_result,
+    version: str,
+    if_none_match: Optional[str],
+    if_modified_since: Optional[datetime],
+) -> bool:
+    # As in HTTP, If-None-Match takes precedence over If-Modified-Since
+    if if_none_match is not None:
+        return if_none_match == version
+    if if_modified_since is not None:
+        return stat.st_mtime <= if_modified_since.timestamp()
+    return False
 
 
 class LocalStorage(StorageBase):
@@ -14,6 +133,33 @@ class LocalStorage(StorageBase):
 
     def __init__(self, config) -> None:
         self.root_dir = config.root
+        self.max_workers = utils.get_config_option(
+            config, "MAX_WORKERS", self.max_workers, int
+        )
+        self.query_index_path = utils.get_config_option(
+            config, "QUERY_INDEX_PATH", self.query_index_path
+        )
+        self.query_refresh_ttl = utils.get_config_option(
+            config, "QUERY_REFRESH_TTL", self.query_refresh_ttl, float
+        )
+        # Files at least this large are memory-mapped rather than read into memory
+        self.mmap_threshold = utils.get_config_option(
+            config, "MMAP_THRESHOLD", DEFAULT_MMAP_THRESHOLD, int
+        )
+        self.compression = Compression.from_config(config)
+        # Keep metadata in one index per directory instead of a file per file
+        self.metadata_index = None
+        if utils.get_config_option(config, "METADATA_INDEX", False, bool):
+            self.metadata_index = MetadataIndex(
+                self._load_index,
+                self._store_index,
+                ttl=utils.get_config_option(
+                    config, "METADATA_INDEX_TTL", DEFAULT_TTL, float
+                ),
+                seed=lambda index_path: self._read_meta_data_files(
+                    os.path.dirname(index_path)
+                ),
+            )
 
     def ping(self) -> dict:
         return {"response": "pong"}
@@ -40,68 +186,469 @@ class LocalStorage(StorageBase):
 
         folder = "/".join(file_path.split("/")[:-1])
 
-        if not os.path.exists(folder):
-            os.makedirs(folder)
+        # exist_ok avoids a race when files in the same folder are created concurrently
+        os.makedirs(folder, exist_ok=True)
 
         # Save the data
-        data = convert(data, bytes)
+        data = self.compression.compress(file_path, encode(file_path, data))
         with open(file_path, "wb") as f:
             f.write(data)
 
         # Save the metadata
         if meta_data is not None:
-            meta_data_file_path = utils.get_meta_data_file_path(file_path)
-            meta_data = convert(meta_data, bytes)
-            with open(meta_data_file_path, "wb") as f:
-                f.write(meta_data)
-
-    def read_file(self, file_path: str) -> Tuple[Any, Optional[dict]]:
+            self._write_meta_data(file_path, meta_data)
+
+    def read_file(
+        self,
+        file_path: str,
+        if_none_match: Optional[str] = None,
+        if_modified_since: Optional[datetime] = None,
+        stream: bool = False,
+    ) -> Union[Tuple[Any, Optional[dict]], _NotModified]:
         """
         Read a file from local storage.
         The data will be converted to the appropriate type.
 
         Args:
             file_path (str): The path to the file.
+            if_none_match (Optional[str], optional): Return `NOT_MODIFIED` if the file
+                still has this version token.
+            if_modified_since (Optional[datetime], optional): Return `NOT_MODIFIED` if the
+                file has not been modified since this time.
+            stream (bool, optional): Return a lazy iterator over the rows of a CSV file
+                (or the lines of a text file) instead of loading it. Defaults to False.
 
         Returns:
-            Tuple[Any, Optional[dict]]: The data and, if available, the metadata.
+            Union[Tuple[Any, Optional[dict]], _NotModified]: The data and, if available,
+                the metadata.
+        """
+        if stream:
+            rows = iter_file(self.open_read(file_path), file_path)
+            full_file_path = os.path.join(self.root_dir, file_path)
+            return rows, self._read_meta_data(full_file_path)
+
+        result = self.read_file_with_version(file_path, if_none_match, if_modified_since)
+        if result is NOT_MODIFIED:
+            return result
+        data, meta_data, _ = result
+        return data, meta_data
+
+    def read_file_with_version(
+        self,
+        file_path: str,
+        if_none_match: Optional[str] = None,
+        if_modified_since: Optional[datetime] = None,
+    ) -> Union[Tuple[Any, Optional[dict], str], _NotModified]:
+        """
+        Read a file from local storage along with its version token.
+        The token is derived from the modification time and size reported by `os.stat`,
+        so an unchanged file is detected without reading it.
+
+        Args:
+            file_path (str): The path to the file.
+            if_none_match (Optional[str], optional): A version token from a previous read.
+            if_modified_since (Optional[datetime], optional): Only read the file if it
+                was modified after this time.
+
+        Returns:
+            Union[Tuple[Any, Optional[dict], str], _NotModified]: The data, the metadata
+                and the version token, or `NOT_MODIFIED`.
         """
 
         file_path = os.path.join(self.root_dir, file_path)
 
         try:
             with open(file_path, "rb") as f:
-                obj = f.read()
+                # Stat the open file so the token matches the bytes we read
+                stat = os.fstat(f.fileno())
+                version = _get_version(stat)
+                if _is_not_modified(stat, version, if_none_match, if_modified_since):
+                    return NOT_MODIFIED
+                if stat.st_size >= self.mmap_threshold and stat.st_size > 0:
+                    # Decode straight from the page cache instead of copying into bytes
+                    obj = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                else:
+                    obj = f.read()
+        except FileNotFoundError:
+            raise NotFoundError(file_path) from None
+
+        raw = obj
+        try:
+            obj = self.compression.decompress(file_path, raw)
+            data = decode(file_path, obj)  # Converts file data
+        except BaseException:
+            if isinstance(raw, mmap.mmap):
+                try:
+                    raw.close()
+                except BufferError:
+                    # A view held by the traceback still uses it, so it is unmapped
+                    # once that is released
+                    pass
+            raise
+        if isinstance(raw, mmap.mmap) and (
+            obj is not raw or not references_buffer(file_path)
+        ):
+            raw.close()
+        meta_data = self._read_meta_data(file_path)
+
+        return data, meta_data, version
+
+    def exists(self, file_path: str) -> bool:
+        """
+        Check whether a file exists in local storage with a single `stat` call.
+
+        Args:
+            file_path (str): The path to the file.
+
+        Returns:
+            bool: Whether the file exists.
+        """
+        return os.path.isfile(os.path.join(self.root_dir, file_path))
+
+    def stat(self, file_path: str) -> FileStat:
+        """
+        Get the attributes of a file in local storage from `os.stat`.
+        The content type is guessed from the extension.
+
+        Args:
+            file_path (str): The path to the file.
+
+        Returns:
+            FileStat: The attributes of the file.
+
+        Raises:
+            NotFoundError: If the file does not exist.
+        """
+        full_file_path = os.path.join(self.root_dir, file_path)
+        try:
+            stat = os.stat(full_file_path)
+        except FileNotFoundError:
+            raise NotFoundError(file_path) from None
+        if stat_module.S_ISDIR(stat.st_mode):
+            raise NotFoundError(file_path)
+
+        return FileStat(
+            file_path,
+            stat.st_size,
+            stat.st_mtime,
+            _get_version(stat),
+            mimetypes.guess_type(file_path)[0],
+            self._has_meta_data(full_file_path),
+        )
+
+    def read_meta_data(self, file_path: str) -> Optional[dict]:
+        """
+        Read only the metadata of a file in local storage.
+
+        Args:
+            file_path (str): The path to the file.
+
+        Returns:
+            Optional[dict]: The metadata, if available.
+        """
+        return self._read_meta_data(os.path.join(self.root_dir, file_path))
+
+    def write_meta_data(self, file_path: str, meta_data: Optional[dict]) -> None:
+        """
+        Replace only the metadata of a file in local storage, leaving its data alone.
+
+        Args:
+            file_path (str): The path to the file.
+            meta_data (Optional[dict]): The new metadata, or `None` to remove it.
+
+        Returns:
+            None
+        """
+        full_file_path = os.path.join(self.root_dir, file_path)
+        if meta_data is not None:
+            self._write_meta_data(full_file_path, meta_data)
+            return
+
+        if self.metadata_index is not None:
+            self.metadata_index.remove(full_file_path)
+        try:
+            os.remove(utils.get_meta_data_file_path(full_file_path))
         except FileNotFoundError:
-            lookup_handler(self, file_path)
+            pass
+
+    def list_meta_data(self, file_path: str) -> Dict[str, dict]:
+        """
+        Read the metadata of every file directly inside a directory.
+        With the metadata index enabled this is a single lookup.
 
-        data = convert(obj, get_type(file_path))  # Converts file data
+        Args:
+            file_path (str): The path to the directory.
 
+        Returns:
+            Dict[str, dict]: File paths mapped to their metadata.
+        """
+        if self.metadata_index is not None:
+            directory = os.path.join(self.root_dir, file_path)
+            files = self.metadata_index.get_directory(directory)
+            if files is not None:
+                prefix = file_path.strip("/")
+                return {
+                    (f"{prefix}/{name}" if prefix else name): meta_data
+                    for name, meta_data in files.items()
+                }
+        return super().list_meta_data(file_path)
+
+    def rebuild_metadata_index(self, file_path: str) -> None:
+        """
+        Build the metadata index of a directory from its metadata files.
+        Use this once to migrate a directory written without the index.
+
+        Args:
+            file_path (str): The path to the directory.
+
+        Returns:
+            None
+        """
+        if self.metadata_index is None:
+            raise ValueError("The metadata index is not enabled.")
+
+        directory = os.path.join(self.root_dir, file_path)
+        files = self._read_meta_data_files(directory)
+        self.metadata_index.replace_directory(directory, files)
+
+    def _read_meta_data_files(self, directory: str) -> Dict[str, dict]:
+        # The metadata files of a directory, keyed by the name of their file
+        try:
+            with os.scandir(directory) as it:
+                names = {entry.name for entry in it if entry.is_file()}
+        except (FileNotFoundError, NotADirectoryError):
+            return {}
+
+        files = {}
+        for name in names:
+            if name.startswith(".") or name.endswith("_meta.json"):
+                continue
+            if utils.get_meta_data_file_path(name) in names:
+                meta_data = self._read_meta_data_file(os.path.join(directory, name))
+                if meta_data is not None:
+                    files[name] = meta_data
+        return files
+
+    def _read_meta_data(self, full_file_path: str) -> Optional[dict]:
+        if self.metadata_index is not None:
+            indexed, meta_data = self.metadata_index.lookup(full_file_path)
+            if indexed:
+                return meta_data
+        return self._read_meta_data_file(full_file_path)
+
+    def _has_meta_data(self, full_file_path: str) -> bool:
+        if self.metadata_index is not None:
+            indexed, meta_data = self.metadata_index.lookup(full_file_path)
+            if indexed:
+                return meta_data is not None
+        return os.path.exists(utils.get_meta_data_file_path(full_file_path))
+
+    def _read_meta_data_file(self, full_file_path: str) -> Optional[dict]:
         # If a metadata file exists, read it
-        meta_data_file_path = utils.get_meta_data_file_path(file_path)
-        if os.path.exists(meta_data_file_path):
+        meta_data_file_path = utils.get_meta_data_file_path(full_file_path)
+        try:
             with open(meta_data_file_path, "rb") as f:
                 obj = f.read()
-            meta_data = convert(obj, dict)
-        else:
-            meta_data = None
+        except FileNotFoundError:
+            return None
+        return decode_meta_data(obj)
 
-        return data, meta_data
+    def _write_meta_data(self, full_file_path: str, meta_data: dict) -> None:
+        if self.metadata_index is not None:
+            self.metadata_index.set(full_file_path, meta_data)
+            return
+
+        meta_data_file_path = utils.get_meta_data_file_path(full_file_path)
+        with open(meta_data_file_path, "wb") as f:
+            f.write(encode_meta_data(meta_data))
+
+    def _load_index(
+        self, index_path: str, version: Optional[str]
+    ) -> Union[Tuple[Optional[bytes], Optional[str]], _NotModified]:
+        try:
+            with open(index_path, "rb") as f:
+                current_version = _get_index_version(os.fstat(f.fileno()))
+                if current_version == version:
+                    return NOT_MODIFIED
+                return f.read(), current_version
+        except FileNotFoundError:
+            return None, None
+
+    def _store_index(
+        self, index_path: str, data: bytes, expected_version: Optional[str]
+    ) -> Optional[str]:
+        folder = os.path.dirname(index_path)
+        os.makedirs(folder, exist_ok=True)
+
+        with _directory_lock(folder):
+            try:
+                current_version = _get_index_version(os.stat(index_path))
+            except FileNotFoundError:
+                current_version = None
+            if current_version != expected_version:
+                return None
+
+            with StreamWriter(LocalFileWriter(index_path)) as f:
+                f.write(data)
+            return _get_index_version(os.stat(index_path))
+
+    @contextmanager
+    def map_file(self, file_path: str) -> Iterator[memoryview]:
+        """
+        Memory-map a file in local storage.
+        Slices of the returned view are read from the page cache on demand, so only the
+        parts that are touched are loaded. The view is only valid inside the `with`
+        block.
+
+        Args:
+            file_path (str): The path to the file.
+
+        Returns:
+            Iterator[memoryview]: A read-only view of the file contents.
+        """
+        full_file_path = os.path.join(self.root_dir, file_path)
+        try:
+            f = open(full_file_path, "rb")
+        except FileNotFoundError:
+            raise NotFoundError(file_path) from None
+
+        with f:
+            if os.fstat(f.fileno()).st_size == 0:
+                # Empty files cannot be mapped
+                yield memoryview(b"")
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapping:
+                view = memoryview(mapping)
+                try:
+                    yield view
+                finally:
+                    view.release()
+
+    def read_range(self, file_path: str, start: int, end: Optional[int] = None) -> bytes:
+        """
+        Read part of a file in local storage without touching the rest of it.
+
+        Args:
+            file_path (str): The path to the file.
+            start (int): The offset of the first byte.
+            end (Optional[int], optional): The offset after the last byte. Defaults to
+                the end of the file.
+
+        Returns:
+            bytes: The raw bytes in `[start, end)`, fewer if the file is shorter.
+        """
+        full_file_path = os.path.join(self.root_dir, file_path)
+        try:
+            with open(full_file_path, "rb", buffering=0) as f:
+                f.seek(start)
+                return f.readall() if end is None else f.read(max(0, end - start))
+        except FileNotFoundError:
+            raise NotFoundError(file_path) from None
+
+    def open_read(self, file_path: str) -> BinaryIO:
+        """
+        Open a file in local storage for reading as a binary stream.
+
+        Args:
+            file_path (str): The path to the file.
+
+        Returns:
+            BinaryIO: A readable stream of the raw file contents.
+        """
+        full_file_path = os.path.join(self.root_dir, file_path)
+        try:
+            stream = open(full_file_path, "rb", buffering=CHUNK_SIZE)
+        except FileNotFoundError:
+            raise NotFoundError(file_path) from None
+        return self.compression.wrap_reader(file_path, stream)
+
+    def open_random_access(self, file_path: str) -> BinaryIO:
+        """
+        Open a file in local storage as a seekable binary stream.
+
+        Args:
+            file_path (str): The path to the file.
+
+        Returns:
+            BinaryIO: A seekable stream of the raw file contents.
+        """
+        full_file_path = os.path.join(self.root_dir, file_path)
+        try:
+            return open(full_file_path, "rb")
+        except FileNotFoundError:
+            raise NotFoundError(file_path) from None
+
+    def read_table(
+        self,
+        file_path: str,
+        columns: Optional[List[str]] = None,
+        filter: Optional[dict] = None,
+    ) -> Any:
+        """
+        Read a `.parquet` or `.arrow` file in local storage as an Arrow table.
+        The file is memory-mapped, so only the pages of the columns and row groups that
+        are needed are read from disk.
+
+        Args:
+            file_path (str): The path to the file.
+            columns (Optional[List[str]], optional): The columns to read. Defaults to all.
+            filter (Optional[dict], optional): The rows to keep, in the form used by
+                `query`. Defaults to all.
+
+        Returns:
+            pyarrow.Table: The table.
+        """
+        from ..tabular import memory_map, read_table
+
+        full_file_path = os.path.join(self.root_dir, file_path)
+        try:
+            source = memory_map(full_file_path)
+        except FileNotFoundError:
+            raise NotFoundError(file_path) from None
+        with source:
+            return read_table(source, file_path, columns, filter)
+
+    def open_write(self, file_path: str, meta_data: Optional[dict] = None) -> BinaryIO:
+        """
+        Open a file in local storage for writing as a binary stream.
+        Data is written to a temporary file that replaces the target when the stream is
+        closed.
+
+        Args:
+            file_path (str): The path to the file.
+            meta_data (Optional[dict], optional): The meta data to save. Defaults
+
+        Returns:
+            BinaryIO: A writable stream for the raw file contents.
+        """
+        full_file_path = os.path.join(self.root_dir, file_path)
+        writer = StreamWriter(
+            self.compression.wrap_writer(file_path, LocalFileWriter(full_file_path))
+        )
+
+        if meta_data is not None:
+
+            writer.add_commit_callback(
+                lambda: self._write_meta_data(full_file_path, meta_data)
+            )
+
+        return writer
 
     def update_file(
         self, file_path: str, data: Any, meta_data: Optional[dict] = None
     ) -> None:
         """
-        TODO: Implement this method.
-        Replace the data in a file in S3.
+        Replace the data of a file in local storage by saving it again with
+        `create_file`, so the file is created if it does not exist.
+        The metadata is replaced if provided, and otherwise kept.
 
         Args:
             file_path (str): The path to the file.
             data (Any): The data to save.
+            meta_data (Optional[dict], optional): The meta data to save. Defaults to None.
 
         Returns:
             None
-
         """
 
         # In Local we simply overwrite the file
@@ -114,34 +661,226 @@ class LocalStorage(StorageBase):
         # Delete the data
         try:
             os.remove(full_file_path)
-        except LookupError:
-            lookup_handler(self, file_path)
+        except FileNotFoundError:
+            raise NotFoundError(file_path) from None
 
         # Delete the metadata
+        if self.metadata_index is not None:
+            self.metadata_index.remove(full_file_path)
         meta_data_file_path = utils.get_meta_data_file_path(full_file_path)
         if os.path.exists(meta_data_file_path):
             os.remove(meta_data_file_path)
 
+    def copy_file(self, file_path: str, new_file_path: str) -> None:
+        """
+        Copy a file and its metadata in local storage.
+        The contents are copied by the kernel where the platform supports it, and the
+        copy appears at its path in one step.
+
+        Args:
+            file_path (str): The path to the file.
+            new_file_path (str): The path to copy it to.
+
+        Returns:
+            None
+        """
+        full_file_path = os.path.join(self.root_dir, file_path)
+        new_full_file_path = os.path.join(self.root_dir, new_file_path)
+        self._transfer(full_file_path, new_full_file_path, move=False)
+        if self.metadata_index is not None:
+            self.metadata_index.set_many(
+                {new_full_file_path: self._read_meta_data(full_file_path)}
+            )
+
+    def move_file(self, file_path: str, new_file_path: str) -> None:
+        """
+        Move, or rename, a file and its metadata in local storage.
+        The file is renamed with `os.replace`, so its contents are not copied.
+
+        Args:
+            file_path (str): The path to the file.
+            new_file_path (str): The path to move it to.
+
+        Returns:
+            None
+        """
+        full_file_path = os.path.join(self.root_dir, file_path)
+        new_full_file_path = os.path.join(self.root_dir, new_file_path)
+        meta_data = None
+        if self.metadata_index is not None:
+            meta_data = self._read_meta_data(full_file_path)
+        self._transfer(full_file_path, new_full_file_path, move=True)
+        if self.metadata_index is not None:
+            self.metadata_index.set_many(
+                {new_full_file_path: meta_data, full_file_path: None}
+            )
+
+    def move_directory(self, file_path: str, new_file_path: str) -> None:
+        """
+        Move every file below a directory in local storage to another directory.
+        If the target does not exist, or is empty, the whole directory is renamed in one
+        step, along with its metadata files and index. Otherwise the files are moved in
+        parallel using a pool of `max_workers` threads, and the emptied directories are
+        removed. A failed file does not stop the others; once all have been tried the
+        first error is raised.
+
+        Args:
+            file_path (str): The path to the directory.
+            new_file_path (str): The path to move it to.
+
+        Returns:
+            None
+        """
+        source, target = self._check_move(file_path, new_file_path)
+        full_source = os.path.join(self.root_dir, source)
+        full_target = os.path.join(self.root_dir, target)
+
+        os.makedirs(os.path.dirname(full_target), exist_ok=True)
+        try:
+            os.replace(full_source, full_target)
+        except OSError as e:
+            # Merge into a non-empty target, or one on another file system
+            if e.errno not in (errno.ENOTEMPTY, errno.EEXIST, errno.EXDEV):
+                raise e
+        else:
+            if self.metadata_index is not None:
+                self.metadata_index.invalidate(full_source)
+                self.metadata_index.invalidate(full_target)
+            return
+
+        moves = [
+            (
+                os.path.join(self.root_dir, entry.path),
+                os.path.join(self.root_dir, new_path),
+            )
+            for entry, new_path in self._plan_move(source, target)
+            if not entry.is_dir
+        ]
+        meta_data = {}
+        if self.metadata_index is not None:
+            meta_data = {path: self._read_meta_data(path) for path, _ in moves}
+
+        results = self._map(
+            lambda path, new_path: self._transfer(path, new_path, move=True), moves
+        )
+
+        if self.metadata_index is not None:
+            changes = {}
+            for (path, new_path), result in zip(moves, results):
+                if result is None:
+                    changes[new_path] = meta_data[path]
+                    changes[path] = None
+            self.metadata_index.set_many(changes)
+
+        _raise_first(results)
+        _remove_empty_directories(full_source)
+        if self.metadata_index is not None:
+            self.metadata_index.invalidate(full_source)
+
+    def _transfer(self, full_file_path: str, new_full_file_path: str, move: bool) -> None:
+        # Copy or move a file and its metadata file, leaving the index to the caller
+        transfer = _replace if move else _copy
+        transfer(full_file_path, new_full_file_path)
+
+        meta_data_file_path = utils.get_meta_data_file_path(full_file_path)
+        new_meta_data_file_path = utils.get_meta_data_file_path(new_full_file_path)
+        try:
+            transfer(meta_data_file_path, new_meta_data_file_path)
+        except FileNotFoundError:
+            # The file has no metadata, so its new path must not keep any either
+            try:
+                os.remove(new_meta_data_file_path)
+            except FileNotFoundError:
+                pass
+
     def list_files_in_directory(self, file_path: str) -> list:
         full_path = os.path.join(self.root_dir, file_path)
         if not os.path.exists(full_path):
             return []
 
-        files = os.listdir(full_path)
-        # Remove file extensions and metadata files
-        files = [
-            os.path.splitext(f)[0]
-            for f in files
-            if not f.startswith(".") and not f.endswith(".meta.json")
-        ]
+        # Remove file extensions, directories and metadata files
+        with os.scandir(full_path) as entries:
+            files = [
+                os.path.splitext(entry.name)[0]
+                for entry in entries
+                if not entry.name.startswith(".")
+                and not entry.name.endswith("_meta.json")
+                and not entry.is_dir()
+            ]
         return list(set(files))
 
     def list_subdirectories_in_directory(self, file_path) -> list:
 
         path = os.path.join(self.root_dir, file_path)
-        files = os.listdir(path)
 
-        # Filter out entries that start with a dot
-        files = [file for file in files if not file.startswith(".")]
+        # Filter out files and entries that start with a dot
+        with os.scandir(path) as entries:
+            return [
+                entry.name
+                for entry in entries
+                if not entry.name.startswith(".") and entry.is_dir()
+            ]
+
+    def walk(
+        self, file_path: str = "", recursive: bool = True, stat: bool = True
+    ) -> Iterator[StorageEntry]:
+        """
+        Lazily iterate over the files and directories below a directory.
+        Built on `os.scandir`, so telling files from directories and finding metadata
+        files needs no extra system calls; only `stat=True` costs one `stat` per entry,
+        and one more per metadata file for its `meta_version`.
 
-        return files
+        Args:
+            file_path (str, optional): The path to the directory. Defaults to the root.
+            recursive (bool, optional): Descend into subdirectories. Defaults to True.
+            stat (bool, optional): Fill in `size` and `mtime`. Defaults to True.
+
+        Returns:
+            Iterator[StorageEntry]: One entry per file or directory, in no particular order.
+        """
+        directories = [file_path.strip("/")]
+        while directories:
+            directory = directories.pop()
+            try:
+                with os.scandir(os.path.join(self.root_dir, directory)) as it:
+                    entries = [entry for entry in it if not entry.name.startswith(".")]
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+
+            by_name = {entry.name: entry for entry in entries}
+            indexed = None
+            if self.metadata_index is not None:
+                indexed = self.metadata_index.get_directory(
+                    os.path.join(self.root_dir, directory)
+                )
+            for entry in entries:
+                if entry.name.endswith("_meta.json"):
+                    continue
+
+                path = f"{directory}/{entry.name}" if directory else entry.name
+                is_dir = entry.is_dir()
+                meta_version = None
+                if is_dir:
+                    has_metadata = False
+                    if recursive:
+                        directories.append(path)
+                elif indexed is not None:
+                    has_metadata = entry.name in indexed
+                    meta_version = meta_data_version(indexed.get(entry.name))
+                else:
+                    meta_data_entry = by_name.get(
+                        utils.get_meta_data_file_path(entry.name)
+                    )
+                    has_metadata = meta_data_entry is not None
+                    if has_metadata and stat:
+                        meta_version = _get_version(meta_data_entry.stat())
+
+                if stat:
+                    entry_stat = entry.stat()
+                    size, mtime = entry_stat.st_size, entry_stat.st_mtime
+                else:
+                    size, mtime = None, None
+
+                yield StorageEntry(
+                    path, size, mtime, is_dir, has_metadata, meta_version
+                )
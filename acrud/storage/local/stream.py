@@ -0,0 +1,42 @@
+import os
+import uuid
+
+from ..stream import RawStreamWriter
+
+
+def temporary_path(file_path: str) -> str:
+    """
+    A unique hidden path next to a file, to write it under before renaming it into place.
+    """
+    folder, name = os.path.split(file_path)
+    return os.path.join(folder, f".{name}.{uuid.uuid4().hex}.tmp")
+
+
+class LocalFileWriter(RawStreamWriter):
+    """
+    Writes to a hidden temporary file next to the target and renames it into place on
+    commit, so readers never see a partially written file.
+    """
+
+    def __init__(self, file_path: str) -> None:
+        super().__init__()
+        self.file_path = file_path
+
+        folder = os.path.dirname(file_path)
+        os.makedirs(folder, exist_ok=True)
+        # Created like a regular file so the final permissions respect the umask
+        self._tmp_path = temporary_path(file_path)
+        fd = os.open(self._tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+        self._file = os.fdopen(fd, "wb", buffering=0)
+
+    def write(self, b) -> int:
+        return self._file.write(b)
+
+    def commit(self) -> None:
+        self._file.close()
+        os.replace(self._tmp_path, self.file_path)
+
+    def discard(self) -> None:
+        self._file.close()
+        if os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
@@ -0,0 +1,769 @@
+import io
+import mimetypes
+import os
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import Any, BinaryIO, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from ..exception import NotFoundError
+from .base import NOT_MODIFIED, FileStat, StorageBase, StorageEntry, _NotModified
+from .convert import decode, encode
+from .index import DEFAULT_TTL, MetadataIndex, meta_data_version
+from .stream import iter_file
+from . import utils
+
+# Hidden, so listings and `walk` skip them
+PACK_INDEX_FILE_NAME = ".acrud_packs.json"
+PACK_DIRECTORY_NAME = ".acrud_packs"
+PACK_EXTENSION = ".pack"
+
+# The manifest entry holding the size of every pack in the directory. File names
+# never contain a slash, so it cannot clash with one.
+PACKS_KEY = "/"
+
+DEFAULT_PACK_MAX_FILE_SIZE = 64 * 1024
+DEFAULT_PACK_SIZE = 16 * 1024 * 1024
+DEFAULT_PACK_COMPACT_INTERVAL = 60.0
+DEFAULT_PACK_COMPACT_THRESHOLD = 0.5
+
+
+class PackedStorage(StorageBase):
+    """
+    Packs many small files into a few large objects.
+
+    `create_files` concatenates the files of a batch whose encoded size is at most
+    `max_file_size` into pack objects of up to `pack_size` bytes, one write per pack,
+    and records where each file starts in a manifest per directory, in one update per
+    directory. Reads look the file up in the manifest and fetch its bytes with a single
+    ranged read of the pack. Files are compressed one by one before they are packed,
+    so each can still be read on its own. Larger files, and files written one at a
+    time with `create_file`, are stored as usual.
+
+    Deleting or rewriting a packed file only removes or moves its manifest entry.
+    A background thread rewrites, every `compact_interval` seconds, the packs of the
+    directories changed since in which at least `compact_threshold` of the bytes are
+    no longer referenced, and deletes the packs nothing refers to any more.
+
+    The manifests, and the absence of one in directories without packs, are cached in
+    memory and revalidated at most once every `index_ttl` seconds, as with
+    `METADATA_INDEX_TTL`.
+    """
+
+    def __init__(
+        self,
+        storage: StorageBase,
+        max_file_size: int = DEFAULT_PACK_MAX_FILE_SIZE,
+        pack_size: int = DEFAULT_PACK_SIZE,
+        index_ttl: float = DEFAULT_TTL,
+        compact_interval: float = DEFAULT_PACK_COMPACT_INTERVAL,
+        compact_threshold: float = DEFAULT_PACK_COMPACT_THRESHOLD,
+    ) -> None:
+        if not all(
+            hasattr(storage, name)
+            for name in ("_load_index", "_store_index", "compression")
+        ):
+            raise ValueError(
+                f"{type(storage).__name__} cannot hold packs, it has no index primitives."
+            )
+        self.storage = storage
+        self.max_file_size = max_file_size
+        self.pack_size = pack_size
+        self.compact_interval = compact_interval
+        self.compact_threshold = compact_threshold
+        self.max_workers = storage.max_workers
+        self.query_index_path = storage.query_index_path
+        self.query_refresh_ttl = storage.query_refresh_ttl
+        self.index = MetadataIndex(
+            storage._load_index,
+            storage._store_index,
+            ttl=index_ttl,
+            file_name=PACK_INDEX_FILE_NAME,
+        )
+
+        # Directories with unreferenced bytes, for the compaction thread
+        self._garbage = set()
+        self._closed = False
+        self._thread = None
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, storage: StorageBase, config) -> "PackedStorage":
+        return cls(
+            storage,
+            max_file_size=utils.get_config_option(
+                config, "PACK_MAX_FILE_SIZE", DEFAULT_PACK_MAX_FILE_SIZE, int
+            ),
+            pack_size=utils.get_config_option(
+                config, "PACK_SIZE", DEFAULT_PACK_SIZE, int
+            ),
+            index_ttl=utils.get_config_option(
+                config, "PACK_INDEX_TTL", DEFAULT_TTL, float
+            ),
+            compact_interval=utils.get_config_option(
+                config, "PACK_COMPACT_INTERVAL", DEFAULT_PACK_COMPACT_INTERVAL, float
+            ),
+            compact_threshold=utils.get_config_option(
+                config, "PACK_COMPACT_THRESHOLD", DEFAULT_PACK_COMPACT_THRESHOLD, float
+            ),
+        )
+
+    def __getattr__(self, name: str) -> Any:
+        # Expose backend specific attributes, e.g. `root_dir` or `client`
+        if name == "storage":
+            raise AttributeError(name)
+        return getattr(self.storage, name)
+
+    def __enter__(self) -> "PackedStorage":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def ping(self) -> dict:
+        return self.storage.ping()
+
+    def create_file(
+        self, file_path: str, data: Any, meta_data: Optional[dict] = None
+    ) -> None:
+        """
+        Save a file on its own, as the backend does. Use `create_files`, or
+        `BufferedStorage` in front of this storage, to pack small files.
+
+        Args:
+            file_path (str): The path to the file.
+            data (Any): The data to save.
+            meta_data (Optional[dict], optional): The meta data to save. Defaults
+
+        Returns:
+            None
+        """
+        entry = self._lookup(file_path)
+        if entry is not None and meta_data is None:
+            meta_data = entry["meta"]
+        self.storage.create_file(file_path, data, meta_data)
+        if entry is not None:
+            self._remove_entries([file_path])
+
+    def update_file(
+        self, file_path: str, data: Any, meta_data: Optional[dict] = None
+    ) -> None:
+        self.create_file(file_path, data, meta_data)
+
+    def create_files(self, items: Iterable[Tuple[str, Any, Optional[dict]]]) -> list:
+        """
+        Save many files, packing the small ones.
+        Each directory's small files are written as one or more packs and added to its
+        manifest in a single update. A failed item does not stop the others; its result
+        is the exception it raised.
+
+        Args:
+            items (Iterable[Tuple[str, Any, Optional[dict]]]): `(file_path, data, meta_data)` tuples.
+
+        Returns:
+            list: One result per item, in input order. `None` on success.
+        """
+        items = list(items)
+        results = [None] * len(items)
+        large = []
+        by_directory = {}
+        for i, (file_path, data, meta_data) in enumerate(items):
+            try:
+                encoded = encode(file_path, data)
+                if len(encoded) > self.max_file_size:
+                    large.append(i)
+                    continue
+                payload = self.storage.compression.compress(file_path, encoded)
+            except Exception as e:
+                results[i] = e
+                continue
+            directory = file_path.rpartition("/")[0]
+            by_directory.setdefault(directory, []).append(
+                (i, file_path, payload, meta_data)
+            )
+
+        if large:
+            for i, result in zip(
+                large, self.storage.create_files([items[i] for i in large])
+            ):
+                results[i] = result
+            self._remove_entries(
+                [items[i][0] for i in large if results[i] is None]
+            )
+
+        work = list(by_directory.items())
+        for (_, records), error in zip(work, self._map(self._pack, work)):
+            if error is not None:
+                for i, _, _, _ in records:
+                    results[i] = error
+        return results
+
+    def read_file(
+        self,
+        file_path: str,
+        if_none_match: Optional[str] = None,
+        if_modified_since: Optional[datetime] = None,
+        stream: bool = False,
+    ) -> Union[Tuple[Any, Optional[dict]], _NotModified]:
+        """
+        Read a file, from its pack if it is packed.
+
+        Args:
+            file_path (str): The path to the file.
+            if_none_match (Optional[str], optional): Return `NOT_MODIFIED` if the file
+                still has this version token.
+            if_modified_since (Optional[datetime], optional): Return `NOT_MODIFIED` if the
+                file has not been modified since this time.
+            stream (bool, optional): Return a lazy iterator over the rows of a CSV file
+                (or the lines of a text file) instead of loading it. Defaults to False.
+
+        Returns:
+            Union[Tuple[Any, Optional[dict]], _NotModified]: The data and, if available,
+                the metadata.
+        """
+        if stream:
+            entry, raw = self._read_packed(file_path)
+            if entry is None:
+                return self.storage.read_file(file_path, stream=True)
+            return iter_file(self._open_raw(file_path, raw), file_path), entry["meta"]
+
+        result = self.read_file_with_version(file_path, if_none_match, if_modified_since)
+        if result is NOT_MODIFIED:
+            return result
+        data, meta_data, _ = result
+        return data, meta_data
+
+    def read_file_with_version(
+        self,
+        file_path: str,
+        if_none_match: Optional[str] = None,
+        if_modified_since: Optional[datetime] = None,
+    ) -> Union[Tuple[Any, Optional[dict], Optional[str]], _NotModified]:
+        """
+        Read a file along with its version token.
+        The token of a packed file names its pack and offset, which change whenever it
+        is written, so an unchanged file is detected from the manifest alone.
+
+        Args:
+            file_path (str): The path to the file.
+            if_none_match (Optional[str], optional): A version token from a previous read.
+            if_modified_since (Optional[datetime], optional): Only read the file if it
+                was modified after this time.
+
+        Returns:
+            Union[Tuple[Any, Optional[dict], Optional[str]], _NotModified]: The data, the
+                metadata and the version token, or `NOT_MODIFIED`.
+        """
+        entry = self._lookup(file_path)
+        if entry is None:
+            return self.storage.read_file_with_version(
+                file_path, if_none_match, if_modified_since
+            )
+        if _is_not_modified(entry, if_none_match, if_modified_since):
+            return NOT_MODIFIED
+
+        entry, raw = self._read_packed(file_path, entry)
+        if entry is None:
+            # Deleted since the lookup
+            raise NotFoundError(file_path)
+        data = decode(file_path, self.storage.compression.decompress(file_path, raw))
+        return data, entry["meta"], _get_version(entry)
+
+    def read_meta_data(self, file_path: str) -> Optional[dict]:
+        entry = self._lookup(file_path)
+        if entry is None:
+            return self.storage.read_meta_data(file_path)
+        return entry["meta"]
+
+    def exists(self, file_path: str) -> bool:
+        return self._lookup(file_path) is not None or self.storage.exists(file_path)
+
+    def stat(self, file_path: str) -> FileStat:
+        """
+        Get the attributes of a file. Those of a packed file come from the manifest.
+
+        Args:
+            file_path (str): The path to the file.
+
+        Returns:
+            FileStat: The attributes of the file.
+
+        Raises:
+            NotFoundError: If the file does not exist.
+        """
+        entry = self._lookup(file_path)
+        if entry is None:
+            return self.storage.stat(file_path)
+        return FileStat(
+            file_path,
+            entry["length"],
+            entry["mtime"],
+            _get_version(entry),
+            mimetypes.guess_type(file_path)[0],
+            entry["meta"] is not None,
+        )
+
+    def list_meta_data(self, file_path: str) -> Dict[str, dict]:
+        meta_data = self.storage.list_meta_data(file_path)
+        directory = file_path.strip("/")
+        for name, entry in self._get_directory(directory).items():
+            path = f"{directory}/{name}" if directory else name
+            if entry["meta"] is not None:
+                meta_data[path] = entry["meta"]
+            else:
+                meta_data.pop(path, None)
+        return meta_data
+
+    def read_range(self, file_path: str, start: int, end: Optional[int] = None) -> bytes:
+        """
+        Read part of a file. A packed file is read with one range of its pack.
+
+        Args:
+            file_path (str): The path to the file.
+            start (int): The offset of the first byte.
+            end (Optional[int], optional): The offset after the last byte. Defaults to
+                the end of the file.
+
+        Returns:
+            bytes: The raw bytes in `[start, end)`, fewer if the file is shorter.
+        """
+        entry = self._lookup(file_path)
+        if entry is None:
+            return self.storage.read_range(file_path, start, end)
+        length = entry["length"]
+        end = length if end is None else min(end, length)
+        if end <= start:
+            return b""
+        entry, raw = self._read_packed(file_path, entry, start, end)
+        if entry is None:
+            raise NotFoundError(file_path)
+        return raw
+
+    def open_read(self, file_path: str) -> BinaryIO:
+        entry, raw = self._read_packed(file_path)
+        if entry is None:
+            return self.storage.open_read(file_path)
+        return self._open_raw(file_path, raw)
+
+    def open_random_access(self, file_path: str) -> BinaryIO:
+        entry, raw = self._read_packed(file_path)
+        if entry is None:
+            return self.storage.open_random_access(file_path)
+        return io.BytesIO(raw)
+
+    def read_table(
+        self,
+        file_path: str,
+        columns: Optional[List[str]] = None,
+        filter: Optional[dict] = None,
+    ) -> Any:
+        if self._lookup(file_path) is None:
+            return self.storage.read_table(file_path, columns, filter)
+        return super().read_table(file_path, columns, filter)
+
+    def open_write(self, file_path: str, meta_data: Optional[dict] = None) -> BinaryIO:
+        # Streams are written on their own, replacing the packed file once committed
+        stream = self.storage.open_write(file_path, meta_data)
+        stream.add_commit_callback(lambda: self._remove_entries([file_path]))
+        return stream
+
+    def delete_file(self, file_path: str) -> None:
+        packed = self._remove_entries([file_path])
+        try:
+            self.storage.delete_file(file_path)
+        except LookupError:
+            if not packed:
+                raise
+
+    def delete_files(self, file_paths: Iterable[str]) -> list:
+        file_paths = list(file_paths)
+        packed = set(self._remove_entries(file_paths))
+        results = self.storage.delete_files(file_paths)
+        return [
+            None if path in packed and isinstance(result, LookupError) else result
+            for path, result in zip(file_paths, results)
+        ]
+
+    def copy_file(self, file_path: str, new_file_path: str) -> None:
+        """
+        Copy a file and its metadata. A packed file is copied into a pack in the
+        target directory.
+
+        Args:
+            file_path (str): The path to the file.
+            new_file_path (str): The path to copy it to.
+
+        Returns:
+            None
+        """
+        entry, raw = self._read_packed(file_path)
+        if entry is None:
+            self.storage.copy_file(file_path, new_file_path)
+            self._remove_entries([new_file_path])
+            return
+        self._pack(
+            new_file_path.rpartition("/")[0], [(0, new_file_path, raw, entry["meta"])]
+        )
+
+    def move_file(self, file_path: str, new_file_path: str) -> None:
+        if self._lookup(file_path) is None:
+            self.storage.move_file(file_path, new_file_path)
+            self._remove_entries([new_file_path])
+            return
+        self.copy_file(file_path, new_file_path)
+        self.delete_file(file_path)
+
+    def move_directory(self, file_path: str, new_file_path: str) -> None:
+        """
+        Move every file below a directory to another directory.
+        The packed files of each directory are repacked into the matching target
+        directory, then the backend moves the others.
+
+        Args:
+            file_path (str): The path to the directory.
+            new_file_path (str): The path to move it to.
+
+        Returns:
+            None
+        """
+        source, target = self._check_move(file_path, new_file_path)
+        directories = [source] + [
+            entry.path for entry in self.walk(source, stat=False) if entry.is_dir
+        ]
+        for directory in directories:
+            packed = sorted(self._get_directory(directory))
+            if not packed:
+                continue
+            new_directory = f"{target}{directory[len(source) :]}"
+            records = []
+            for name in packed:
+                entry, raw = self._read_packed(f"{directory}/{name}")
+                if entry is not None:
+                    records.append((0, f"{new_directory}/{name}", raw, entry["meta"]))
+            self._pack(new_directory, records)
+            self._drop_directory(directory)
+        self.storage.move_directory(source, target)
+
+    def list_files_in_directory(self, file_path: str) -> list:
+        files = set(self.storage.list_files_in_directory(file_path))
+        files.update(
+            os.path.splitext(name)[0]
+            for name in self._get_directory(file_path.strip("/"))
+        )
+        return list(files)
+
+    def list_subdirectories_in_directory(self, file_path: str) -> list:
+        return self.storage.list_subdirectories_in_directory(file_path)
+
+    def walk(
+        self, file_path: str = "", recursive: bool = True, stat: bool = True
+    ) -> Iterator[StorageEntry]:
+        """
+        Lazily iterate over the files and directories below a directory, packed files
+        included. Each directory is listed on its own, as a directory holding nothing
+        but packs may not show up in a recursive listing.
+
+        Args:
+            file_path (str, optional): The path to the directory. Defaults to the root.
+            recursive (bool, optional): Descend into subdirectories. Defaults to True.
+            stat (bool, optional): Fill in `size` and `mtime`. Defaults to True.
+
+        Returns:
+            Iterator[StorageEntry]: One entry per file or directory, in no particular order.
+        """
+        directories = [file_path.strip("/")]
+        while directories:
+            directory = directories.pop()
+            packed = self._get_directory(directory)
+            for entry in self.storage.walk(directory, recursive=False, stat=stat):
+                if entry.is_dir:
+                    if recursive:
+                        directories.append(entry.path)
+                elif entry.path.rpartition("/")[2] in packed:
+                    # Stored on its own and then packed, the manifest wins
+                    continue
+                yield entry
+            for name, entry in packed.items():
+                yield StorageEntry(
+                    f"{directory}/{name}" if directory else name,
+                    entry["length"] if stat else None,
+                    entry["mtime"] if stat else None,
+                    False,
+                    entry["meta"] is not None,
+                    meta_data_version(entry["meta"]),
+                )
+
+    def compact(self, file_path: str = "") -> None:
+        """
+        Rewrite the packs of a directory in which at least `compact_threshold` of the
+        bytes are no longer referenced, and delete the packs nothing refers to.
+        Files written meanwhile keep their new location.
+
+        Args:
+            file_path (str, optional): The path to the directory. Defaults to the root.
+
+        Returns:
+            None
+        """
+        directory = file_path.strip("/")
+        files = self.index.get_directory(self._index_key(directory))
+        if not files:
+            return
+        sizes = files.pop(PACKS_KEY, {})
+        live = dict.fromkeys(sizes, 0)
+        for entry in files.values():
+            live[entry["pack"]] = live.get(entry["pack"], 0) + entry["length"]
+
+        sparse = {
+            pack
+            for pack, size in sizes.items()
+            if 0 < live[pack] and size - live[pack] >= self.compact_threshold * size
+        }
+        if sparse:
+            moved = {}
+            for pack in sparse:
+                # One read per pack rather than one per file
+                data = self.storage.read_range(self._pack_path(directory, pack), 0)
+                for name, entry in files.items():
+                    if entry["pack"] == pack:
+                        offset = entry["offset"]
+                        moved[name] = (entry, data[offset : offset + entry["length"]])
+            self._pack(directory, [], moved)
+
+        # Whatever is unreferenced now, rewritten packs included, can go
+        removed = []
+
+        def _drop(files: dict) -> bool:
+            sizes = dict(files.get(PACKS_KEY, {}))
+            used = {entry["pack"] for name, entry in files.items() if name != PACKS_KEY}
+            removed[:] = [pack for pack in sizes if pack not in used]
+            for pack in removed:
+                del sizes[pack]
+            files[PACKS_KEY] = sizes
+            return bool(removed)
+
+        self.index.update_directory(self._index_key(directory), _drop)
+        if removed:
+            self.storage.delete_files(
+                [self._pack_path(directory, pack) for pack in removed]
+            )
+
+    def close(self) -> None:
+        """
+        Stop the compaction thread. Packed files stay readable.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            self._closed = True
+            thread = self._thread
+        self._wakeup.set()
+        if thread is not None:
+            thread.join()
+
+    def _pack(
+        self,
+        directory: str,
+        records: List[Tuple[int, str, bytes, Optional[dict]]],
+        moved: Optional[Dict[str, Tuple[dict, bytes]]] = None,
+    ) -> None:
+        # Write `(index, file_path, payload, meta_data)` records, and the files moved
+        # out of sparse packs, as packs, then add them to the manifest in one update
+        moved = moved or {}
+        chunks = [(record[2] for record in records), (data for _, data in moved.values())]
+        payloads = [payload for chunk in chunks for payload in chunk]
+
+        locations = []
+        packs = {}
+        start = 0
+        while start < len(payloads):
+            pack = f"{uuid.uuid4().hex}{PACK_EXTENSION}"
+            end, size = start, 0
+            # Every pack takes at least one file
+            while end < len(payloads) and (
+                end == start or size + len(payloads[end]) <= self.pack_size
+            ):
+                locations.append((pack, size, len(payloads[end])))
+                size += len(payloads[end])
+                end += 1
+            with self.storage.open_write(self._pack_path(directory, pack)) as f:
+                for payload in payloads[start:end]:
+                    f.write(payload)
+            packs[pack] = size
+            start = end
+        if not packs:
+            return
+
+        now = time.time()
+        written = {}
+        for (_, file_path, _, meta_data), (pack, offset, length) in zip(
+            records, locations
+        ):
+            name = file_path.rpartition("/")[2]
+            written[name] = (pack, offset, length, meta_data)
+        relocations = dict(zip(moved, locations[len(records) :]))
+        replaced = []
+
+        def _add(files: dict) -> None:
+            files[PACKS_KEY] = {**files.get(PACKS_KEY, {}), **packs}
+            replaced.clear()
+            for name, (pack, offset, length, meta_data) in written.items():
+                previous = files.get(name)
+                if previous is not None:
+                    replaced.append(name)
+                    if meta_data is None:
+                        meta_data = previous["meta"]
+                files[name] = {
+                    "pack": pack,
+                    "offset": offset,
+                    "length": length,
+                    "mtime": now,
+                    "meta": meta_data,
+                }
+            for name, (pack, offset, length) in relocations.items():
+                # Unless the file was rewritten or deleted since it was read
+                if files.get(name) == moved[name][0]:
+                    files[name] = {**moved[name][0], "pack": pack, "offset": offset}
+
+        self.index.update_directory(self._index_key(directory), _add)
+        if replaced:
+            self._mark_garbage(directory)
+        # Storing a file on its own removes it from the manifest, so only files new to
+        # the manifest can have a copy stored on their own, which is then removed
+        new = set(written).difference(replaced)
+        if new:
+            loose = [
+                entry.path
+                for entry in self.storage.walk(directory, recursive=False, stat=False)
+                if not entry.is_dir and entry.path.rpartition("/")[2] in new
+            ]
+            if loose:
+                self.storage.delete_files(loose)
+
+    def _remove_entries(self, file_paths: List[str]) -> List[str]:
+        # Remove packed files from their manifests, returning those that were packed
+        by_directory = {}
+        for file_path in file_paths:
+            directory, _, name = file_path.rpartition("/")
+            by_directory.setdefault(directory, set()).add(name)
+
+        removed = []
+        for directory, names in by_directory.items():
+            if not names & set(self._get_directory(directory)):
+                continue
+            found = []
+
+            def _remove(files: dict, names=names, found=found) -> bool:
+                found[:] = [name for name in names if files.pop(name, None) is not None]
+                return bool(found)
+
+            self.index.update_directory(self._index_key(directory), _remove)
+            if found:
+                self._mark_garbage(directory)
+                removed += [f"{directory}/{name}" if directory else name for name in found]
+        return removed
+
+    def _drop_directory(self, directory: str) -> None:
+        # Delete the manifest of a directory and every pack it lists
+        files = self.index.get_directory(self._index_key(directory)) or {}
+        paths = [self._pack_path(directory, pack) for pack in files.get(PACKS_KEY, {})]
+        paths.append(
+            f"{directory}/{PACK_INDEX_FILE_NAME}" if directory else PACK_INDEX_FILE_NAME
+        )
+        self.storage.delete_files(paths)
+        self.index.invalidate(self._index_key(directory))
+
+    def _lookup(self, file_path: str) -> Optional[dict]:
+        _, entry = self.index.lookup(self._index_key(file_path.strip("/")))
+        return entry
+
+    def _get_directory(self, directory: str) -> Dict[str, dict]:
+        # The packed files of a directory, without the pack sizes
+        files = self.index.get_directory(self._index_key(directory)) or {}
+        files.pop(PACKS_KEY, None)
+        return files
+
+    def _read_packed(
+        self,
+        file_path: str,
+        entry: Optional[dict] = None,
+        start: int = 0,
+        end: Optional[int] = None,
+    ) -> Tuple[Optional[dict], Optional[bytes]]:
+        # Read the raw bytes of a packed file, or `(None, None)` if it is not packed
+        for attempt in range(2):
+            if entry is None:
+                entry = self._lookup(file_path)
+                if entry is None:
+                    return None, None
+            length = entry["length"] if end is None else end
+            offset = entry["offset"]
+            try:
+                raw = self.storage.read_range(
+                    self._pack_path(file_path.rpartition("/")[0], entry["pack"]),
+                    offset + start,
+                    offset + length,
+                )
+            except LookupError:
+                raw = None
+            if raw is not None and len(raw) == length - start:
+                return entry, raw
+            # The pack was compacted away since the manifest was read
+            self.index.invalidate(self._index_key(file_path.rpartition("/")[0]))
+            entry = None
+        raise NotFoundError(file_path)
+
+    def _open_raw(self, file_path: str, raw: bytes) -> BinaryIO:
+        return self.storage.compression.wrap_reader(
+            file_path, io.BufferedReader(io.BytesIO(raw))
+        )
+
+    def _pack_path(self, directory: str, pack: str) -> str:
+        path = f"{PACK_DIRECTORY_NAME}/{pack}"
+        return f"{directory}/{path}" if directory else path
+
+    def _index_key(self, file_path: str) -> str:
+        # The backend's index primitives take what its own index uses, e.g. local
+        # storage addresses manifests by their path on disk
+        root_dir = getattr(self.storage, "root_dir", None)
+        return os.path.join(root_dir, file_path) if root_dir is not None else file_path
+
+    def _mark_garbage(self, directory: str) -> None:
+        if self.compact_interval <= 0:
+            return
+        with self._lock:
+            if self._closed:
+                return
+            self._garbage.add(directory)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        while not self._wakeup.wait(self.compact_interval):
+            with self._lock:
+                directories, self._garbage = self._garbage, set()
+            for directory in directories:
+                try:
+                    self.compact(directory)
+                except Exception:
+                    # Try again in the next round
+                    with self._lock:
+                        self._garbage.add(directory)
+
+
+def _get_version(entry: dict) -> str:
+    return f"{entry['pack']}:{entry['offset']}"
+
+
+def _is_not_modified(
+    entry: dict, if_none_match: Optional[str], if_modified_since: Optional[datetime]
+) -> bool:
+    if if_none_match is not None:
+        return if_none_match == _get_version(entry)
+    if if_modified_since is not None:
+        return entry["mtime"] <= if_modified_since.timestamp()
+    return False
@@ -0,0 +1,149 @@
+from typing import BinaryIO, Iterable, List, Optional
+
+from PyPDF2 import PdfReader
+from PyPDF2.generic import IndirectObject, NameObject
+from PyPDF2._page import PageObject
+
+# Page attributes a page takes from its ancestors in the page tree if it lacks them
+INHERITABLE_ATTRIBUTES = ("/Resources", "/MediaBox", "/CropBox", "/Rotate")
+
+
+def is_unmodified(reader: PdfReader) -> bool:
+    """
+    Whether a document can be saved by copying its original bytes.
+    Pages can only be changed once `reader.pages` has built the page list, so a
+    document whose pages were never listed is unchanged.
+    """
+    return reader.flattened_pages is None and not reader.is_encrypted
+
+
+def source_bytes(reader: PdfReader) -> bytes:
+    """
+    The bytes a document was read from.
+    """
+    stream = reader.stream
+    position = stream.tell()
+    try:
+        stream.seek(0)
+        return stream.read()
+    finally:
+        stream.seek(position)
+
+
+def page_count(reader: PdfReader) -> int:
+    """
+    Count the pages of a document from the root of its page tree, without loading the
+    tree.
+    """
+    return int(reader.trailer["/Root"].get_object()["/Pages"].get_object()["/Count"])
+
+
+def document_info(reader: PdfReader) -> dict:
+    """
+    The document information dictionary, e.g. title and author, as plain strings.
+    """
+    metadata = reader.metadata or {}
+    return {key: str(value) for key, value in metadata.items()}
+
+
+def get_page(reader: PdfReader, index: int) -> PageObject:
+    """
+    Load one page, descending the page tree by the page counts of its nodes so only
+    the nodes on the path to the page are parsed.
+
+    Args:
+        reader (PdfReader): The document.
+        index (int): The zero-based page number. Negative numbers count from the end.
+
+    Returns:
+        PageObject: The page.
+    """
+    count = page_count(reader)
+    if index < 0:
+        index += count
+    if not 0 <= index < count:
+        raise IndexError(f"Page {index} is out of range for {count} pages.")
+
+    node = reader.trailer["/Root"].get_object()["/Pages"].get_object()
+    inherited = {}
+    while True:
+        for attribute in INHERITABLE_ATTRIBUTES:
+            if attribute in node:
+                inherited[attribute] = node[attribute]
+
+        for kid in node["/Kids"]:
+            kid_node = kid.get_object()
+            if kid_node.get("/Type") == "/Pages":
+                kid_count = int(kid_node["/Count"])
+                if index < kid_count:
+                    node = kid_node
+                    break
+                index -= kid_count
+            elif index == 0:
+                reference = kid if isinstance(kid, IndirectObject) else None
+                page = PageObject(reader, reference)
+                page.update(kid_node)
+                for attribute, value in inherited.items():
+                    if attribute not in page:
+                        page[NameObject(attribute)] = value
+                return page
+            else:
+                index -= 1
+        else:
+            raise ValueError("The page tree does not match its page counts.")
+
+
+class PdfPages(List[PageObject]):
+    """
+    The pages loaded by `read_pages`: a list that also owns the stream they read their
+    contents from. Close it, or use it as a context manager, once the pages are no
+    longer used.
+    """
+
+    def __init__(self, pages: Iterable[PageObject], source: BinaryIO) -> None:
+        super().__init__(pages)
+        self.source = source
+
+    def close(self) -> None:
+        self.source.close()
+
+    def __enter__(self) -> "PdfPages":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+
+def read_pages(source: BinaryIO, pages: Optional[Iterable[int]] = None) -> PdfPages:
+    """
+    Load some pages of a document from a seekable stream.
+    Page contents are only read from the stream when they are used, so the stream must
+    stay open for as long as the pages are. Closing the result closes it.
+
+    Args:
+        source (BinaryIO): A seekable stream of the document.
+        pages (Optional[Iterable[int]], optional): The zero-based page numbers. Defaults
+            to all pages.
+
+    Returns:
+        PdfPages: The pages, in the order requested.
+    """
+    reader = PdfReader(source)
+    if pages is None:
+        return PdfPages(reader.pages, source)
+    return PdfPages((get_page(reader, index) for index in pages), source)
+
+
+def read_info(source: BinaryIO) -> dict:
+    """
+    Read the page count and document information of a document from a seekable stream,
+    without loading any page.
+
+    Args:
+        source (BinaryIO): A seekable stream of the document.
+
+    Returns:
+        dict: `{"pages": int, "metadata": dict}`.
+    """
+    reader = PdfReader(source)
+    return {"pages": page_count(reader), "metadata": document_info(reader)}
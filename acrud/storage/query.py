@@ -0,0 +1,215 @@
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Operators accepted in a filter, mapped to SQL
+OPERATORS = {
+    "==": "IS",
+    "!=": "IS NOT",
+    "<": "<",
+    "<=": "<=",
+    ">": ">",
+    ">=": ">=",
+}
+
+
+def _json_path(field: str) -> str:
+    # Dotted field names address nested metadata, e.g. "schema.version"
+    if '"' in field or "'" in field:
+        raise ValueError(f"Invalid metadata field: {field!r}")
+    return "$" + "".join(f'."{part}"' for part in field.split("."))
+
+
+def _prefix_clause(prefix: str, use_index: bool = True) -> Tuple[str, list]:
+    # A range over the primary key, so only the rows below the prefix are visited.
+    # The unary "+" stops SQLite from choosing it over a field's expression index.
+    if not prefix:
+        return "1", []
+    column = "path" if use_index else "+path"
+    return f"({column} >= ? AND {column} < ?)", [prefix + "/", prefix + "0"]
+
+
+def _is_unchanged(row: tuple, entry) -> bool:
+    # A file's metadata version, where the backend has one, catches metadata edits
+    # that leave the data alone, and is exact where modification times are coarse
+    mtime, size, has_metadata, meta_version = row
+    if bool(has_metadata) != entry.has_metadata:
+        return False
+    if entry.meta_version is not None:
+        return meta_version == entry.meta_version
+    return (mtime, size) == (entry.mtime, entry.size)
+
+
+class QueryIndex:
+    """
+    A SQLite index of file metadata, used to find files by their metadata without
+    reading any data.
+
+    Each row holds a file's path, its modification time and size, the version of its
+    metadata and the metadata itself as JSON. `refresh` walks the storage and only
+    reads the metadata of files whose metadata version, or, where the backend has none,
+    modification time or size, has changed since the last walk. Fields used in a filter
+    get a SQLite expression index the first time they are queried, so later equality
+    and range queries are index lookups.
+    """
+
+    def __init__(self, path: str = ":memory:") -> None:
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._indexed_fields = set()
+        # prefix -> when its last walk started
+        self._refreshed: Dict[str, float] = {}
+        with self._lock, self._connection:
+            columns = [
+                row[1]
+                for row in self._connection.execute("PRAGMA table_info(files)")
+            ]
+            if columns and "meta_version" not in columns:
+                # Written by an older version, the index is rebuilt by the next walk
+                self._connection.execute("DROP TABLE files")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS files ("
+                "path TEXT PRIMARY KEY, mtime REAL, size INTEGER, "
+                "has_metadata INTEGER, meta_version TEXT, meta_data TEXT) WITHOUT ROWID"
+            )
+
+    def refresh(self, storage, prefix: str = "", max_age: Optional[float] = None) -> None:
+        """
+        Bring the index up to date with the files below a directory.
+        Files whose metadata cannot be read are logged and left out, so the next
+        refresh, which the directory is then not spared by `max_age`, reads them again.
+
+        Args:
+            storage (StorageBase): The storage to walk.
+            prefix (str, optional): The path to the directory. Defaults to the root.
+            max_age (Optional[float], optional): Skip the walk if the directory, or one
+                above it, was walked less than this many seconds ago. Defaults to
+                always walking.
+
+        Returns:
+            None
+        """
+        prefix = prefix.strip("/")
+        started = time.monotonic()
+        if max_age is not None:
+            with self._lock:
+                for path, refreshed in self._refreshed.items():
+                    covers = not path or prefix == path or prefix.startswith(path + "/")
+                    if covers and started - refreshed < max_age:
+                        return
+
+        clause, parameters = _prefix_clause(prefix)
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT path, mtime, size, has_metadata, meta_version FROM files "
+                f"WHERE {clause}",
+                parameters,
+            ).fetchall()
+        known = {row[0]: row[1:] for row in rows}
+
+        changed = []
+        for entry in storage.walk(prefix):
+            if entry.is_dir:
+                continue
+            row = known.pop(entry.path, None)
+            if row is None or not _is_unchanged(row, entry):
+                changed.append(entry)
+
+        # Only files with metadata need a read, and those are read in parallel
+        with_meta_data = [entry for entry in changed if entry.has_metadata]
+        results = storage._map(
+            storage.read_meta_data, ((entry.path,) for entry in with_meta_data)
+        )
+        meta_data = {}
+        failed = set()
+        for entry, result in zip(with_meta_data, results):
+            if isinstance(result, BaseException):
+                # Not recorded, so the next refresh reads it again
+                logger.warning("Failed to read the metadata of %s: %r", entry.path, result)
+                failed.add(entry.path)
+            elif isinstance(result, dict):
+                meta_data[entry.path] = json.dumps(result)
+        changed = [entry for entry in changed if entry.path not in failed]
+
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    (
+                        entry.path,
+                        entry.mtime,
+                        entry.size,
+                        entry.has_metadata,
+                        entry.meta_version,
+                        meta_data.get(entry.path),
+                    )
+                    for entry in changed
+                ),
+            )
+            # Whatever the walk did not see has been deleted
+            self._connection.executemany(
+                "DELETE FROM files WHERE path = ?", ((path,) for path in known)
+            )
+            if not failed:
+                self._refreshed[prefix] = started
+
+    def query(self, prefix: str = "", filter: Optional[dict] = None) -> Dict[str, dict]:
+        """
+        Find the files below a directory whose metadata matches a filter.
+
+        Args:
+            prefix (str, optional): The path to the directory. Defaults to the root.
+            filter (Optional[dict], optional): Field names mapped to a value to match,
+                or to a dict of operators (`==`, `!=`, `<`, `<=`, `>`, `>=`, `in`) and
+                values. Nested fields are addressed with dots. Defaults to matching
+                every file with metadata.
+
+        Returns:
+            Dict[str, dict]: The paths of the matching files mapped to their metadata.
+        """
+        clause, parameters = _prefix_clause(prefix.strip("/"), use_index=not filter)
+        conditions = [clause, "meta_data IS NOT NULL"]
+
+        for field, condition in (filter or {}).items():
+            expression = f"json_extract(meta_data, '{_json_path(field)}')"
+            self._ensure_field_index(field, expression)
+            if not isinstance(condition, dict):
+                condition = {"==": condition}
+
+            for operator, value in condition.items():
+                if operator == "in":
+                    values = list(value)
+                    placeholders = ", ".join("?" * len(values))
+                    conditions.append(f"{expression} IN ({placeholders})")
+                    parameters.extend(values)
+                elif operator in OPERATORS:
+                    conditions.append(f"{expression} {OPERATORS[operator]} ?")
+                    parameters.append(value)
+                else:
+                    raise ValueError(f"Unsupported operator: {operator!r}")
+
+        with self._lock:
+            rows = self._connection.execute(
+                f"SELECT path, meta_data FROM files WHERE {' AND '.join(conditions)}",
+                parameters,
+            ).fetchall()
+        return {path: json.loads(meta_data) for path, meta_data in rows}
+
+    def close(self) -> None:
+        self._connection.close()
+
+    def _ensure_field_index(self, field: str, expression: str) -> None:
+        if field in self._indexed_fields:
+            return
+        name = "meta_" + hashlib.sha1(field.encode("utf-8")).hexdigest()[:16]
+        with self._lock, self._connection:
+            self._connection.execute(
+                f'CREATE INDEX IF NOT EXISTS "{name}" ON files({expression})'
+            )
+        self._indexed_fields.add(field)
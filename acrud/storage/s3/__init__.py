@@ -1 +1,11 @@
-from .s3 import S3Storage
+def __getattr__(name: str):
+    # boto3 and aiobotocore are slow to import, so each backend is imported when used
+    if name == "S3Storage":
+        from .s3 import S3Storage
+
+        return S3Storage
+    if name == "AsyncS3Storage":
+        from .async_s3 import AsyncS3Storage
+
+        return AsyncS3Storage
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
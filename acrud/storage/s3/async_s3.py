@@ -0,0 +1,210 @@
+import asyncio
+import os
+from contextlib import AsyncExitStack
+from typing import AsyncIterator, Optional, Tuple, Any
+
+from botocore.exceptions import ClientError
+
+try:
+    from aiobotocore.config import AioConfig
+    from aiobotocore.session import get_session
+except ImportError:  # aiobotocore is only needed for the async backend
+    get_session = None
+
+from ..base import AsyncStorageBase
+from ..compression import Compression
+from ..convert import decode, decode_meta_data, encode, encode_meta_data
+from .. import utils
+from .client import (
+    DEFAULT_MAX_POOL_CONNECTIONS,
+    client_options,
+    config_kwargs,
+    not_found,
+)
+
+
+class AsyncS3Storage(AsyncStorageBase):
+    """
+    An asyncio CRUD interface for S3, built on aiobotocore.
+    The client is created on first use and released by `close`, or by using the
+    storage as an async context manager.
+    """
+
+    def __init__(self, config) -> None:
+        if get_session is None:
+            raise ImportError(
+                "AsyncS3Storage requires aiobotocore. Install it with `pip install acrud[async]`."
+            )
+        self.bucket = config.bucket
+        self.max_concurrency = utils.get_config_option(
+            config, "MAX_CONCURRENCY", self.max_concurrency, int
+        )
+        self.compression = Compression.from_config(config)
+        # Clients are bound to the event loop they were created on, so each storage
+        # has its own, sized for the operations it runs at once
+        self._client_config = AioConfig(
+            **config_kwargs(
+                client_options(
+                    config, max(DEFAULT_MAX_POOL_CONNECTIONS, self.max_concurrency)
+                )
+            )
+        )
+        self._session = get_session()
+        self._client = None
+        self._client_lock = None
+        self._exit_stack = None
+
+    async def __aenter__(self) -> "AsyncS3Storage":
+        await self._get_client()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+    async def _get_client(self):
+        if self._client is None:
+            if self._client_lock is None:
+                self._client_lock = asyncio.Lock()
+            async with self._client_lock:
+                if self._client is None:
+                    exit_stack = AsyncExitStack()
+                    self._client = await exit_stack.enter_async_context(
+                        self._session.create_client("s3", config=self._client_config)
+                    )
+                    self._exit_stack = exit_stack
+        return self._client
+
+    async def close(self) -> None:
+        """
+        Close the underlying client and its connection pool.
+        """
+        if self._exit_stack is not None:
+            await self._exit_stack.aclose()
+        self._client = None
+        self._exit_stack = None
+
+    async def ping(self) -> dict:
+        client = await self._get_client()
+        await client.head_bucket(Bucket=self.bucket)
+        return {"response": "pong"}
+
+    async def _get_object_bytes(self, key: str) -> bytes:
+        client = await self._get_client()
+        response = await client.get_object(Bucket=self.bucket, Key=key)
+        async with response["Body"] as stream:
+            return await stream.read()
+
+    async def create_file(
+        self, file_path: str, data: Any, meta_data: Optional[dict] = None
+    ) -> None:
+        """
+        Save a file to S3.
+        The data and meta data are uploaded concurrently.
+
+        Args:
+            file_path (str): The path to the file.
+            data (Any): The data to save.
+            meta_data (Optional[dict], optional): The meta data to save. Defaults
+
+        Returns:
+            None
+        """
+        client = await self._get_client()
+
+        uploads = [
+            client.put_object(
+                Body=self.compression.compress(file_path, encode(file_path, data)),
+                Bucket=self.bucket,
+                Key=file_path,
+            )
+        ]
+        if meta_data is not None:
+            meta_data_file_path = utils.get_meta_data_file_path(file_path)
+            uploads.append(
+                client.put_object(
+                    Body=encode_meta_data(meta_data),
+                    Bucket=self.bucket,
+                    Key=meta_data_file_path,
+                )
+            )
+        await asyncio.gather(*uploads)
+
+    async def read_file(self, file_path: str) -> Tuple[Any, Optional[dict]]:
+        """
+        Read a file from S3.
+        The data and meta data are downloaded concurrently.
+
+        Args:
+            file_path (str): The path to the file.
+
+        Returns:
+            Tuple[Any, Optional[dict]]: The data and, if available, the meta data.
+
+        Raises:
+            NotFoundError: If the file does not exist.
+        """
+        meta_data_file_path = utils.get_meta_data_file_path(file_path)
+        obj, meta_obj = await asyncio.gather(
+            self._get_object_bytes(file_path),
+            self._get_object_bytes(meta_data_file_path),
+            return_exceptions=True,
+        )
+        if isinstance(obj, ClientError):
+            raise not_found(obj, file_path) or obj
+        if isinstance(obj, BaseException):
+            raise obj
+
+        data = decode(file_path, self.compression.decompress(file_path, obj))  # Converts file data
+
+        # Most files have no metadata, so only a missing metadata key is expected
+        if isinstance(meta_obj, ClientError) and not_found(meta_obj, file_path):
+            meta_data = None
+        elif isinstance(meta_obj, BaseException):
+            raise meta_obj
+        else:
+            meta_data = decode_meta_data(meta_obj)
+
+        return data, meta_data
+
+    async def update_file(
+        self, file_path: str, data: Any, meta_data: Optional[dict] = None
+    ) -> None:
+        # In s3 we simply overwrite the file
+        await self.create_file(file_path, data, meta_data)
+
+    async def delete_file(self, file_path: str) -> None:
+        client = await self._get_client()
+        meta_data_file_path = utils.get_meta_data_file_path(file_path)
+        await asyncio.gather(
+            client.delete_object(Bucket=self.bucket, Key=file_path),
+            client.delete_object(Bucket=self.bucket, Key=meta_data_file_path),
+        )
+
+    async def list_files_in_directory(self, file_path: str) -> list:
+        names = []
+        async for page in self._iter_directory_pages(file_path):
+            for obj in page.get("Contents", []):
+                name = obj["Key"].rsplit("/", 1)[-1]
+                if not name or name.startswith(".") or name.endswith("_meta.json"):
+                    continue
+                names.append(os.path.splitext(name)[0])
+        return list(dict.fromkeys(names))
+
+    async def list_subdirectories_in_directory(self, file_path: str) -> list:
+        names = []
+        async for page in self._iter_directory_pages(file_path):
+            for prefix in page.get("CommonPrefixes", []):
+                name = prefix["Prefix"].rstrip("/").rsplit("/", 1)[-1]
+                if not name.startswith("."):
+                    names.append(name)
+        return names
+
+    async def _iter_directory_pages(self, file_path: str) -> AsyncIterator[dict]:
+        client = await self._get_client()
+        prefix = file_path.strip("/")
+        prefix = prefix + "/" if prefix else ""
+        paginator = client.get_paginator("list_objects_v2")
+        async for page in paginator.paginate(
+            Bucket=self.bucket, Prefix=prefix, Delimiter="/"
+        ):
+            yield page
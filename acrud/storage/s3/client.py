@@ -0,0 +1,156 @@
+import os
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+from .. import utils
+from ...exception import NotFoundError
+
+# botocore's own default, raised by `S3Storage` to cover its worker threads
+DEFAULT_MAX_POOL_CONNECTIONS = 10
+DEFAULT_RETRY_MODE = "standard"
+
+# Clients are thread-safe and own their connection pool, so storages with the same
+# settings share one client, created from one session. Sessions are not thread-safe,
+# so clients are only created under the lock.
+_session = None
+_clients: Dict[Tuple, Any] = {}
+_lock = threading.Lock()
+
+
+def client_options(
+    config, max_pool_connections: int = DEFAULT_MAX_POOL_CONNECTIONS
+) -> Dict[str, Any]:
+    """
+    Read the S3 client settings from a `StorageConfig`.
+
+    Args:
+        config (StorageConfig): The storage configuration.
+        max_pool_connections (int, optional): The pool size if `MAX_POOL_CONNECTIONS`
+            is not set. Defaults to 10.
+
+    Returns:
+        Dict[str, Any]: The settings, with `None` for those left to botocore.
+    """
+    return {
+        "max_pool_connections": utils.get_config_option(
+            config, "MAX_POOL_CONNECTIONS", max_pool_connections, int
+        ),
+        "retry_mode": utils.get_config_option(
+            config, "RETRY_MODE", DEFAULT_RETRY_MODE, str.lower
+        ),
+        "max_attempts": utils.get_config_option(config, "RETRY_MAX_ATTEMPTS", None, int),
+        "tcp_keepalive": utils.get_config_option(config, "TCP_KEEPALIVE", True, bool),
+        "connect_timeout": utils.get_config_option(
+            config, "CONNECT_TIMEOUT", None, float
+        ),
+        "read_timeout": utils.get_config_option(config, "READ_TIMEOUT", None, float),
+    }
+
+
+def config_kwargs(options: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Turn the settings from `client_options` into arguments for `botocore.config.Config`,
+    or aiobotocore's `AioConfig`.
+    """
+    retries = {"mode": options["retry_mode"]}
+    if options["max_attempts"] is not None:
+        retries["max_attempts"] = options["max_attempts"]
+
+    kwargs = {
+        "max_pool_connections": options["max_pool_connections"],
+        "retries": retries,
+        "tcp_keepalive": options["tcp_keepalive"],
+    }
+    # botocore treats None as no timeout, so unset timeouts keep its defaults
+    for name in ("connect_timeout", "read_timeout"):
+        if options[name] is not None:
+            kwargs[name] = options[name]
+    return kwargs
+
+
+def get_client(options: Dict[str, Any], shared: bool = True):
+    """
+    Get an S3 client with the given settings, reusing the process-wide client created
+    with the same settings, and its warm connections, if there is one.
+
+    Args:
+        options (Dict[str, Any]): The settings, from `client_options`.
+        shared (bool, optional): Whether to share the client. Defaults to True.
+
+    Returns:
+        The boto3 S3 client.
+    """
+    global _session
+
+    # Connection pools must not be used on both sides of a fork
+    key = (os.getpid(), *sorted(options.items()))
+    client = _clients.get(key) if shared else None
+    if client is not None:
+        return client
+
+    with _lock:
+        client = _clients.get(key) if shared else None
+        if client is None:
+            if _session is None:
+                # Imported here, as the async backend only uses the settings
+                import boto3
+
+                _session = boto3.session.Session()
+            client = _session.client("s3", config=Config(**config_kwargs(options)))
+            if shared:
+                # Drop clients inherited from a parent process
+                for stale in [k for k in _clients if k[0] != key[0]]:
+                    del _clients[stale]
+                _clients[key] = client
+    return client
+
+
+def clear_clients() -> None:
+    """
+    Forget the shared clients and session, e.g. after the credentials change.
+    Storages already created keep using their client.
+    """
+    global _session
+
+    with _lock:
+        _clients.clear()
+        _session = None
+
+
+class S3NotFoundError(NotFoundError, ClientError):
+    """
+    Raised when an S3 object does not exist.
+    It is also the `ClientError` S3 responded with, so code catching `ClientError`
+    keeps working.
+    """
+
+    def __init__(
+        self, file_path: str, response: dict, operation_name: str = "GetObject"
+    ) -> None:
+        NotFoundError.__init__(self, file_path)
+        self.response = response
+        self.operation_name = operation_name
+
+    def __reduce__(self):
+        return type(self), (self.filename, self.response, self.operation_name)
+
+
+def not_found(error: ClientError, file_path: str) -> Optional[S3NotFoundError]:
+    """
+    Get the `S3NotFoundError` for a `ClientError` if it reports a missing key.
+
+    Args:
+        error (ClientError): The error from S3.
+        file_path (str): The path that was requested.
+
+    Returns:
+        Optional[S3NotFoundError]: The error to raise instead, or None if the key
+            was not missing.
+    """
+    # HEAD responses have no body, so a missing key only shows as its status code
+    if error.response.get("Error", {}).get("Code") not in ("NoSuchKey", "404"):
+        return None
+    return S3NotFoundError(file_path, error.response, error.operation_name)
@@ -1,12 +1,34 @@
+import heapq
+import io
+import mimetypes
 import os
-from typing import Optional, Tuple, Any
+from datetime import datetime
+from typing import BinaryIO, Dict, Iterable, Iterator, Optional, Tuple, Any, Union
 
-import boto3
 from botocore.exceptions import ClientError
 
-from ..base import StorageBase
-from ..convert import convert, get_type
+from ..base import (
+    NOT_MODIFIED,
+    FileStat,
+    StorageBase,
+    StorageEntry,
+    _NotModified,
+    _raise_first,
+)
+from ..compression import Compression
+from ..convert import decode, decode_meta_data, encode, encode_meta_data
+from ..index import DEFAULT_TTL, MetadataIndex, meta_data_version
+from ..stream import CHUNK_SIZE, RangeReader, StreamWriter, iter_file
 from .. import utils
+from ...exception import NotFoundError
+from . import client, transfer
+from .stream import S3MultipartWriter, S3Reader
+
+# S3 accepts at most 1,000 keys per DeleteObjects request
+MAX_DELETE_KEYS = 1000
+
+# Small reads from `open_random_access` fetch aligned blocks of this size
+RANGE_READ_SIZE = 64 * 1024
 
 
 class S3Storage(StorageBase):
@@ -15,8 +37,58 @@ class S3Storage(StorageBase):
     """
 
     def __init__(self, config) -> None:
-        self.client = boto3.client("s3")
         self.bucket = config.bucket
+        self.max_workers = utils.get_config_option(
+            config, "MAX_WORKERS", self.max_workers, int
+        )
+        self.query_index_path = utils.get_config_option(
+            config, "QUERY_INDEX_PATH", self.query_index_path
+        )
+        self.query_refresh_ttl = utils.get_config_option(
+            config, "QUERY_REFRESH_TTL", self.query_refresh_ttl, float
+        )
+        self.compression = Compression.from_config(config)
+
+        # Objects above the threshold are transferred in concurrent parts
+        self.multipart_threshold = utils.get_config_option(
+            config, "MULTIPART_THRESHOLD", transfer.DEFAULT_MULTIPART_THRESHOLD, int
+        )
+        self.part_size = utils.get_config_option(
+            config, "MULTIPART_PART_SIZE", transfer.DEFAULT_PART_SIZE, int
+        )
+        self.transfer_concurrency = utils.get_config_option(
+            config, "MULTIPART_CONCURRENCY", transfer.DEFAULT_CONCURRENCY, int
+        )
+        self.transfer_retries = utils.get_config_option(
+            config, "MULTIPART_RETRIES", transfer.DEFAULT_RETRIES, int
+        )
+
+        # The pool needs a connection per worker thread, or the workers queue on it
+        options = client.client_options(
+            config,
+            max(
+                client.DEFAULT_MAX_POOL_CONNECTIONS,
+                self.max_workers,
+                self.transfer_concurrency,
+            ),
+        )
+        self.client = client.get_client(
+            options, shared=utils.get_config_option(config, "SHARE_CLIENT", True, bool)
+        )
+
+        # Keep metadata in one index per directory instead of an object per file
+        self.metadata_index = None
+        if utils.get_config_option(config, "METADATA_INDEX", False, bool):
+            self.metadata_index = MetadataIndex(
+                self._load_index,
+                self._store_index,
+                ttl=utils.get_config_option(
+                    config, "METADATA_INDEX_TTL", DEFAULT_TTL, float
+                ),
+                seed=lambda index_path: self._read_meta_data_files(
+                    index_path.rpartition("/")[0]
+                ),
+            )
 
     def ping(self) -> dict:
         try:
@@ -43,64 +115,478 @@ class S3Storage(StorageBase):
             None
         """
 
-        # Save the data
-        data = convert(data, bytes)
-        self.client.put_object(Body=data, Bucket=self.bucket, Key=file_path)
+        self.write_raw(
+            file_path,
+            self.compression.compress(file_path, encode(file_path, data)),
+            meta_data,
+        )
+
+    def read_file(
+        self,
+        file_path: str,
+        if_none_match: Optional[str] = None,
+        if_modified_since: Optional[datetime] = None,
+        stream: bool = False,
+    ) -> Union[Tuple[Any, Optional[dict]], _NotModified]:
+        """
+        Read a file from S3.
+        The data will be converted to the appropriate type.
+        The meta data, if provided, will be converted to a dictionary.
+
+        Args:
+            file_path (str): The path to the file.
+            if_none_match (Optional[str], optional): Return `NOT_MODIFIED` if the
+                object still has this ETag.
+            if_modified_since (Optional[datetime], optional): Return `NOT_MODIFIED` if the
+                object has not been modified since this time.
+            stream (bool, optional): Return a lazy iterator over the rows of a CSV file
+                (or the lines of a text file) instead of loading it. Defaults to False.
+
+        Returns:
+            Union[Tuple[Any, Optional[dict]], _NotModified]: The data and, if available,
+                the meta data.
+
+        Raises:
+            NotFoundError: If the file does not exist.
+        """
+        if stream:
+            rows = iter_file(self.open_read(file_path), file_path)
+            return rows, self._read_meta_data(file_path)
+
+        result = self.read_file_with_version(file_path, if_none_match, if_modified_since)
+        if result is NOT_MODIFIED:
+            return result
+        data, meta_data, _ = result
+        return data, meta_data
 
-        # Save the metadata
+    def read_file_with_version(
+        self,
+        file_path: str,
+        if_none_match: Optional[str] = None,
+        if_modified_since: Optional[datetime] = None,
+    ) -> Union[Tuple[Any, Optional[dict], str], _NotModified]:
+        """
+        Read a file from S3 along with its ETag.
+        The conditions are sent with the `GetObject` request, so an unchanged object
+        costs a 304 response and no body transfer.
+
+        Args:
+            file_path (str): The path to the file.
+            if_none_match (Optional[str], optional): An ETag from a previous read.
+            if_modified_since (Optional[datetime], optional): Only read the object if it
+                was modified after this time.
+
+        Returns:
+            Union[Tuple[Any, Optional[dict], str], _NotModified]: The data, the meta data
+                and the ETag, or `NOT_MODIFIED`.
+
+        Raises:
+            NotFoundError: If the file does not exist.
+        """
+
+        conditions = {}
+        if if_none_match is not None:
+            conditions["IfNoneMatch"] = if_none_match
+        if if_modified_since is not None:
+            conditions["IfModifiedSince"] = if_modified_since
+
+        result = self._get_object(file_path, **conditions)
+        if result is NOT_MODIFIED:
+            return NOT_MODIFIED
+        obj, version = result
+        data = decode(file_path, self.compression.decompress(file_path, obj))  # Converts file data
+        meta_data = self._read_meta_data(file_path)
+
+        # Create the file object
+        return data, meta_data, version
+
+    def read_raw(
+        self, file_path: str, if_none_match: Optional[str] = None
+    ) -> Union[Tuple[Union[bytes, bytearray], str], _NotModified]:
+        """
+        Read the bytes of a file exactly as stored in S3, without decompressing or
+        decoding them, along with its ETag.
+
+        Args:
+            file_path (str): The path to the file.
+            if_none_match (Optional[str], optional): Return `NOT_MODIFIED` if the object
+                still has this ETag.
+
+        Returns:
+            Union[Tuple[Union[bytes, bytearray], str], _NotModified]: The bytes and the
+                ETag, or `NOT_MODIFIED`.
+
+        Raises:
+            NotFoundError: If the file does not exist.
+        """
+        if if_none_match is not None:
+            return self._get_object(file_path, IfNoneMatch=if_none_match)
+        return self._get_object(file_path)
+
+    def write_raw(
+        self, file_path: str, data: bytes, meta_data: Optional[dict] = None
+    ) -> str:
+        """
+        Save bytes to S3 exactly as given, without encoding or compressing them, e.g.
+        bytes returned by `read_raw`. Without new metadata the file keeps its old
+        metadata, as with `create_file`.
+
+        Args:
+            file_path (str): The path to the file.
+            data (bytes): The stored contents of the file.
+            meta_data (Optional[dict], optional): The meta data to save. Defaults to None.
+
+        Returns:
+            str: The ETag of the new object.
+        """
+        etag = self._put_object(file_path, data)
         if meta_data is not None:
-            meta_data_file_path = utils.get_meta_data_file_path(file_path)
-            meta_data = convert(meta_data, bytes)
-            self.client.put_object(
-                Body=meta_data, Bucket=self.bucket, Key=meta_data_file_path
+            self._write_meta_data(file_path, meta_data)
+        return etag
+
+    def _get_object(
+        self, file_path: str, **conditions
+    ) -> Union[Tuple[Union[bytes, bytearray], str], _NotModified]:
+        # Get the raw contents and ETag, large objects with parallel ranged GETs
+        try:
+            return transfer.download(
+                self.client,
+                self.bucket,
+                file_path,
+                part_size=self.part_size,
+                concurrency=self.transfer_concurrency,
+                retries=self.transfer_retries,
+                **conditions,
             )
+        except ClientError as e:
+            if e.response["ResponseMetadata"].get("HTTPStatusCode") == 304:
+                return NOT_MODIFIED
+            raise client.not_found(e, file_path) or e
+
+    def _put_object(self, file_path: str, data) -> str:
+        # Save raw contents and return the ETag, large objects in parallel parts
+        if len(data) > self.multipart_threshold:
+            return transfer.upload(
+                self.client,
+                self.bucket,
+                file_path,
+                data,
+                part_size=self.part_size,
+                concurrency=self.transfer_concurrency,
+                retries=self.transfer_retries,
+            )
+        return self.client.put_object(Body=data, Bucket=self.bucket, Key=file_path)["ETag"]
 
-    def read_file(self, file_path: str) -> Tuple[Any, Optional[dict]]:
+    def exists(self, file_path: str) -> bool:
         """
-        Read a file from S3.
-        The data will be converted to the appropriate type.
-        The meta data, if provided, will be converted to a dictionary.
+        Check whether a file exists in S3 with a single `HeadObject`.
+
+        Args:
+            file_path (str): The path to the file.
+
+        Returns:
+            bool: Whether the file exists.
+        """
+        return self._head_object(file_path) is not None
+
+    def stat(self, file_path: str) -> FileStat:
+        """
+        Get the attributes of a file in S3 with a `HeadObject`.
+        Objects stored without a content type get one guessed from the extension.
+        Whether the file has metadata comes from the metadata index if it is enabled,
+        or from a second `HeadObject` on the metadata file.
 
         Args:
             file_path (str): The path to the file.
 
         Returns:
-            Tuple[Any, Optional[dict]]: The data and, if available, the meta data.
+            FileStat: The attributes of the file.
+
+        Raises:
+            NotFoundError: If the file does not exist.
+        """
+        head = self._head_object(file_path)
+        if head is None:
+            raise NotFoundError(file_path)
+
+        # S3 reports binary/octet-stream for objects uploaded without a content type
+        content_type = head.get("ContentType")
+        if content_type in (None, "binary/octet-stream"):
+            content_type = mimetypes.guess_type(file_path)[0]
+
+        return FileStat(
+            file_path,
+            head["ContentLength"],
+            head["LastModified"].timestamp(),
+            head["ETag"],
+            content_type,
+            self._has_meta_data(file_path),
+        )
+
+    def read_meta_data(self, file_path: str) -> Optional[dict]:
         """
+        Read only the metadata of a file in S3.
 
-        # Get the data
-        obj = self.client.get_object(Bucket=self.bucket, Key=file_path)
-        obj = obj["Body"].read()
-        data = convert(obj, get_type(file_path))  # Converts file data
+        Args:
+            file_path (str): The path to the file.
 
-        # Get the metadata
+        Returns:
+            Optional[dict]: The metadata, if available.
+        """
+        return self._read_meta_data(file_path)
+
+    def list_meta_data(self, file_path: str) -> Dict[str, dict]:
+        """
+        Read the metadata of every file directly inside a directory.
+        With the metadata index enabled this is a single `GetObject`.
+
+        Args:
+            file_path (str): The path to the directory.
+
+        Returns:
+            Dict[str, dict]: File paths mapped to their metadata.
+        """
+        if self.metadata_index is not None:
+            files = self.metadata_index.get_directory(file_path.strip("/"))
+            if files is not None:
+                prefix = file_path.strip("/")
+                return {
+                    (f"{prefix}/{name}" if prefix else name): meta_data
+                    for name, meta_data in files.items()
+                }
+        return super().list_meta_data(file_path)
+
+    def rebuild_metadata_index(self, file_path: str) -> None:
+        """
+        Build the metadata index of a directory from its metadata files.
+        Use this once to migrate a directory written without the index.
+
+        Args:
+            file_path (str): The path to the directory.
+
+        Returns:
+            None
+        """
+        if self.metadata_index is None:
+            raise ValueError("The metadata index is not enabled.")
+
+        files = self._read_meta_data_files(file_path.strip("/"))
+        self.metadata_index.replace_directory(file_path.strip("/"), files)
+
+    def _read_meta_data_files(self, directory: str) -> Dict[str, dict]:
+        # The metadata objects of a directory, keyed by the name of their file
+        files = {}
+        for entry in self._walk(directory, recursive=False):
+            if entry.has_metadata:
+                meta_data = self._read_meta_data_file(entry.path)
+                if meta_data is not None:
+                    files[entry.path.rsplit("/", 1)[-1]] = meta_data
+        return files
+
+    def _read_meta_data(self, file_path: str) -> Optional[dict]:
+        if self.metadata_index is not None:
+            indexed, meta_data = self.metadata_index.lookup(file_path)
+            if indexed:
+                return meta_data
+        return self._read_meta_data_file(file_path)
+
+    def _head_object(self, file_path: str) -> Optional[dict]:
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=file_path)
+        except ClientError as e:
+            # HEAD responses have no body, so a missing key only shows as its status
+            if e.response["ResponseMetadata"].get("HTTPStatusCode") == 404:
+                return None
+            raise e
+
+    def _has_meta_data(self, file_path: str) -> bool:
+        if self.metadata_index is not None:
+            indexed, meta_data = self.metadata_index.lookup(file_path)
+            if indexed:
+                return meta_data is not None
+        return self._head_object(utils.get_meta_data_file_path(file_path)) is not None
+
+    def _read_meta_data_file(self, file_path: str) -> Optional[dict]:
+        # Get the metadata, most files have none so a missing key is expected
+        meta_data_file_path = utils.get_meta_data_file_path(file_path)
         try:
-            meta_data_file_path = utils.get_meta_data_file_path(file_path)
             obj = self.client.get_object(Bucket=self.bucket, Key=meta_data_file_path)
-            meta_data = obj["Body"]
+        except self.client.exceptions.NoSuchKey:
+            return None
+        return decode_meta_data(obj["Body"].read())
 
-            if meta_data is not None:
-                meta_data = convert(meta_data.read(), dict)
+    def _write_meta_data(self, file_path: str, meta_data: dict) -> None:
+        if self.metadata_index is not None:
+            self.metadata_index.set(file_path, meta_data)
+            return
 
-        except ClientError:
-            print("No metadata found.")
-            meta_data = None
+        meta_data_file_path = utils.get_meta_data_file_path(file_path)
+        self.client.put_object(
+            Body=encode_meta_data(meta_data),
+            Bucket=self.bucket,
+            Key=meta_data_file_path,
+        )
+
+    def _load_index(
+        self, index_path: str, version: Optional[str]
+    ) -> Union[Tuple[Optional[bytes], Optional[str]], _NotModified]:
+        conditions = {"IfNoneMatch": version} if version is not None else {}
+        try:
+            obj = self.client.get_object(
+                Bucket=self.bucket, Key=index_path, **conditions
+            )
+        except self.client.exceptions.NoSuchKey:
+            return None, None
+        except ClientError as e:
+            if e.response["ResponseMetadata"].get("HTTPStatusCode") == 304:
+                return NOT_MODIFIED
+            raise e
+        return obj["Body"].read(), obj["ETag"]
+
+    def _store_index(
+        self, index_path: str, data: bytes, expected_version: Optional[str]
+    ) -> Optional[str]:
+        # S3 conditional writes make the read-modify-write safe between writers
+        if expected_version is None:
+            conditions = {"IfNoneMatch": "*"}
+        else:
+            conditions = {"IfMatch": expected_version}
+        try:
+            response = self.client.put_object(
+                Body=data, Bucket=self.bucket, Key=index_path, **conditions
+            )
+        except ClientError as e:
+            if e.response["ResponseMetadata"].get("HTTPStatusCode") in (409, 412):
+                return None
+            raise e
+        return response["ETag"]
 
-        # Create the file object
-        return data, meta_data
+    def read_range(self, file_path: str, start: int, end: Optional[int] = None) -> bytes:
+        """
+        Read part of a file in S3 with a ranged `GetObject`.
+
+        Args:
+            file_path (str): The path to the file.
+            start (int): The offset of the first byte.
+            end (Optional[int], optional): The offset after the last byte. Defaults to
+                the end of the file.
+
+        Returns:
+            bytes: The raw bytes in `[start, end)`, fewer if the file is shorter.
+        """
+        if end is not None and end <= start:
+            return b""
+
+        # HTTP ranges are inclusive
+        byte_range = f"bytes={start}-" if end is None else f"bytes={start}-{end - 1}"
+        try:
+            obj = self.client.get_object(
+                Bucket=self.bucket, Key=file_path, Range=byte_range
+            )
+        except ClientError as e:
+            # The range starts beyond the end of the object
+            if e.response.get("Error", {}).get("Code") == "InvalidRange":
+                return b""
+            raise client.not_found(e, file_path) or e
+        return obj["Body"].read()
+
+    def open_read(self, file_path: str) -> BinaryIO:
+        """
+        Open a file in S3 for reading as a binary stream.
+        The object body is pulled off the connection in chunks as the stream is read.
 
-    def update_file(self, file_path: str, data: Any, meta_data: Optional[dict]) -> None:
+        Args:
+            file_path (str): The path to the file.
+
+        Returns:
+            BinaryIO: A readable stream of the raw file contents.
+        """
+        try:
+            obj = self.client.get_object(Bucket=self.bucket, Key=file_path)
+        except ClientError as e:
+            raise client.not_found(e, file_path) or e
+        stream = io.BufferedReader(S3Reader(obj["Body"]), buffer_size=CHUNK_SIZE)
+        return self.compression.wrap_reader(file_path, stream)
+
+    def open_random_access(self, file_path: str) -> BinaryIO:
         """
-        TODO: Implement this method.
-        Replace the data in a file in S3.
+        Open a file in S3 as a seekable binary stream in which every read is a ranged
+        `GetObject`, pinned to the version that was opened.
+
+        Args:
+            file_path (str): The path to the file.
+
+        Returns:
+            BinaryIO: A seekable stream of the raw file contents.
+        """
+        try:
+            head = self.client.head_object(Bucket=self.bucket, Key=file_path)
+        except ClientError as e:
+            raise client.not_found(e, file_path) or e
+        etag = head["ETag"]
+
+        def _read_range(start: int, end: int) -> bytes:
+            obj = transfer.with_retries(
+                lambda: self.client.get_object(
+                    Bucket=self.bucket,
+                    Key=file_path,
+                    Range=f"bytes={start}-{end - 1}",
+                    IfMatch=etag,
+                ),
+                self.transfer_retries,
+            )
+            return obj["Body"].read()
+
+        return io.BufferedReader(
+            RangeReader(_read_range, head["ContentLength"], block_size=RANGE_READ_SIZE)
+        )
+
+    def open_write(self, file_path: str, meta_data: Optional[dict] = None) -> BinaryIO:
+        """
+        Open a file in S3 for writing as a binary stream.
+        The data is sent as a multipart upload, one part at a time, and the object
+        appears when the stream is closed.
+
+        Args:
+            file_path (str): The path to the file.
+            meta_data (Optional[dict], optional): The meta data to save. Defaults
+
+        Returns:
+            BinaryIO: A writable stream for the raw file contents.
+        """
+        raw = S3MultipartWriter(
+            self.client,
+            self.bucket,
+            file_path,
+            part_size=self.part_size,
+            concurrency=self.transfer_concurrency,
+            retries=self.transfer_retries,
+        )
+        writer = StreamWriter(self.compression.wrap_writer(file_path, raw))
+
+        if meta_data is not None:
+
+            writer.add_commit_callback(
+                lambda: self._write_meta_data(file_path, meta_data)
+            )
+
+        return writer
+
+    def update_file(
+        self, file_path: str, data: Any, meta_data: Optional[dict] = None
+    ) -> None:
+        """
+        Replace the data of a file in S3 by saving it again with `create_file`,
+        so the file is created if it does not exist.
+        The metadata is replaced if provided, and otherwise kept.
 
         Args:
             file_path (str): The path to the file.
             data (Any): The data to save.
+            meta_data (Optional[dict], optional): The meta data to save. Defaults to None.
 
         Returns:
             None
-
         """
 
         # In s3 we simply overwrite the file
@@ -112,36 +598,393 @@ class S3Storage(StorageBase):
         self.client.delete_object(Bucket=self.bucket, Key=file_path)
 
         # Delete the metadata
+        if self.metadata_index is not None:
+            self.metadata_index.remove(file_path)
         meta_data_file_path = utils.get_meta_data_file_path(file_path)
         self.client.delete_object(Bucket=self.bucket, Key=meta_data_file_path)
 
-    def list_files_in_directory(self, file_path: str) -> list:
-        files = self.client.list_objects_v2(Bucket=self.bucket, Prefix=file_path)
-        return files
+    def delete_files(self, file_paths: Iterable[str]) -> list:
+        """
+        Delete many files using S3 multi-object deletes.
+        Each file and its metadata are removed in the same request, and requests of up to
+        1,000 keys are sent in parallel.
 
-    def list_subdirectories_in_directory(self, file_path) -> list:
-        def _extract_next_directory(file_path: str, path: str) -> str:
-            directories, _ = os.path.split(file_path)
-            directory_list = directories.split("/")
-            directory_index = directory_list.index(path)
-            # Check if the directory is the last one in the list
-            if directory_index == len(directory_list) - 1:
-                return None
+        Args:
+            file_paths (Iterable[str]): The paths to the files.
+
+        Returns:
+            list: One result per path, in input order. `None` on success, otherwise the error.
+        """
+        file_paths = list(file_paths)
+
+        # Each file takes two keys, the data and the metadata
+        files_per_request = MAX_DELETE_KEYS // 2
+        chunks = [
+            (file_paths[i : i + files_per_request],)
+            for i in range(0, len(file_paths), files_per_request)
+        ]
+
+        results = []
+        for chunk_result in self._map(self._delete_chunk, chunks):
+            if isinstance(chunk_result, Exception):
+                # The whole request failed, so every file in the chunk failed
+                chunk_size = min(files_per_request, len(file_paths) - len(results))
+                results.extend([chunk_result] * chunk_size)
             else:
-                next_directory = directory_list[directory_index + 1]
-                return next_directory
+                results.extend(chunk_result)
+
+        if self.metadata_index is not None:
+            deleted = [path for path, result in zip(file_paths, results) if result is None]
+            self.metadata_index.remove_many(deleted)
+        return results
+
+    def _delete_chunk(self, file_paths: list) -> list:
+        # Each key is deleted once, and its outcome given to every position it came from
+        keys = {}
+        for index, file_path in enumerate(file_paths):
+            keys.setdefault(file_path, []).append(index)
+            keys.setdefault(utils.get_meta_data_file_path(file_path), []).append(index)
+
+        response = self.client.delete_objects(
+            Bucket=self.bucket,
+            Delete={"Objects": [{"Key": key} for key in keys], "Quiet": True},
+        )
+
+        results = [None] * len(file_paths)
+        for error in response.get("Errors", []):
+            exception = ClientError(
+                {"Error": {"Code": error["Code"], "Message": error["Message"]}},
+                "DeleteObjects",
+            )
+            for index in keys[error["Key"]]:
+                results[index] = exception
+        return results
+
+    def copy_file(self, file_path: str, new_file_path: str) -> None:
+        """
+        Copy a file and its metadata in S3 with `CopyObject`, so the data never leaves
+        S3. Objects above the multipart threshold are copied in concurrent parts.
+
+        Args:
+            file_path (str): The path to the file.
+            new_file_path (str): The path to copy it to.
+
+        Returns:
+            None
+        """
+        if not self._transfer(file_path, new_file_path):
+            self._delete_keys([utils.get_meta_data_file_path(new_file_path)])
+        if self.metadata_index is not None:
+            self.metadata_index.set_many({new_file_path: self._read_meta_data(file_path)})
+
+    def move_file(self, file_path: str, new_file_path: str) -> None:
+        """
+        Move, or rename, a file and its metadata in S3.
+        S3 has no rename, so the objects are copied on the server and then deleted.
 
-        response = self.client.list_objects_v2(Bucket=self.bucket, Prefix=file_path)
+        Args:
+            file_path (str): The path to the file.
+            new_file_path (str): The path to move it to.
+
+        Returns:
+            None
+        """
+        meta_data = None
+        if self.metadata_index is not None:
+            meta_data = self._read_meta_data(file_path)
 
-        last = file_path.split("/")[-1]
-        dirs = []
+        keys = [file_path, utils.get_meta_data_file_path(file_path)]
+        if not self._transfer(file_path, new_file_path):
+            keys.append(utils.get_meta_data_file_path(new_file_path))
 
-        files = response.get("Contents")
-        if files is not None:
-            for file in files:
-                next_dir = _extract_next_directory(file["Key"], last)
-                if next_dir is not None:
-                    dirs.append(next_dir)
-            dirs = list(set(dirs))  # Remove duplicates
+        if self.metadata_index is not None:
+            self.metadata_index.set_many({new_file_path: meta_data, file_path: None})
+        self._delete_keys(keys)
+
+    def move_directory(self, file_path: str, new_file_path: str) -> None:
+        """
+        Move every file below a prefix in S3 to another prefix.
+        Files are copied on the server in parallel using a pool of `max_workers`
+        threads, then the originals are removed with multi-object deletes. A failed file
+        does not stop the others; once all have been tried the first error is raised.
+
+        Args:
+            file_path (str): The path to the directory.
+            new_file_path (str): The path to move it to.
+
+        Returns:
+            None
+        """
+        source, target = self._check_move(file_path, new_file_path)
+        # The raw listing tells which files have a metadata object
+        moves = [
+            (
+                entry.path,
+                f"{target}/{entry.path[len(source) + 1 :]}"
+                if target
+                else entry.path[len(source) + 1 :],
+                entry.size,
+                entry.has_metadata,
+            )
+            for entry in self._walk(source)
+            if not entry.is_dir
+        ]
+
+        meta_data = {}
+        if self.metadata_index is not None:
+            # One manifest lookup per directory
+            directories = {}
+            for path, _, _, has_metadata in moves:
+                directory, _, name = path.rpartition("/")
+                if directory not in directories:
+                    directories[directory] = self.metadata_index.get_directory(directory)
+                files = directories[directory]
+                if files is not None:
+                    meta_data[path] = files.get(name)
+                elif has_metadata:
+                    meta_data[path] = self._read_meta_data_file(path)
+                else:
+                    meta_data[path] = None
+
+        results = self._map(self._transfer, moves)
+
+        keys = []
+        changes = {}
+        for (path, new_path, _, _), result in zip(moves, results):
+            if isinstance(result, Exception):
+                continue
+            keys += [path, utils.get_meta_data_file_path(path)]
+            if not result:
+                keys.append(utils.get_meta_data_file_path(new_path))
+            changes[new_path] = meta_data.get(path)
+            changes[path] = None
+
+        if self.metadata_index is not None:
+            self.metadata_index.set_many(changes)
+        self._delete_keys(keys)
+        _raise_first(results)
+
+    def _transfer(
+        self,
+        file_path: str,
+        new_file_path: str,
+        size: Optional[int] = None,
+        has_metadata: Optional[bool] = None,
+    ) -> bool:
+        # Copy a file and its metadata object, returning whether it had one
+        try:
+            transfer.copy(
+                self.client,
+                self.bucket,
+                file_path,
+                new_file_path,
+                multipart_threshold=self.multipart_threshold,
+                part_size=self.part_size,
+                concurrency=self.transfer_concurrency,
+                retries=self.transfer_retries,
+                size=size,
+            )
+        except ClientError as e:
+            raise client.not_found(e, file_path) or e
+        if has_metadata is False:
+            return False
+
+        try:
+            self.client.copy_object(
+                Bucket=self.bucket,
+                Key=utils.get_meta_data_file_path(new_file_path),
+                CopySource={
+                    "Bucket": self.bucket,
+                    "Key": utils.get_meta_data_file_path(file_path),
+                },
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] not in ("NoSuchKey", "404"):
+                raise e
+            return False
+        return True
+
+    def _delete_keys(self, keys: list) -> None:
+        chunks = [
+            (keys[i : i + MAX_DELETE_KEYS],) for i in range(0, len(keys), MAX_DELETE_KEYS)
+        ]
+
+        def _delete(chunk: list) -> None:
+            response = self.client.delete_objects(
+                Bucket=self.bucket,
+                Delete={"Objects": [{"Key": key} for key in chunk], "Quiet": True},
+            )
+            for error in response.get("Errors", []):
+                raise ClientError(
+                    {"Error": {"Code": error["Code"], "Message": error["Message"]}},
+                    "DeleteObjects",
+                )
+
+        _raise_first(self._map(_delete, chunks))
+
+    def list_files_in_directory(self, file_path: str) -> list:
+        """
+        List the files directly inside a directory.
+        As in `LocalStorage`, names are returned without their extensions, and metadata
+        files are left out.
+
+        Args:
+            file_path (str): The path to the directory.
 
-        return dirs
+        Returns:
+            list: The file names.
+        """
+        return list(self.iter_files_in_directory(file_path))
+
+    def list_subdirectories_in_directory(self, file_path: str) -> list:
+        """
+        List the directories directly inside a directory.
+
+        Args:
+            file_path (str): The path to the directory.
+
+        Returns:
+            list: The directory names.
+        """
+        return list(self.iter_subdirectories_in_directory(file_path))
+
+    def iter_files_in_directory(self, file_path: str) -> Iterator[str]:
+        """
+        Lazily list the files directly inside a directory, one page of up to 1,000 keys
+        at a time.
+
+        Args:
+            file_path (str): The path to the directory.
+
+        Returns:
+            Iterator[str]: The file names, without extensions.
+        """
+        seen = set()
+        for page in self._iter_directory_pages(file_path):
+            for obj in page.get("Contents", []):
+                name = obj["Key"].rsplit("/", 1)[-1]
+                if not name or name.startswith(".") or name.endswith("_meta.json"):
+                    continue
+                name = os.path.splitext(name)[0]
+                if name not in seen:
+                    seen.add(name)
+                    yield name
+
+    def iter_subdirectories_in_directory(self, file_path: str) -> Iterator[str]:
+        """
+        Lazily list the directories directly inside a directory.
+        S3 groups keys into `CommonPrefixes` server side, so the keys inside the
+        subdirectories are never listed.
+
+        Args:
+            file_path (str): The path to the directory.
+
+        Returns:
+            Iterator[str]: The directory names.
+        """
+        for page in self._iter_directory_pages(file_path):
+            for prefix in page.get("CommonPrefixes", []):
+                name = prefix["Prefix"].rstrip("/").rsplit("/", 1)[-1]
+                if not name.startswith("."):
+                    yield name
+
+    def walk(
+        self, file_path: str = "", recursive: bool = True, stat: bool = True
+    ) -> Iterator[StorageEntry]:
+        """
+        Lazily iterate over the files and directories below a prefix.
+        Sizes and modification times come from the listing itself, so `stat` costs
+        nothing here, and so does `meta_version`, the ETag of the metadata object.
+        Directories are derived from the keys, or from `CommonPrefixes` when not
+        recursive.
+
+        Args:
+            file_path (str, optional): The path to the directory. Defaults to the root.
+            recursive (bool, optional): Descend into subdirectories. Defaults to True.
+            stat (bool, optional): Unused, sizes are always known. Defaults to True.
+
+        Returns:
+            Iterator[StorageEntry]: One entry per file or directory, in no particular order.
+        """
+        for entry in self._walk(file_path, recursive):
+            if self.metadata_index is not None and not entry.is_dir:
+                indexed, meta_data = self.metadata_index.lookup(entry.path)
+                # Directories without an index still use metadata files
+                if indexed:
+                    entry = entry._replace(
+                        has_metadata=meta_data is not None,
+                        meta_version=meta_data_version(meta_data),
+                    )
+            yield entry
+
+    def _walk(
+        self, file_path: str = "", recursive: bool = True
+    ) -> Iterator[StorageEntry]:
+        prefix = file_path.strip("/")
+        prefix = prefix + "/" if prefix else ""
+        paginator = self.client.get_paginator("list_objects_v2")
+        pages = paginator.paginate(
+            Bucket=self.bucket, Prefix=prefix, **({} if recursive else {"Delimiter": "/"})
+        )
+
+        # Keys are listed in order, and a file's metadata key sorts after the file, so a
+        # file is held back until the listing has passed the key its metadata would have
+        pending = []
+        seen_directories = set()
+        counter = 0
+
+        for page in pages:
+            for common_prefix in page.get("CommonPrefixes", []):
+                path = common_prefix["Prefix"].rstrip("/")
+                if not path.rsplit("/", 1)[-1].startswith("."):
+                    yield StorageEntry(path, None, None, True, False)
+
+            for obj in page.get("Contents", []):
+                key = obj["Key"]
+
+                while pending and pending[0][0] < key:
+                    yield heapq.heappop(pending)[2]._replace(has_metadata=False)
+
+                relative_parts = key[len(prefix) :].split("/")
+                if any(part.startswith(".") for part in relative_parts):
+                    continue
+
+                # S3 has no directories, so yield each parent the first time it is seen
+                for depth in range(1, len(relative_parts)):
+                    directory = prefix + "/".join(relative_parts[:depth])
+                    if directory not in seen_directories:
+                        seen_directories.add(directory)
+                        yield StorageEntry(directory, None, None, True, False)
+
+                if key.endswith("_meta.json"):
+                    while pending and pending[0][0] == key:
+                        yield heapq.heappop(pending)[2]._replace(
+                            has_metadata=True, meta_version=obj["ETag"]
+                        )
+                    continue
+
+                if not relative_parts[-1]:
+                    # A "directory marker" key ending in a slash
+                    continue
+
+                entry = StorageEntry(
+                    key,
+                    obj["Size"],
+                    obj["LastModified"].timestamp(),
+                    False,
+                    False,
+                )
+                meta_data_key = utils.get_meta_data_file_path(key)
+                counter += 1
+                heapq.heappush(pending, (meta_data_key, counter, entry))
+
+        while pending:
+            yield heapq.heappop(pending)[2]
+
+    def _iter_directory_pages(self, file_path: str) -> Iterator[dict]:
+        prefix = file_path.strip("/")
+        prefix = prefix + "/" if prefix else ""
+        paginator = self.client.get_paginator("list_objects_v2")
+        yield from paginator.paginate(
+            Bucket=self.bucket, Prefix=prefix, Delimiter="/"
+        )
@@ -0,0 +1,134 @@
+import io
+from concurrent.futures import ThreadPoolExecutor
+
+from ..stream import RawStreamWriter
+from .transfer import (
+    DEFAULT_CONCURRENCY,
+    DEFAULT_PART_SIZE,
+    DEFAULT_RETRIES,
+    MIN_PART_SIZE,
+    with_retries,
+)
+
+
+class S3Reader(io.RawIOBase):
+    """
+    A raw stream over the `StreamingBody` of a `GetObject` response.
+    Each read pulls the next chunk off the HTTP connection.
+    """
+
+    def __init__(self, body) -> None:
+        super().__init__()
+        self._body = body
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        chunk = self._body.read(len(b))
+        n = len(chunk)
+        b[:n] = chunk
+        return n
+
+    def close(self) -> None:
+        if not self.closed:
+            self._body.close()
+        super().close()
+
+
+class S3MultipartWriter(RawStreamWriter):
+    """
+    Uploads a stream to S3 in parts of `part_size` bytes, with up to `concurrency`
+    parts uploading in the background, so memory use is bounded by
+    `part_size * (concurrency + 1)`. Streams smaller than one part are sent with a
+    single `PutObject`. The multipart upload is completed on commit and aborted on
+    discard.
+    """
+
+    def __init__(
+        self,
+        client,
+        bucket: str,
+        key: str,
+        part_size: int = DEFAULT_PART_SIZE,
+        concurrency: int = DEFAULT_CONCURRENCY,
+        retries: int = DEFAULT_RETRIES,
+    ) -> None:
+        super().__init__()
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.part_size = max(part_size, MIN_PART_SIZE)
+        self.concurrency = concurrency
+        self.retries = retries
+
+        self._buffer = bytearray()
+        self._upload_id = None
+        self._executor = None
+        self._pending = []
+        self._parts = []
+
+    def write(self, b) -> int:
+        self._buffer += b
+        while len(self._buffer) >= self.part_size:
+            self._submit_part(bytes(self._buffer[: self.part_size]))
+            del self._buffer[: self.part_size]
+        return len(b)
+
+    def _submit_part(self, data: bytes) -> None:
+        if self._upload_id is None:
+            response = self.client.create_multipart_upload(
+                Bucket=self.bucket, Key=self.key
+            )
+            self._upload_id = response["UploadId"]
+            self._executor = ThreadPoolExecutor(max_workers=self.concurrency)
+
+        # Apply backpressure once `concurrency` parts are in flight
+        if len(self._pending) >= self.concurrency:
+            self._parts.append(self._pending.pop(0).result())
+
+        part_number = len(self._parts) + len(self._pending) + 1
+        self._pending.append(
+            self._executor.submit(self._upload_part, data, part_number)
+        )
+
+    def _upload_part(self, data: bytes, part_number: int) -> dict:
+        response = with_retries(
+            lambda: self.client.upload_part(
+                Body=data,
+                Bucket=self.bucket,
+                Key=self.key,
+                PartNumber=part_number,
+                UploadId=self._upload_id,
+            ),
+            self.retries,
+        )
+        return {"ETag": response["ETag"], "PartNumber": part_number}
+
+    def commit(self) -> None:
+        if self._upload_id is None:
+            self.client.put_object(
+                Body=bytes(self._buffer), Bucket=self.bucket, Key=self.key
+            )
+            return
+
+        if self._buffer:
+            self._submit_part(bytes(self._buffer))
+        while self._pending:
+            self._parts.append(self._pending.pop(0).result())
+        self._executor.shutdown()
+
+        self.client.complete_multipart_upload(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self._upload_id,
+            MultipartUpload={"Parts": self._parts},
+        )
+
+    def discard(self) -> None:
+        self._buffer = bytearray()
+        if self._upload_id is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self.client.abort_multipart_upload(
+                Bucket=self.bucket, Key=self.key, UploadId=self._upload_id
+            )
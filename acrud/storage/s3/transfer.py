@@ -0,0 +1,266 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple, Union
+
+from botocore.exceptions import BotoCoreError, ClientError
+
+DEFAULT_MULTIPART_THRESHOLD = 16 * 1024 * 1024
+DEFAULT_PART_SIZE = 8 * 1024 * 1024
+DEFAULT_CONCURRENCY = 8
+DEFAULT_RETRIES = 3
+
+# S3 requires every part but the last to be at least 5 MiB
+MIN_PART_SIZE = 5 * 1024 * 1024
+MAX_PART_COUNT = 10_000
+
+# CopyObject accepts sources of up to 5 GiB, larger objects must be copied in parts
+MAX_COPY_SIZE = 5 * 1024**3
+
+
+def _is_retryable(error: Exception) -> bool:
+    if isinstance(error, ClientError):
+        status = error.response.get("ResponseMetadata", {}).get("HTTPStatusCode", 0)
+        code = error.response.get("Error", {}).get("Code", "")
+        return status >= 500 or code in ("SlowDown", "RequestTimeout", "Throttling")
+    return isinstance(error, BotoCoreError)
+
+
+def with_retries(func, retries: int = DEFAULT_RETRIES):
+    """
+    Call `func`, retrying transient S3 errors with exponential backoff.
+    """
+    attempt = 0
+    while True:
+        try:
+            return func()
+        except (BotoCoreError, ClientError) as e:
+            if attempt >= retries or not _is_retryable(e):
+                raise e
+            time.sleep(0.1 * 2**attempt)
+            attempt += 1
+
+
+def upload(
+    client,
+    bucket: str,
+    key: str,
+    data: bytes,
+    part_size: int = DEFAULT_PART_SIZE,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    retries: int = DEFAULT_RETRIES,
+) -> str:
+    """
+    Upload a buffer as a multipart upload with `concurrency` parts in flight.
+    Each part is retried on its own, and the upload is aborted if any part fails.
+
+    Args:
+        client: The boto3 S3 client.
+        bucket (str): The bucket name.
+        key (str): The object key.
+        data (bytes): The object contents.
+        part_size (int, optional): The size of each part.
+        concurrency (int, optional): The number of parts uploaded at once.
+        retries (int, optional): The number of retries per part.
+
+    Returns:
+        str: The ETag of the object.
+    """
+    # Parts are raised above `part_size` where needed to stay within the part limit
+    part_size = max(part_size, MIN_PART_SIZE, -(-len(data) // MAX_PART_COUNT))
+    view = memoryview(data)
+
+    upload_id = client.create_multipart_upload(Bucket=bucket, Key=key)["UploadId"]
+
+    def _upload_part(part_number: int) -> dict:
+        start = (part_number - 1) * part_size
+        body = bytes(view[start : start + part_size])
+        response = with_retries(
+            lambda: client.upload_part(
+                Body=body,
+                Bucket=bucket,
+                Key=key,
+                PartNumber=part_number,
+                UploadId=upload_id,
+            ),
+            retries,
+        )
+        return {"ETag": response["ETag"], "PartNumber": part_number}
+
+    part_count = max(1, -(-len(data) // part_size))
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            parts = list(executor.map(_upload_part, range(1, part_count + 1)))
+        response = client.complete_multipart_upload(
+            Bucket=bucket,
+            Key=key,
+            UploadId=upload_id,
+            MultipartUpload={"Parts": parts},
+        )
+    except BaseException:
+        client.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+        raise
+    return response["ETag"]
+
+
+def download(
+    client,
+    bucket: str,
+    key: str,
+    part_size: int = DEFAULT_PART_SIZE,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    retries: int = DEFAULT_RETRIES,
+    **conditions,
+) -> Tuple[Union[bytes, bytearray], str]:
+    """
+    Download an object with concurrent ranged GETs.
+    The first request fetches the first part and reveals the object size. The remaining
+    parts are then fetched in parallel, pinned to the same ETag, directly into a single
+    preallocated buffer.
+
+    Args:
+        client: The boto3 S3 client.
+        bucket (str): The bucket name.
+        key (str): The object key.
+        part_size (int, optional): The size of each ranged GET.
+        concurrency (int, optional): The number of ranged GETs in flight.
+        retries (int, optional): The number of retries per range.
+        **conditions: Extra arguments for the first `GetObject`, e.g. `IfNoneMatch`.
+
+    Returns:
+        Tuple[Union[bytes, bytearray], str]: The object contents and its ETag.
+    """
+    try:
+        response = client.get_object(
+            Bucket=bucket, Key=key, Range=f"bytes=0-{part_size - 1}", **conditions
+        )
+    except ClientError as e:
+        # Empty objects cannot satisfy a range request
+        if e.response.get("Error", {}).get("Code") != "InvalidRange":
+            raise e
+        response = client.get_object(Bucket=bucket, Key=key, **conditions)
+        return response["Body"].read(), response["ETag"]
+
+    etag = response["ETag"]
+    first_part = response["Body"].read()
+    content_range = response.get("ContentRange")
+    size = int(content_range.split("/")[-1]) if content_range else len(first_part)
+
+    if size <= len(first_part):
+        return first_part, etag
+
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    view[: len(first_part)] = first_part
+
+    def _download_part(start: int) -> None:
+        end = min(start + part_size, size) - 1
+
+        def _get() -> None:
+            part = client.get_object(
+                Bucket=bucket, Key=key, Range=f"bytes={start}-{end}", IfMatch=etag
+            )
+            view[start : end + 1] = part["Body"].read()
+
+        with_retries(_get, retries)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        # Consume the iterator so errors in any part are raised
+        list(executor.map(_download_part, range(len(first_part), size, part_size)))
+
+    view.release()
+    return buffer, etag
+
+
+def copy(
+    client,
+    bucket: str,
+    key: str,
+    new_key: str,
+    multipart_threshold: int = DEFAULT_MULTIPART_THRESHOLD,
+    part_size: int = DEFAULT_PART_SIZE,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    retries: int = DEFAULT_RETRIES,
+    size: Optional[int] = None,
+) -> None:
+    """
+    Copy an object within a bucket, on the server, so no data is transferred.
+    Objects above `multipart_threshold`, and all objects above 5 GiB, are copied as a
+    multipart upload of concurrent `UploadPartCopy` requests pinned to the source's ETag.
+
+    Args:
+        client: The boto3 S3 client.
+        bucket (str): The bucket name.
+        key (str): The source key.
+        new_key (str): The destination key.
+        multipart_threshold (int, optional): The size above which objects are copied in
+            parts.
+        part_size (int, optional): The size of each part.
+        concurrency (int, optional): The number of parts copied at once.
+        retries (int, optional): The number of retries per request.
+        size (Optional[int], optional): The object size, if known, saving a `HeadObject` for
+            objects below the threshold.
+
+    Returns:
+        None
+    """
+    copy_source = {"Bucket": bucket, "Key": key}
+    threshold = min(multipart_threshold, MAX_COPY_SIZE)
+    if size is not None and size <= threshold:
+        with_retries(
+            lambda: client.copy_object(Bucket=bucket, Key=new_key, CopySource=copy_source),
+            retries,
+        )
+        return
+
+    head = client.head_object(Bucket=bucket, Key=key)
+    size = head["ContentLength"]
+    if size <= threshold:
+        with_retries(
+            lambda: client.copy_object(
+                Bucket=bucket,
+                Key=new_key,
+                CopySource=copy_source,
+                CopySourceIfMatch=head["ETag"],
+            ),
+            retries,
+        )
+        return
+
+    part_size = max(part_size, MIN_PART_SIZE, -(-size // MAX_PART_COUNT))
+    upload_id = client.create_multipart_upload(
+        Bucket=bucket,
+        Key=new_key,
+        ContentType=head.get("ContentType", "binary/octet-stream"),
+        Metadata=head.get("Metadata", {}),
+    )["UploadId"]
+
+    def _copy_part(part_number: int) -> dict:
+        start = (part_number - 1) * part_size
+        end = min(start + part_size, size) - 1
+        response = with_retries(
+            lambda: client.upload_part_copy(
+                Bucket=bucket,
+                Key=new_key,
+                CopySource=copy_source,
+                CopySourceIfMatch=head["ETag"],
+                CopySourceRange=f"bytes={start}-{end}",
+                PartNumber=part_number,
+                UploadId=upload_id,
+            ),
+            retries,
+        )
+        return {"ETag": response["CopyPartResult"]["ETag"], "PartNumber": part_number}
+
+    part_count = -(-size // part_size)
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            parts = list(executor.map(_copy_part, range(1, part_count + 1)))
+        client.complete_multipart_upload(
+            Bucket=bucket,
+            Key=new_key,
+            UploadId=upload_id,
+            MultipartUpload={"Parts": parts},
+        )
+    except BaseException:
+        client.abort_multipart_upload(Bucket=bucket, Key=new_key, UploadId=upload_id)
+        raise
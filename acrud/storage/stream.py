@@ -0,0 +1,197 @@
+import csv
+import io
+from collections import OrderedDict
+from typing import BinaryIO, Callable, Iterator, List
+
+from . import utils
+
+# Default size of the chunks moved between a stream and the backend
+CHUNK_SIZE = 1024 * 1024
+
+
+class RawStreamWriter(io.RawIOBase):
+    """
+    Base class for the raw side of a `StreamWriter`.
+    Subclasses make the data visible in `commit`, which runs when the stream is closed,
+    and clean up in `discard`, which runs instead if the stream was aborted or the
+    commit failed.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._aborted = False
+        self._callbacks: List[Callable[[], None]] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def commit(self) -> None:
+        raise NotImplementedError
+
+    def discard(self) -> None:
+        pass
+
+    def abort(self) -> None:
+        self._aborted = True
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        try:
+            if self._aborted:
+                self.discard()
+            else:
+                try:
+                    self.commit()
+                except BaseException:
+                    self.discard()
+                    raise
+                for callback in self._callbacks:
+                    callback()
+        finally:
+            super().close()
+
+
+class StreamWriter(io.BufferedWriter):
+    """
+    A buffered, write-only stream returned by `StorageBase.open_write`.
+    The file is only created or replaced once the stream is closed and every byte has
+    been written; if the `with` block, a write or the final flush raises, everything
+    written so far is discarded.
+    """
+
+    def __init__(self, raw: RawStreamWriter, buffer_size: int = CHUNK_SIZE) -> None:
+        super().__init__(raw, buffer_size=buffer_size)
+
+    def write(self, data) -> int:
+        try:
+            return super().write(data)
+        except BaseException:
+            self.raw.abort()
+            raise
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        try:
+            self.flush()
+        except BaseException:
+            # BufferedWriter.close would still close, and so commit, the raw stream;
+            # close it directly so nothing is written again before it is discarded
+            self.raw.abort()
+            self.raw.close()
+            raise
+        super().close()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.raw.abort()
+        return super().__exit__(exc_type, exc_value, traceback)
+
+    def add_commit_callback(self, callback: Callable[[], None]) -> None:
+        """
+        Run `callback` once the file has been written successfully.
+        """
+        self.raw._callbacks.append(callback)
+
+
+class RangeReader(io.RawIOBase):
+    """
+    A seekable, read-only stream in which reads fetch just the requested range, e.g.
+    with a ranged GET. Formats such as Parquet use it to read only the parts of a file
+    they need.
+
+    Reads smaller than `block_size` fetch the whole aligned block around them instead,
+    and the last few blocks are kept, so parsers making many small reads near each
+    other, or reading backwards from the end, only fetch each block once.
+    """
+
+    def __init__(
+        self,
+        read_range: Callable[[int, int], bytes],
+        size: int,
+        block_size: int = 64 * 1024,
+        max_blocks: int = 8,
+    ) -> None:
+        super().__init__()
+        self._read_range = read_range
+        self.size = size
+        self.block_size = block_size
+        self.max_blocks = max_blocks
+        self._position = 0
+        self._blocks: "OrderedDict[int, bytes]" = OrderedDict()
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        self._position = max(0, offset)
+        return self._position
+
+    def readinto(self, b) -> int:
+        end = min(self._position + len(b), self.size)
+        if end <= self._position:
+            return 0
+
+        if end - self._position >= self.block_size:
+            data = self._read_range(self._position, end)
+        else:
+            index = self._position // self.block_size
+            offset = self._position - index * self.block_size
+            data = self._get_block(index)[offset : offset + end - self._position]
+
+        n = len(data)
+        b[:n] = data
+        self._position += n
+        return n
+
+    def _get_block(self, index: int) -> bytes:
+        block = self._blocks.get(index)
+        if block is None:
+            start = index * self.block_size
+            block = self._read_range(start, min(start + self.block_size, self.size))
+            self._blocks[index] = block
+            if len(self._blocks) > self.max_blocks:
+                self._blocks.popitem(last=False)
+        else:
+            self._blocks.move_to_end(index)
+        return block
+
+
+def iter_file(stream: BinaryIO, file_path: str) -> Iterator:
+    """
+    Lazily decode a binary stream.
+    CSV files yield one row (a list of strings) at a time, text files one line at a time.
+
+    Args:
+        stream (BinaryIO): The stream returned by `open_read`.
+        file_path (str): The path to the file, used to pick the format.
+
+    Returns:
+        Iterator: The rows or lines of the file.
+    """
+    file_type = utils.get_extension(file_path)
+    if file_type not in ("csv", "txt"):
+        stream.close()
+        raise ValueError(f"Streaming reads are not supported for .{file_type} files.")
+
+    text = io.TextIOWrapper(stream, encoding="utf-8", newline="")
+
+    def _iter() -> Iterator:
+        with text:
+            if file_type == "csv":
+                yield from csv.reader(text)
+            else:
+                yield from text
+
+    return _iter()
@@ -0,0 +1,191 @@
+from typing import Any, BinaryIO, List, Optional
+
+from . import utils
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.csv as pa_csv
+    import pyarrow.ipc as pa_ipc
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow is only needed for .parquet and .arrow files
+    pa = None
+
+
+def _require_pyarrow() -> None:
+    if pa is None:
+        raise ImportError(
+            "Reading and writing .parquet and .arrow files requires pyarrow. "
+            "Install it with `pip install acrud[tabular]`."
+        )
+
+
+def to_table(data: Any) -> "pa.Table":
+    """
+    Convert an Arrow table, record batch or pandas DataFrame to an Arrow table.
+    """
+    _require_pyarrow()
+    if isinstance(data, pa.Table):
+        return data
+    if isinstance(data, pa.RecordBatch):
+        return pa.Table.from_batches([data])
+    # pandas is imported by pyarrow only when needed, so check by duck typing
+    if hasattr(data, "to_numpy") and hasattr(data, "columns"):
+        return pa.Table.from_pandas(data)
+    raise TypeError(f"Cannot write {data.__class__} as a table.")
+
+
+def encode_parquet(data: Any) -> bytes:
+    table = to_table(data)
+    sink = pa.BufferOutputStream()
+    pq.write_table(table, sink)
+    return sink.getvalue().to_pybytes()
+
+
+def decode_parquet(data) -> "pa.Table":
+    _require_pyarrow()
+    return pq.read_table(pa.BufferReader(pa.py_buffer(data)))
+
+
+def encode_arrow(data: Any) -> bytes:
+    table = to_table(data)
+    sink = pa.BufferOutputStream()
+    with pa_ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def decode_arrow(data) -> "pa.Table":
+    # Zero-copy, the table points into `data`
+    _require_pyarrow()
+    return pa_ipc.open_file(pa.BufferReader(pa.py_buffer(data))).read_all()
+
+
+def memory_map(file_path: str) -> BinaryIO:
+    """
+    Memory-map a local file, so Arrow reads column chunks straight from the page cache.
+    """
+    _require_pyarrow()
+    return pa.memory_map(file_path, "r")
+
+
+def to_expression(filter: dict) -> "pc.Expression":
+    """
+    Convert a filter in the form used by `StorageBase.query` to an Arrow expression.
+
+    Args:
+        filter (dict): Column names mapped to a value, or to a dict of operators
+            (`==`, `!=`, `<`, `<=`, `>`, `>=`, `in`) and values.
+
+    Returns:
+        pc.Expression: The expression, true for the rows to keep.
+    """
+    expression = None
+    for column, condition in filter.items():
+        field = pc.field(column)
+        if not isinstance(condition, dict):
+            condition = {"==": condition}
+
+        for operator, value in condition.items():
+            match operator:
+                case "==":
+                    term = field == value
+                case "!=":
+                    term = field != value
+                case "<":
+                    term = field < value
+                case "<=":
+                    term = field <= value
+                case ">":
+                    term = field > value
+                case ">=":
+                    term = field >= value
+                case "in":
+                    term = field.isin(list(value))
+                case _:
+                    raise ValueError(f"Unsupported operator: {operator!r}")
+            expression = term if expression is None else expression & term
+    return expression
+
+
+def read_table(
+    source: BinaryIO,
+    file_path: str,
+    columns: Optional[List[str]] = None,
+    filter: Optional[dict] = None,
+) -> "pa.Table":
+    """
+    Read the columns and rows of a table that are needed from a random access file.
+
+    For Parquet, only the column chunks of `columns` are read, and row groups whose
+    statistics rule out `filter` are skipped. For Arrow, only the buffers of `columns`
+    are read, and `filter` is applied after reading.
+
+    Args:
+        source (BinaryIO): A seekable file, e.g. from `StorageBase.open_random_access`.
+        file_path (str): The path to the file, used to pick the format.
+        columns (Optional[List[str]], optional): The columns to read. Defaults to all.
+        filter (Optional[dict], optional): The rows to keep, see `to_expression`.
+            Defaults to all.
+
+    Returns:
+        pa.Table: The table.
+    """
+    _require_pyarrow()
+    expression = to_expression(filter) if filter else None
+    file_type = utils.get_extension(file_path)
+
+    if file_type == "parquet":
+        return pq.read_table(source, columns=columns, filters=expression)
+
+    if file_type != "arrow":
+        raise ValueError(f"Table reads are not supported for .{file_type} files.")
+
+    options = None
+    if columns is not None:
+        schema = pa_ipc.open_file(source).schema
+        # The filter may need columns that are not returned
+        needed = set(columns) | (set(filter) if filter else set())
+        options = pa_ipc.IpcReadOptions(
+            included_fields=[i for i, name in enumerate(schema.names) if name in needed]
+        )
+    table = pa_ipc.open_file(source, options=options).read_all()
+    if expression is not None:
+        table = table.filter(expression)
+    return table.select(columns) if columns is not None else table
+
+
+def csv_to_parquet(
+    storage,
+    csv_path: str,
+    parquet_path: Optional[str] = None,
+    meta_data: Optional[dict] = None,
+) -> str:
+    """
+    Convert a CSV file to Parquet, streaming it through in batches so neither file is
+    ever held in memory whole. Column types are inferred from the first block of the CSV.
+
+    Args:
+        storage (StorageBase): The storage holding the CSV file.
+        csv_path (str): The path to the CSV file.
+        parquet_path (Optional[str], optional): The path to write. Defaults to the CSV
+            path with a `.parquet` extension.
+        meta_data (Optional[dict], optional): The meta data to save. Defaults to that of
+            the CSV file.
+
+    Returns:
+        str: The path to the Parquet file.
+    """
+    _require_pyarrow()
+    if parquet_path is None:
+        parquet_path = csv_path.rsplit(".", 1)[0] + ".parquet"
+    if meta_data is None:
+        meta_data = storage.read_meta_data(csv_path)
+
+    with storage.open_read(csv_path) as stream:
+        reader = pa_csv.open_csv(stream)
+        with storage.open_write(parquet_path, meta_data) as sink:
+            with pq.ParquetWriter(pa.PythonFile(sink, mode="w"), reader.schema) as writer:
+                for batch in reader:
+                    writer.write_batch(batch)
+    return parquet_path
@@ -0,0 +1 @@
+from .tiered import TieredStorage
@@ -0,0 +1,232 @@
+import os
+import sqlite3
+import threading
+import time
+from typing import List, NamedTuple, Optional, Tuple
+
+CATALOG_FILE_NAME = ".acrud_tier.db"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    path TEXT PRIMARY KEY,
+    etag TEXT,
+    size INTEGER NOT NULL,
+    accessed REAL NOT NULL,
+    checked REAL NOT NULL,
+    dirty INTEGER NOT NULL DEFAULT 0,
+    version INTEGER NOT NULL DEFAULT 0
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS entries_accessed ON entries (dirty, accessed);
+"""
+
+
+class CatalogEntry(NamedTuple):
+    """
+    A file held in the cache directory.
+    """
+
+    etag: Optional[str]
+    size: int
+    checked: float
+    dirty: bool
+    version: int
+
+
+class DiskCatalog:
+    """
+    Records which files a `TieredStorage` cache directory holds, their S3 ETags and
+    when they were last read.
+
+    The catalog is a SQLite database in WAL mode, so every process on the node that
+    uses the same directory sees the same entries, the same byte total and the same
+    least recently used order. Each process opens its own connection.
+    """
+
+    def __init__(self, path: str, timeout: float = 30.0) -> None:
+        self.path = path
+        self.timeout = timeout
+        self._connection = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def get(self, file_path: str) -> Optional[CatalogEntry]:
+        with self._lock:
+            row = (
+                self._connect()
+                .execute(
+                    "SELECT etag, size, checked, dirty, version FROM entries WHERE path = ?",
+                    (file_path,),
+                )
+                .fetchone()
+            )
+        if row is None:
+            return None
+        return CatalogEntry(row[0], row[1], row[2], bool(row[3]), row[4])
+
+    def record(
+        self, file_path: str, etag: Optional[str], size: int, dirty: bool = False
+    ) -> int:
+        """
+        Add or replace an entry, as just read and just validated.
+
+        Returns:
+            int: The entry's new version, which changes on every write.
+        """
+        now = time.time()
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                connection.execute(
+                    "INSERT INTO entries (path, etag, size, accessed, checked, dirty, version) "
+                    "VALUES (?, ?, ?, ?, ?, ?, 1) ON CONFLICT (path) DO UPDATE SET "
+                    "etag = excluded.etag, size = excluded.size, accessed = excluded.accessed, "
+                    "checked = excluded.checked, dirty = excluded.dirty, version = version + 1",
+                    (file_path, etag, size, now, now, int(dirty)),
+                )
+                (version,) = connection.execute(
+                    "SELECT version FROM entries WHERE path = ?", (file_path,)
+                ).fetchone()
+        return version
+
+    def touch(self, file_path: str, checked: bool = False) -> None:
+        """
+        Mark an entry as just read and, if `checked`, as just validated against S3.
+        """
+        now = time.time()
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                if checked:
+                    connection.execute(
+                        "UPDATE entries SET accessed = ?, checked = ? WHERE path = ?",
+                        (now, now, file_path),
+                    )
+                else:
+                    connection.execute(
+                        "UPDATE entries SET accessed = ? WHERE path = ?", (now, file_path)
+                    )
+
+    def mark_clean(self, file_path: str, version: int, etag: str) -> bool:
+        """
+        Mark a written-back entry as uploaded, unless it was written again meanwhile.
+
+        Returns:
+            bool: Whether the entry was still at `version`.
+        """
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                cursor = connection.execute(
+                    "UPDATE entries SET dirty = 0, etag = ?, checked = ? "
+                    "WHERE path = ? AND version = ?",
+                    (etag, time.time(), file_path, version),
+                )
+        return cursor.rowcount == 1
+
+    def dirty(self, directory: Optional[str] = None) -> List[Tuple[str, int]]:
+        """
+        The `(file_path, version)` of every entry not yet uploaded, or only of those
+        below `directory`.
+        """
+        directory = (directory or "").strip("/")
+        with self._lock:
+            if not directory:
+                return self._connect().execute(
+                    "SELECT path, version FROM entries WHERE dirty = 1 ORDER BY accessed"
+                ).fetchall()
+            return self._connect().execute(
+                "SELECT path, version FROM entries "
+                "WHERE dirty = 1 AND path >= ? AND path < ? ORDER BY accessed",
+                (directory + "/", directory + "0"),
+            ).fetchall()
+
+    def remove(self, file_path: str) -> None:
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                connection.execute("DELETE FROM entries WHERE path = ?", (file_path,))
+
+    def remove_directory(self, directory: str) -> List[str]:
+        """
+        Remove every entry below a directory.
+
+        Returns:
+            List[str]: The paths removed.
+        """
+        directory = directory.strip("/")
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                # A range over the primary key, as "/" sorts just before "0"
+                paths = [
+                    path
+                    for (path,) in connection.execute(
+                        "SELECT path FROM entries WHERE path >= ? AND path < ?",
+                        (directory + "/", directory + "0"),
+                    )
+                ]
+                connection.executemany(
+                    "DELETE FROM entries WHERE path = ?", ((path,) for path in paths)
+                )
+        return paths
+
+    def evict(self, max_bytes: int) -> List[str]:
+        """
+        Remove the least recently read entries until the cached files fit in
+        `max_bytes`. Entries not yet uploaded are kept.
+
+        Returns:
+            List[str]: The paths whose files the caller must now delete.
+        """
+        with self._lock:
+            connection = self._connect()
+            # An immediate transaction, so two processes cannot evict the same bytes
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                (total,) = connection.execute(
+                    "SELECT COALESCE(SUM(size), 0) FROM entries"
+                ).fetchone()
+                evicted = []
+                if total > max_bytes:
+                    for path, size in connection.execute(
+                        "SELECT path, size FROM entries WHERE dirty = 0 ORDER BY accessed"
+                    ):
+                        if total <= max_bytes:
+                            break
+                        evicted.append(path)
+                        total -= size
+                    connection.executemany(
+                        "DELETE FROM entries WHERE path = ?", ((path,) for path in evicted)
+                    )
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+        return evicted
+
+    def total_size(self) -> int:
+        with self._lock:
+            (total,) = self._connect().execute(
+                "SELECT COALESCE(SUM(size), 0) FROM entries"
+            ).fetchone()
+        return total
+
+    def close(self) -> None:
+        with self._lock:
+            if self._connection is not None and self._pid == os.getpid():
+                self._connection.close()
+            self._connection = None
+
+    def _connect(self) -> sqlite3.Connection:
+        # SQLite connections must not be used on both sides of a fork
+        if self._connection is None or self._pid != os.getpid():
+            connection = sqlite3.connect(
+                self.path, timeout=self.timeout, check_same_thread=False
+            )
+            connection.execute("PRAGMA journal_mode=WAL")
+            # WAL keeps the database consistent without syncing on every commit
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.executescript(_SCHEMA)
+            self._connection = connection
+            self._pid = os.getpid()
+        return self._connection
@@ -0,0 +1,557 @@
+import atexit
+import os
+import posixpath
+import tempfile
+import threading
+import time
+from datetime import datetime
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional, Tuple, Union
+
+from ... import StorageConfig
+from ..base import (
+    NOT_MODIFIED,
+    FileStat,
+    StorageBase,
+    StorageEntry,
+    _NotModified,
+    _raise_first,
+)
+from ..convert import encode
+from ..local import LocalStorage
+from ..local.stream import LocalFileWriter
+from ..s3 import S3Storage
+from ..stream import StreamWriter
+from .. import utils
+from ...exception import NotFoundError
+from .catalog import CATALOG_FILE_NAME, DiskCatalog
+
+DEFAULT_TIER_MAX_BYTES = 10 * 1024 * 1024 * 1024
+DEFAULT_TIER_FLUSH_INTERVAL = 5.0
+
+WRITE_MODES = ("through", "back")
+
+
+def _relative_parts(directory: str, file_path: str) -> List[str]:
+    directory = directory.strip("/")
+    if directory:
+        file_path = file_path[len(directory) + 1 :]
+    return file_path.split("/")
+
+
+def _remove(file_path: str) -> None:
+    try:
+        os.remove(file_path)
+    except FileNotFoundError:
+        pass
+
+
+class TieredStorage(StorageBase):
+    """
+    An S3 bucket with a cache directory on local disk in front of it.
+
+    Files are cached as stored in S3, and read like any local file, memory-mapped when
+    large. A cached copy is revalidated against the object's ETag with a conditional
+    GET, which costs a 304 and no transfer, once it is older than `TIER_TTL` seconds.
+
+    Writes go to S3 and the cache together ("through"), or only to the cache and are
+    uploaded by `flush` ("back"). The cache holds at most `TIER_MAX_BYTES` of files,
+    evicting the least recently read first. Its catalog is a SQLite database in the
+    cache directory, so processes on one node can share the directory.
+    """
+
+    def __init__(self, config) -> None:
+        self.origin = S3Storage(config)
+        self.max_workers = self.origin.max_workers
+        self.query_index_path = self.origin.query_index_path
+        self.query_refresh_ttl = self.origin.query_refresh_ttl
+
+        cache_dir = utils.get_config_option(
+            config,
+            "TIER_CACHE_DIR",
+            os.path.join(tempfile.gettempdir(), "acrud", self.origin.bucket),
+        )
+        os.makedirs(cache_dir, exist_ok=True)
+        # Plain metadata files, and the origin's compression so write-back files are
+        # uploaded exactly as write-through would have sent them
+        self.cache = LocalStorage(
+            StorageConfig({"root": cache_dir, "max_workers": self.max_workers})
+        )
+        self.cache.compression = self.origin.compression
+        self.catalog = DiskCatalog(os.path.join(cache_dir, CATALOG_FILE_NAME))
+
+        self.max_bytes = utils.get_config_option(
+            config, "TIER_MAX_BYTES", DEFAULT_TIER_MAX_BYTES, int
+        )
+        # By default every read asks S3 whether the cached copy is still current
+        self.ttl = utils.get_config_option(config, "TIER_TTL", 0.0, float)
+        self.write_mode = utils.get_config_option(
+            config, "TIER_WRITE_MODE", "through", str.lower
+        )
+        if self.write_mode not in WRITE_MODES:
+            raise ValueError(
+                f"Unsupported tier write mode: {self.write_mode}. Use one of {WRITE_MODES}."
+            )
+
+        self._closed = threading.Event()
+        self._flush_lock = threading.Lock()
+        self._flush_thread = None
+        if self.write_mode == "back":
+            interval = utils.get_config_option(
+                config, "TIER_FLUSH_INTERVAL", DEFAULT_TIER_FLUSH_INTERVAL, float
+            )
+            if interval > 0:
+                self._flush_thread = threading.Thread(
+                    target=self._flush_periodically, args=(interval,), daemon=True
+                )
+                self._flush_thread.start()
+            atexit.register(self.close)
+
+    @property
+    def cache_dir(self) -> str:
+        return self.cache.root_dir
+
+    def ping(self) -> dict:
+        return self.origin.ping()
+
+    def create_file(
+        self, file_path: str, data: Any, meta_data: Optional[dict] = None
+    ) -> None:
+        """
+        Save a file to S3 and the cache, or only to the cache in write-back mode.
+        The data must be of a supported type.
+        The meta data, if provided, must be a dictionary.
+
+        Args:
+            file_path (str): The path to the file.
+            data (Any): The data to save.
+            meta_data (Optional[dict], optional): The meta data to save. Defaults
+
+        Returns:
+            None
+        """
+        raw = self.origin.compression.compress(file_path, encode(file_path, data))
+        # Without new metadata a file keeps its old metadata, as in S3
+        cached_meta_data = meta_data
+        if meta_data is None:
+            cached_meta_data = self._current_meta_data(file_path)
+
+        if self.write_mode == "back":
+            self._store(file_path, raw, cached_meta_data, etag=None, dirty=True)
+            return
+
+        etag = self.origin.write_raw(file_path, raw, meta_data)
+        self._store(file_path, raw, cached_meta_data, etag)
+
+    def read_file(
+        self,
+        file_path: str,
+        if_none_match: Optional[str] = None,
+        if_modified_since: Optional[datetime] = None,
+        stream: bool = False,
+    ) -> Union[Tuple[Any, Optional[dict]], _NotModified]:
+        """
+        Read a file, from the cache if it holds a current copy.
+        The data will be converted to the appropriate type.
+
+        Args:
+            file_path (str): The path to the file.
+            if_none_match (Optional[str], optional): Return `NOT_MODIFIED` if the
+                cached copy still has this version token.
+            if_modified_since (Optional[datetime], optional): Return `NOT_MODIFIED` if the
+                cached copy has not been modified since this time.
+            stream (bool, optional): Return a lazy iterator over the rows of a CSV file
+                (or the lines of a text file) instead of loading it. Defaults to False.
+
+        Returns:
+            Union[Tuple[Any, Optional[dict]], _NotModified]: The data and, if available,
+                the meta data.
+        """
+        return self._cached(
+            file_path,
+            lambda: self.cache.read_file(
+                file_path, if_none_match, if_modified_since, stream=stream
+            ),
+        )
+
+    def read_file_with_version(
+        self,
+        file_path: str,
+        if_none_match: Optional[str] = None,
+        if_modified_since: Optional[datetime] = None,
+    ) -> Union[Tuple[Any, Optional[dict], str], _NotModified]:
+        """
+        Read a file along with the version token of its cached copy.
+        The copy is brought up to date with S3 first, so the token changes whenever
+        the object does.
+
+        Args:
+            file_path (str): The path to the file.
+            if_none_match (Optional[str], optional): A version token from a previous read.
+            if_modified_since (Optional[datetime], optional): Only read the file if it
+                was modified after this time.
+
+        Returns:
+            Union[Tuple[Any, Optional[dict], str], _NotModified]: The data, the meta data
+                and the version token, or `NOT_MODIFIED`.
+        """
+        return self._cached(
+            file_path,
+            lambda: self.cache.read_file_with_version(
+                file_path, if_none_match, if_modified_since
+            ),
+        )
+
+    def exists(self, file_path: str) -> bool:
+        if self._is_dirty(file_path):
+            return True
+        return self.origin.exists(file_path)
+
+    def stat(self, file_path: str) -> FileStat:
+        # Files not yet written back only exist in the cache
+        if self._is_dirty(file_path):
+            return self.cache.stat(file_path)
+        return self.origin.stat(file_path)
+
+    def read_meta_data(self, file_path: str) -> Optional[dict]:
+        if self._is_dirty(file_path):
+            return self.cache.read_meta_data(file_path)
+        return self.origin.read_meta_data(file_path)
+
+    def list_meta_data(self, file_path: str) -> Dict[str, dict]:
+        meta_data = self.origin.list_meta_data(file_path)
+        for path in self._dirty_files(file_path, recursive=False):
+            cached_meta_data = self.cache.read_meta_data(path)
+            if cached_meta_data is None:
+                meta_data.pop(path, None)
+            else:
+                meta_data[path] = cached_meta_data
+        return meta_data
+
+    def rebuild_metadata_index(self, file_path: str) -> None:
+        self.origin.rebuild_metadata_index(file_path)
+
+    def query(
+        self,
+        file_path: str = "",
+        filter: Optional[dict] = None,
+        refresh: Optional[bool] = None,
+    ) -> Dict[str, dict]:
+        return self.origin.query(file_path, filter, refresh)
+
+    def read_range(self, file_path: str, start: int, end: Optional[int] = None) -> bytes:
+        return self._cached(file_path, lambda: self.cache.read_range(file_path, start, end))
+
+    def open_read(self, file_path: str) -> BinaryIO:
+        return self._cached(file_path, lambda: self.cache.open_read(file_path))
+
+    def open_random_access(self, file_path: str) -> BinaryIO:
+        return self._cached(file_path, lambda: self.cache.open_random_access(file_path))
+
+    def read_table(
+        self,
+        file_path: str,
+        columns: Optional[List[str]] = None,
+        filter: Optional[dict] = None,
+    ) -> Any:
+        return self._cached(
+            file_path, lambda: self.cache.read_table(file_path, columns, filter)
+        )
+
+    def open_write(self, file_path: str, meta_data: Optional[dict] = None) -> BinaryIO:
+        """
+        Open a file for writing as a binary stream.
+        In write-through mode the stream uploads to S3 and the cached copy is dropped
+        once it closes; in write-back mode it writes to the cache.
+
+        Args:
+            file_path (str): The path to the file.
+            meta_data (Optional[dict], optional): The meta data to save. Defaults
+
+        Returns:
+            BinaryIO: A writable stream for the raw file contents.
+        """
+        if self.write_mode == "through":
+            writer = self.origin.open_write(file_path, meta_data)
+            writer.add_commit_callback(lambda: self._discard(file_path))
+            return writer
+
+        if meta_data is None:
+            meta_data = self._current_meta_data(file_path)
+        full_file_path = os.path.join(self.cache_dir, file_path)
+        writer = StreamWriter(
+            self.origin.compression.wrap_writer(
+                file_path, LocalFileWriter(full_file_path)
+            )
+        )
+
+        def _commit() -> None:
+            self.cache.write_meta_data(file_path, meta_data)
+            size = os.stat(full_file_path).st_size
+            self.catalog.record(file_path, None, size, dirty=True)
+            self._evict()
+
+        writer.add_commit_callback(_commit)
+        return writer
+
+    def update_file(
+        self, file_path: str, data: Any, meta_data: Optional[dict] = None
+    ) -> None:
+        self.create_file(file_path, data, meta_data)
+
+    def delete_file(self, file_path: str) -> None:
+        """
+        Delete a file from the cache and S3, including pending write-back uploads.
+
+        Args:
+            file_path (str): The path to the file.
+
+        Returns:
+            None
+        """
+        self._discard(file_path)
+        self.origin.delete_file(file_path)
+
+    def copy_file(self, file_path: str, new_file_path: str) -> None:
+        self._flush_file(file_path)
+        try:
+            self.origin.copy_file(file_path, new_file_path)
+        finally:
+            self._discard(new_file_path)
+
+    def move_file(self, file_path: str, new_file_path: str) -> None:
+        self._flush_file(file_path)
+        try:
+            self.origin.move_file(file_path, new_file_path)
+        finally:
+            self._discard(file_path)
+            self._discard(new_file_path)
+
+    def move_directory(self, file_path: str, new_file_path: str) -> None:
+        self.flush()
+        try:
+            self.origin.move_directory(file_path, new_file_path)
+        finally:
+            for directory in (file_path, new_file_path):
+                for path in self.catalog.remove_directory(directory):
+                    self._remove_cached(path)
+
+    def list_files_in_directory(self, file_path: str) -> list:
+        return list(self.iter_files_in_directory(file_path))
+
+    def list_subdirectories_in_directory(self, file_path: str) -> list:
+        return list(self.iter_subdirectories_in_directory(file_path))
+
+    def iter_files_in_directory(self, file_path: str) -> Iterator[str]:
+        pending = {
+            os.path.splitext(posixpath.basename(path))[0]
+            for path in self._dirty_files(file_path, recursive=False)
+        }
+        for name in self.origin.iter_files_in_directory(file_path):
+            pending.discard(name)
+            yield name
+        yield from sorted(pending)
+
+    def iter_subdirectories_in_directory(self, file_path: str) -> Iterator[str]:
+        pending = set()
+        for path in self._dirty_files(file_path):
+            parts = _relative_parts(file_path, path)
+            if len(parts) > 1:
+                pending.add(parts[0])
+        for name in self.origin.iter_subdirectories_in_directory(file_path):
+            pending.discard(name)
+            yield name
+        yield from sorted(pending)
+
+    def walk(
+        self, file_path: str = "", recursive: bool = True, stat: bool = True
+    ) -> Iterator[StorageEntry]:
+        """
+        Lazily iterate over the files and directories below a prefix in S3, along with
+        the files written back to the cache but not yet uploaded, which are described
+        by their cached copy.
+
+        Args:
+            file_path (str, optional): The path to the directory. Defaults to the root.
+            recursive (bool, optional): Descend into subdirectories. Defaults to True.
+            stat (bool, optional): Include sizes and modification times. Defaults to True.
+
+        Returns:
+            Iterator[StorageEntry]: One entry per file or directory, in no particular order.
+        """
+        pending_files = set()
+        pending_directories = set()
+        for path in self._dirty_files(file_path):
+            parts = _relative_parts(file_path, path)
+            if recursive or len(parts) == 1:
+                pending_files.add(path)
+            depth = len(parts) if recursive else min(len(parts), 2)
+            for i in range(1, depth):
+                pending_directories.add(posixpath.join(file_path.strip("/"), *parts[:i]))
+
+        for entry in self.origin.walk(file_path, recursive, stat):
+            if entry.is_dir:
+                pending_directories.discard(entry.path)
+            elif entry.path in pending_files:
+                # The uploaded copy is older than the cached one
+                continue
+            yield entry
+
+        for path in sorted(pending_directories):
+            yield StorageEntry(path, None, None, True, False)
+        for path in sorted(pending_files):
+            try:
+                file_stat = self.cache.stat(path)
+            except NotFoundError:
+                # Deleted since it was written
+                continue
+            if stat:
+                yield StorageEntry(
+                    path, file_stat.size, file_stat.mtime, False, file_stat.has_metadata
+                )
+            else:
+                yield StorageEntry(path, None, None, False, file_stat.has_metadata)
+
+    def flush(self) -> None:
+        """
+        Upload every file written back to the cache but not yet to S3, including those
+        written by other processes sharing the cache directory.
+        A file written again during its upload stays pending for the next flush.
+
+        Returns:
+            None
+        """
+        with self._flush_lock:
+            pending = self.catalog.dirty()
+            _raise_first(self._map(self._upload, pending))
+        self._evict()
+
+    def close(self) -> None:
+        """
+        Stop the background flush and upload the pending writes.
+
+        Returns:
+            None
+        """
+        if self._closed.is_set():
+            return
+        self._closed.set()
+        if self._flush_thread is not None:
+            self._flush_thread.join()
+        if self.write_mode == "back":
+            self.flush()
+            atexit.unregister(self.close)
+
+    def _cached(self, file_path: str, read: Any) -> Any:
+        # Bring the cached copy up to date and read it. Another process may evict the
+        # copy in between, in which case it is fetched again.
+        for attempt in range(2):
+            self._fetch(file_path)
+            try:
+                return read()
+            except FileNotFoundError:
+                if attempt == 1:
+                    raise
+                self.catalog.remove(file_path)
+
+    def _fetch(self, file_path: str) -> None:
+        entry = self.catalog.get(file_path)
+        if entry is not None and os.path.exists(os.path.join(self.cache_dir, file_path)):
+            if entry.dirty or time.time() - entry.checked < self.ttl:
+                self.catalog.touch(file_path)
+                return
+            result = self.origin.read_raw(file_path, entry.etag)
+            if result is NOT_MODIFIED:
+                # The metadata can change without the data, so it is read again
+                self._refresh_meta_data(file_path)
+                self.catalog.touch(file_path, checked=True)
+                return
+        else:
+            result = self.origin.read_raw(file_path)
+
+        raw, etag = result
+        self._store(file_path, raw, self.origin.read_meta_data(file_path), etag)
+
+    def _store(
+        self,
+        file_path: str,
+        raw,
+        meta_data: Optional[dict],
+        etag: Optional[str],
+        dirty: bool = False,
+    ) -> int:
+        # Save the file as stored in S3, replacing any older copy in one step
+        full_file_path = os.path.join(self.cache_dir, file_path)
+        writer = LocalFileWriter(full_file_path)
+        try:
+            writer.write(raw)
+        except BaseException:
+            writer.discard()
+            raise
+        writer.commit()
+        self.cache.write_meta_data(file_path, meta_data)
+
+        version = self.catalog.record(file_path, etag, len(raw), dirty)
+        self._evict()
+        return version
+
+    def _refresh_meta_data(self, file_path: str) -> None:
+        meta_data = self.origin.read_meta_data(file_path)
+        if meta_data != self.cache.read_meta_data(file_path):
+            self.cache.write_meta_data(file_path, meta_data)
+
+    def _current_meta_data(self, file_path: str) -> Optional[dict]:
+        # The metadata of the cached copy, or of the object if it is not cached
+        if self.catalog.get(file_path) is not None:
+            return self.cache.read_meta_data(file_path)
+        return self.origin.read_meta_data(file_path)
+
+    def _upload(self, file_path: str, version: int) -> None:
+        full_file_path = os.path.join(self.cache_dir, file_path)
+        try:
+            with open(full_file_path, "rb") as f:
+                raw = f.read()
+        except FileNotFoundError:
+            # Deleted since it was written
+            return
+        meta_data = self.cache.read_meta_data(file_path)
+
+        etag = self.origin.write_raw(file_path, raw, meta_data)
+        self.catalog.mark_clean(file_path, version, etag)
+
+    def _flush_file(self, file_path: str) -> None:
+        entry = self.catalog.get(file_path)
+        if entry is not None and entry.dirty:
+            self._upload(file_path, entry.version)
+
+    def _dirty_files(self, file_path: str, recursive: bool = True) -> List[str]:
+        # Files below a directory that are only in the cache, or newer there than in S3
+        paths = [path for path, _ in self.catalog.dirty(file_path)]
+        if not recursive:
+            directory = file_path.strip("/")
+            paths = [path for path in paths if posixpath.dirname(path) == directory]
+        return paths
+
+    def _is_dirty(self, file_path: str) -> bool:
+        entry = self.catalog.get(file_path)
+        return entry is not None and entry.dirty
+
+    def _flush_periodically(self, interval: float) -> None:
+        while not self._closed.wait(interval):
+            try:
+                self.flush()
+            except Exception:
+                # Failed uploads stay pending and are retried on the next flush
+                pass
+
+    def _evict(self) -> None:
+        for file_path in self.catalog.evict(self.max_bytes):
+            self._remove_cached(file_path)
+
+    def _discard(self, file_path: str) -> None:
+        self.catalog.remove(file_path)
+        self._remove_cached(file_path)
+
+    def _remove_cached(self, file_path: str) -> None:
+        full_file_path = os.path.join(self.cache_dir, file_path)
+        _remove(full_file_path)
+        _remove(utils.get_meta_data_file_path(full_file_path))
@@ -1,4 +1,5 @@
 import os
+from typing import Any, Callable, Optional
 
 
 def get_meta_data_file_path(file_path: str):
@@ -6,3 +7,50 @@ def get_meta_data_file_path(file_path: str):
     file_path = ".".join(file_path)
     meta_data_file_path = file_path + "_meta.json"
     return meta_data_file_path
+
+
+def get_extension(file_path: str) -> str:
+    """
+    Get the extension of a file, lower-cased and without the dot, which picks the
+    format it is read and written in.
+    """
+    return file_path.rpartition(".")[2].lower()
+
+
+def to_bool(value: Any) -> bool:
+    """
+    Interpret a config value as a boolean.
+    Values read from `storage.config` are strings, so `"false"` must be falsy.
+    """
+    if isinstance(value, str):
+        return value.strip().lower() in ("1", "true", "yes", "on")
+    return bool(value)
+
+
+def get_config_option(
+    config, name: str, default: Any = None, cast: Optional[Callable] = None
+) -> Any:
+    """
+    Read an optional setting from a `StorageConfig`.
+    `configparser` lower-cases keys, so both `MAX_WORKERS` and `max_workers` resolve
+    to the same attribute.
+
+    Args:
+        config (StorageConfig): The storage configuration.
+        name (str): The name of the setting.
+        default (Any, optional): The value to use if the setting is missing.
+        cast (Optional[Callable], optional): Applied to the value if it is present.
+
+    Returns:
+        Any: The setting value.
+    """
+    value = getattr(config, name.lower(), None)
+    if value is None:
+        value = getattr(config, name.upper(), None)
+    if value is None or value == "":
+        return default
+    if cast is bool:
+        return to_bool(value)
+    if cast is not None:
+        return cast(value)
+    return value
@@ -0,0 +1,77 @@
+# Compares the codecs in acrud.storage.convert with the encoders they replace.
+# Run from the repository root with `python -m scripts.benchmarks.codecs`.
+import json
+import pickle
+import timeit
+
+import dill
+
+from acrud.storage import convert
+
+RECORDS = {
+    "records": [
+        {"id": i, "name": f"item-{i}", "price": i * 0.5, "tags": ["a", "b"]}
+        for i in range(10_000)
+    ]
+}
+try:
+    import numpy
+
+    WEIGHTS = numpy.random.random(8 * 1024 * 1024)
+except ImportError:
+    # bytearray is also pickled out-of-band, but must be copied when loaded
+    WEIGHTS = bytearray(64 * 1024 * 1024)
+BLOB = {"weights": WEIGHTS, "name": "model"}
+
+
+def bench(name: str, func, number: int) -> float:
+    seconds = min(timeit.repeat(func, number=number, repeat=3)) / number
+    print(f"{name:<40} {seconds * 1000:10.2f} ms")
+    return seconds
+
+
+def compare(title: str, baseline: float, candidate: float) -> None:
+    print(f"{title:<40} {baseline / candidate:10.1f}x\n")
+
+
+json_bytes = json.dumps(RECORDS).encode("utf-8")
+baseline = bench("json.dumps", lambda: json.dumps(RECORDS).encode("utf-8"), 20)
+candidate = bench("codec json encode", lambda: convert.encode("a.json", RECORDS), 20)
+compare("json encode speedup", baseline, candidate)
+
+baseline = bench("json.loads", lambda: json.loads(str(json_bytes, "utf-8")), 20)
+candidate = bench("codec json decode", lambda: convert.decode("a.json", json_bytes), 20)
+compare("json decode speedup", baseline, candidate)
+
+dill_bytes = dill.dumps(BLOB)
+# A bytearray, as returned by large S3 downloads, lets buffers be used in place
+pickle_bytes = bytearray(convert.encode("a.pkl", BLOB))
+baseline = bench("dill.dumps", lambda: dill.dumps(BLOB), 5)
+candidate = bench("codec pkl encode", lambda: convert.encode("a.pkl", BLOB), 5)
+compare("pickle encode speedup", baseline, candidate)
+
+baseline = bench("dill.loads", lambda: dill.loads(dill_bytes), 5)
+candidate = bench("codec pkl decode", lambda: convert.decode("a.pkl", pickle_bytes), 5)
+compare("pickle decode speedup", baseline, candidate)
+
+try:
+    convert._require_msgpack()
+    has_msgpack = True
+except ImportError:
+    has_msgpack = False
+
+if has_msgpack:
+    baseline = bench("json.dumps", lambda: json.dumps(RECORDS).encode("utf-8"), 20)
+    candidate = bench(
+        "codec msgpack encode", lambda: convert.encode("a.msgpack", RECORDS), 20
+    )
+    compare("msgpack encode vs json", baseline, candidate)
+
+    msgpack_bytes = convert.encode("a.msgpack", RECORDS)
+    baseline = bench("json.loads", lambda: json.loads(str(json_bytes, "utf-8")), 20)
+    candidate = bench(
+        "codec msgpack decode", lambda: convert.decode("a.msgpack", msgpack_bytes), 20
+    )
+    compare("msgpack decode vs json", baseline, candidate)
+else:
+    print("msgpack is not installed, skipping")
@@ -0,0 +1,43 @@
+# Compares the per-call cost of `convert`, which dispatches on the argument types, with
+# the codec table used by the storage backends, for small files where dispatch dominates.
+# Run from the repository root with `python -m scripts.benchmarks.convert`.
+import timeit
+
+from acrud.storage import convert
+
+RECORD = {"id": 1, "name": "item-1", "tags": ["a", "b"]}
+TEXT = "id,name\n1,item-1\n"
+NUMBER = 100_000
+
+
+def bench(name: str, func) -> float:
+    seconds = min(timeit.repeat(func, number=NUMBER, repeat=3)) / NUMBER
+    print(f"{name:<40} {seconds * 1e6:10.2f} us")
+    return seconds
+
+
+def compare(title: str, baseline: float, candidate: float) -> None:
+    print(f"{title:<40} {baseline / candidate:10.1f}x\n")
+
+
+record_bytes = convert.encode("a.json", RECORD)
+baseline = bench("convert dict -> bytes", lambda: convert.convert(RECORD, bytes))
+candidate = bench("encode json", lambda: convert.encode("a.json", RECORD))
+compare("json encode speedup", baseline, candidate)
+
+baseline = bench("convert bytes -> dict", lambda: convert.convert(record_bytes, dict))
+candidate = bench("decode json", lambda: convert.decode("a.json", record_bytes))
+compare("json decode speedup", baseline, candidate)
+
+baseline = bench("convert dict -> bytes (meta data)", lambda: convert.convert(RECORD, bytes))
+candidate = bench("encode_meta_data", lambda: convert.encode_meta_data(RECORD))
+compare("meta data encode speedup", baseline, candidate)
+
+text_bytes = convert.encode("a.csv", TEXT)
+baseline = bench("convert str -> bytes", lambda: convert.convert(TEXT, bytes))
+candidate = bench("encode csv", lambda: convert.encode("a.csv", TEXT))
+compare("text encode speedup", baseline, candidate)
+
+baseline = bench("convert bytes -> str", lambda: convert.convert(text_bytes, str))
+candidate = bench("decode csv", lambda: convert.decode("a.csv", text_bytes))
+compare("text decode speedup", baseline, candidate)
@@ -0,0 +1,58 @@
+# Measures how long `import acrud` takes, and how long creating the default storage
+# takes on top, each in a fresh interpreter. Run from the repository root with
+# `python -m scripts.benchmarks.import_time`.
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+REPEAT = 10
+# The interpreters run elsewhere, so they import acrud from this checkout
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+HEAVY_MODULES = ("boto3", "aiobotocore", "PyPDF2", "dill", "multimethod", "asyncio")
+
+SNIPPET = """
+import sys, time
+start = time.perf_counter()
+import acrud
+imported = time.perf_counter()
+{access}
+end = time.perf_counter()
+loaded = [m for m in {heavy!r} if m in sys.modules]
+print(imported - start, end - start, ",".join(loaded))
+"""
+
+
+def run(access: str, cwd: str) -> None:
+    import_times, total_times = [], []
+    for _ in range(REPEAT):
+        output = subprocess.run(
+            [sys.executable, "-c", SNIPPET.format(access=access, heavy=HEAVY_MODULES)],
+            cwd=cwd,
+            env={
+                **os.environ,
+                "PYTHONPATH": os.pathsep.join(
+                    filter(None, [ROOT, os.environ.get("PYTHONPATH")])
+                ),
+            },
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.split(" ")
+        import_times.append(float(output[0]))
+        total_times.append(float(output[1]))
+        loaded = output[2].strip() or "-"
+
+    print(f"{'import acrud':<40} {statistics.median(import_times) * 1000:10.1f} ms")
+    if access:
+        print(f"{access:<40} {statistics.median(total_times) * 1000:10.1f} ms")
+    print(f"{'heavy modules loaded':<40} {loaded:>13}\n")
+
+
+with tempfile.TemporaryDirectory() as root:
+    with open(os.path.join(root, "storage.config"), "w") as f:
+        f.write(f"[DEFAULT]\nSTORAGE_TYPE = local\nROOT = {root}\n")
+
+    run("", root)
+    run("acrud.default_storage()", root)
@@ -6,7 +6,9 @@ os.chdir(os.path.dirname(os.path.abspath(__file__)))
 
 import argparse
 
-from acrud import storage
+import acrud
+
+storage = acrud.default_storage()
 
 parser = argparse.ArgumentParser()
 parser.add_argument("--file_path", type=str, required=True)
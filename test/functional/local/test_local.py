@@ -4,13 +4,17 @@ import json
 from unittest.mock import patch, mock_open
 from typing import Any
 import shutil
+import asyncio
+import gzip
 
 
 # Set working directory to the directory of this file
 os.chdir(os.path.dirname(os.path.abspath(__file__)))
 
-# Assuming the LocalStorage class is in a module called local
-from acrud import storage
+import acrud
+
+# The storage configured by storage.config next to this file
+storage = acrud.default_storage()
 
 
 class TestLocalStorage:
@@ -138,6 +142,22 @@ class TestLocalStorage:
         expected_files = {os.path.splitext(f)[0] for f in test_files}
         assert set(files) == expected_files
 
+    def test_walk(self, root_dir, setup_teardown):
+        """Test walking a directory tree reports files, directories and metadata."""
+        storage.create_file("tmp/walk/a.txt", "a", {"author": "Test"})
+        storage.create_file("tmp/walk/sub/b.txt", "bb")
+        storage.create_file("tmp/walk/.hidden/c.txt", "c")
+
+        entries = {entry.path: entry for entry in storage.walk("tmp/walk")}
+        assert set(entries) == {"tmp/walk/a.txt", "tmp/walk/sub", "tmp/walk/sub/b.txt"}
+        assert entries["tmp/walk/a.txt"].has_metadata
+        assert not entries["tmp/walk/sub/b.txt"].has_metadata
+        assert entries["tmp/walk/sub"].is_dir
+        assert entries["tmp/walk/sub/b.txt"].size == 2
+
+        shallow = {entry.path for entry in storage.walk("tmp/walk", recursive=False)}
+        assert shallow == {"tmp/walk/a.txt", "tmp/walk/sub"}
+
     def test_list_subdirectories(self, root_dir, setup_teardown):
         """Test listing subdirectories."""
         # Create a separate test directory
@@ -154,3 +174,874 @@ class TestLocalStorage:
 
         dirs = storage.list_subdirectories_in_directory("tmp/test_dirs")
         assert set(dirs) == set(test_dirs)
+
+    def test_conditional_read(self, root_dir, setup_teardown):
+        """Test a conditional read skips unchanged files and sees new versions."""
+        from acrud.storage import NOT_MODIFIED
+
+        file_path = "tmp/conditional.txt"
+        storage.create_file(file_path, "first")
+        data, _, version = storage.read_file_with_version(file_path)
+        assert data == "first"
+
+        assert storage.read_file(file_path, if_none_match=version) is NOT_MODIFIED
+
+        storage.update_file(file_path, "second version")
+        data, _ = storage.read_file(file_path, if_none_match=version)
+        assert data == "second version"
+
+    def test_streaming_write_and_read(self, root_dir, setup_teardown):
+        """Test CSV files can be written and read back as streams."""
+        file_path = "tmp/stream.csv"
+
+        with storage.open_write(file_path, {"rows": 100}) as f:
+            f.write(b"id,value\n")
+            for i in range(100):
+                f.write(f"{i},{i * i}\n".encode())
+
+        rows, meta_data = storage.read_file(file_path, stream=True)
+        assert next(rows) == ["id", "value"]
+        assert list(rows)[-1] == ["99", "9801"]
+        assert meta_data == {"rows": 100}
+
+        # Extensions are matched regardless of case, as for regular reads
+        storage.create_file("tmp/upper.CSV", "id,value\n1,1\n")
+        rows, _ = storage.read_file("tmp/upper.CSV", stream=True)
+        assert list(rows) == [["id", "value"], ["1", "1"]]
+
+    def test_streaming_write_aborts_on_error(self, root_dir, setup_teardown):
+        """Test a failed streaming write leaves no file behind."""
+        file_path = "tmp/aborted.csv"
+
+        with pytest.raises(RuntimeError):
+            with storage.open_write(file_path) as f:
+                f.write(b"partial")
+                raise RuntimeError("failed mid-write")
+
+        assert not os.path.exists(os.path.join(root_dir, file_path))
+        assert os.listdir(os.path.join(root_dir, "tmp")) == []
+
+    def test_streaming_write_aborts_on_failed_flush(self, root_dir, setup_teardown):
+        """Test a stream whose final flush fails is discarded rather than committed."""
+        from acrud.storage.stream import RawStreamWriter, StreamWriter
+
+        class FailingWriter(RawStreamWriter):
+            def __init__(self):
+                super().__init__()
+                self.calls = []
+
+            def write(self, data):
+                raise OSError("disk full")
+
+            def commit(self):
+                self.calls.append("commit")
+
+            def discard(self):
+                self.calls.append("discard")
+
+        raw = FailingWriter()
+        f = StreamWriter(raw, buffer_size=16)
+        f.write(b"buffered")
+        with pytest.raises(OSError):
+            f.close()
+
+        assert f.closed
+        assert raw.calls == ["discard"]
+
+    def test_memory_mapped_read(self, root_dir, setup_teardown):
+        """Test files above the mmap threshold decode the same as regular reads."""
+        from acrud import StorageConfig
+        from acrud.storage.local import LocalStorage
+
+        mapped_storage = LocalStorage(
+            StorageConfig({"root": root_dir, "MMAP_THRESHOLD": "1"})
+        )
+        test_data = {"values": list(range(1000))}
+        mapped_storage.create_file("tmp/mapped.json", test_data)
+        mapped_storage.create_file("tmp/mapped.txt", "Hello, World!")
+
+        assert mapped_storage.read_file("tmp/mapped.json") == (test_data, None)
+        assert mapped_storage.read_file("tmp/mapped.txt") == ("Hello, World!", None)
+
+        # A mapping is closed when decoding it fails
+        mappings = []
+
+        def failing_decode(file_path, obj):
+            mappings.append(obj)
+            raise ValueError("Corrupt file")
+
+        with patch("acrud.storage.local.local.decode", failing_decode):
+            with pytest.raises(ValueError):
+                mapped_storage.read_file("tmp/mapped.txt")
+        assert mappings[0].closed
+
+    def test_read_range(self, root_dir, setup_teardown):
+        """Test reading a slice of a file."""
+        storage.create_file("tmp/range.txt", "0123456789")
+
+        assert storage.read_range("tmp/range.txt", 2, 5) == b"234"
+        assert storage.read_range("tmp/range.txt", 7) == b"789"
+        assert storage.read_range("tmp/range.txt", 20) == b""
+        assert storage.head("tmp/range.txt", 4) == b"0123"
+        with storage.map_file("tmp/range.txt") as view:
+            assert view[:3] == b"012"
+
+    def test_read_csv_header(self, root_dir, setup_teardown):
+        """Test the header row is parsed from the start of a CSV file."""
+        rows = "\n".join(f"{i},{i * 2}" for i in range(1000))
+        storage.create_file("tmp/header.csv", f'id,"value\nsquared"\n{rows}\n')
+
+        header = storage.read_csv_header("tmp/header.csv", n_bytes=4)
+        assert header == ["id", "value\nsquared"]
+
+    def test_bulk_operations(self, root_dir, setup_teardown):
+        """Test the bulk API keeps input order and reports per-item errors."""
+        paths = [f"tmp/bulk/{i}.json" for i in range(10)]
+
+        results = storage.create_files((p, {"path": p}, None) for p in paths)
+        assert results == [None] * len(paths)
+
+        results = storage.read_files(paths + ["tmp/bulk/missing.json"])
+        assert [data["path"] for data, _ in results[:-1]] == paths
+        assert isinstance(results[-1], LookupError)
+
+        assert storage.delete_files(paths) == [None] * len(paths)
+        assert not any(os.path.exists(p) for p in paths)
+
+    def test_metadata_index(self, root_dir, setup_teardown):
+        """Test metadata is kept in the directory index instead of sidecar files."""
+        from acrud import StorageConfig
+        from acrud.storage.local import LocalStorage
+
+        indexed_storage = LocalStorage(
+            StorageConfig({"root": root_dir, "METADATA_INDEX": "true"})
+        )
+        indexed_storage.create_file("tmp/index/a.txt", "a", {"author": "A"})
+        indexed_storage.create_file("tmp/index/b.txt", "b", {"author": "B"})
+        indexed_storage.create_file("tmp/index/c.txt", "c")
+
+        assert not os.path.exists(os.path.join(root_dir, "tmp/index/a_meta.json"))
+        assert indexed_storage.read_file("tmp/index/a.txt") == ("a", {"author": "A"})
+        assert indexed_storage.read_meta_data("tmp/index/c.txt") is None
+        assert indexed_storage.list_meta_data("tmp/index") == {
+            "tmp/index/a.txt": {"author": "A"},
+            "tmp/index/b.txt": {"author": "B"},
+        }
+        assert set(indexed_storage.list_files_in_directory("tmp/index")) == {"a", "b", "c"}
+
+        indexed_storage.delete_file("tmp/index/a.txt")
+        assert set(indexed_storage.list_meta_data("tmp/index")) == {"tmp/index/b.txt"}
+
+        # A directory with metadata files keeps them when its index is first written
+        storage.create_file("tmp/sidecars/a.json", {"x": 1}, {"m": "legacy"})
+        indexed_storage.create_file("tmp/sidecars/b.json", {"x": 2}, {"m": "new"})
+        assert indexed_storage.read_file("tmp/sidecars/a.json") == (
+            {"x": 1},
+            {"m": "legacy"},
+        )
+        assert indexed_storage.list_meta_data("tmp/sidecars") == {
+            "tmp/sidecars/a.json": {"m": "legacy"},
+            "tmp/sidecars/b.json": {"m": "new"},
+        }
+
+        # Directories written without the index are migrated by rebuilding it
+        storage.create_file("tmp/legacy/d.txt", "d", {"author": "D"})
+        assert indexed_storage.read_meta_data("tmp/legacy/d.txt") == {"author": "D"}
+        indexed_storage.rebuild_metadata_index("tmp/legacy")
+        assert indexed_storage.list_meta_data("tmp/legacy") == {
+            "tmp/legacy/d.txt": {"author": "D"}
+        }
+
+    def test_metadata_index_batches_updates(self, root_dir, setup_teardown):
+        """Test concurrent updates of one directory's index are written together."""
+        import time
+        from acrud import StorageConfig
+        from acrud.storage.local import LocalStorage
+
+        indexed_storage = LocalStorage(
+            StorageConfig({"root": root_dir, "METADATA_INDEX": "true"})
+        )
+        store_index = indexed_storage.metadata_index._store
+        stores = []
+
+        def slow_store(*args):
+            stores.append(args[0])
+            time.sleep(0.05)
+            return store_index(*args)
+
+        indexed_storage.metadata_index._store = slow_store
+        results = indexed_storage.create_files(
+            (f"tmp/batch/{i}.txt", str(i), {"i": i}) for i in range(16)
+        )
+
+        assert results == [None] * 16
+        assert len(stores) < 16
+        assert indexed_storage.list_meta_data("tmp/batch") == {
+            f"tmp/batch/{i}.txt": {"i": i} for i in range(16)
+        }
+
+    def test_query(self, root_dir, setup_teardown):
+        """Test files are found by their metadata and the index follows changes."""
+        for i in range(6):
+            meta_data = {"source": "a" if i % 2 else "b", "year": 2020 + i}
+            storage.create_file(f"tmp/query/{i}.txt", str(i), meta_data)
+        storage.create_file("tmp/query/plain.txt", "no metadata")
+
+        assert len(storage.query("tmp/query")) == 6
+        assert set(storage.query("tmp/query", {"source": "a", "year": {">=": 2022}})) == {
+            "tmp/query/3.txt",
+            "tmp/query/5.txt",
+        }
+        assert set(storage.query("tmp/query", {"year": {"in": [2020, 2021]}})) == {
+            "tmp/query/0.txt",
+            "tmp/query/1.txt",
+        }
+
+        storage.delete_file("tmp/query/3.txt")
+        storage.update_file("tmp/query/0.txt", "0", {"source": "c"})
+        # The directory was walked less than QUERY_REFRESH_TTL seconds ago
+        assert "tmp/query/3.txt" in storage.query("tmp/query", {"source": "a"})
+        assert set(storage.query("tmp/query", {"source": "a"}, refresh=True)) == {
+            "tmp/query/1.txt",
+            "tmp/query/5.txt",
+        }
+        assert storage.query("tmp/query", {"source": "c"}) == {
+            "tmp/query/0.txt": {"source": "c"}
+        }
+
+        # Metadata changed without touching the data is picked up too
+        storage._write_meta_data(os.path.join(root_dir, "tmp/query/1.txt"), {"source": "d"})
+        assert storage.query("tmp/query", {"source": "d"}, refresh=True) == {
+            "tmp/query/1.txt": {"source": "d"}
+        }
+
+    def test_query_retries_failed_reads(self, root_dir, setup_teardown, caplog):
+        """Test files whose metadata could not be read are logged and read again."""
+        storage.create_file("tmp/retried/a.txt", "a", {"source": "a"})
+        storage.create_file("tmp/retried/b.txt", "b", {"source": "b"})
+        read_meta_data = storage.read_meta_data
+
+        def failing_read_meta_data(file_path):
+            if file_path.endswith("b.txt"):
+                raise OSError("Transient failure")
+            return read_meta_data(file_path)
+
+        with patch.object(storage, "read_meta_data", failing_read_meta_data):
+            assert set(storage.query("tmp/retried", refresh=True)) == {"tmp/retried/a.txt"}
+        assert "tmp/retried/b.txt" in caplog.text
+
+        # The failed walk does not count towards QUERY_REFRESH_TTL
+        assert set(storage.query("tmp/retried")) == {
+            "tmp/retried/a.txt",
+            "tmp/retried/b.txt",
+        }
+
+    def test_codecs(self, root_dir, setup_teardown):
+        """Test pickled objects, including those only dill can handle, round trip."""
+        test_object = {"values": [1, 2, 3], "buffer": bytearray(b"x" * 1000)}
+        storage.create_file("tmp/object.pkl", test_object)
+        assert storage.read_file("tmp/object.pkl") == (test_object, None)
+
+        storage.create_file("tmp/function.pkl", lambda x: x + 1)
+        assert storage.read_file("tmp/function.pkl")[0](1) == 2
+
+        # Classes defined in a script are stored by value, so other processes load them
+        import subprocess
+        import sys
+        import acrud
+
+        script = (
+            "from acrud.storage import convert\n"
+            "class Thing:\n"
+            "    value = 42\n"
+            f"open({os.path.join(root_dir, 'tmp/thing.pkl')!r}, 'wb')"
+            ".write(convert.encode('thing.pkl', Thing()))\n"
+        )
+        subprocess.run(
+            [sys.executable, "-c", script],
+            env={**os.environ, "PYTHONPATH": os.path.dirname(acrud.__path__[0])},
+            check=True,
+        )
+        assert storage.read_file("tmp/thing.pkl")[0].value == 42
+
+        storage.create_file("tmp/keys.json", {1: "one"})
+        assert storage.read_file("tmp/keys.json") == ({"1": "one"}, None)
+
+        # Non-finite floats are kept, not written as null
+        storage.create_file("tmp/floats.json", {"x": [float("inf"), None]})
+        assert storage.read_file("tmp/floats.json") == ({"x": [float("inf"), None]}, None)
+
+        from acrud.storage import convert
+
+        assert set(convert.FILE_TYPES) <= set(convert.CODECS)
+        assert convert.decode("a.TXT", convert.encode("a.TXT", "héllo")) == "héllo"
+        assert convert.decode_meta_data(convert.encode_meta_data({"a": 1})) == {"a": 1}
+
+    def test_compression(self, root_dir, setup_teardown):
+        """Test compressed files round trip and are detected on read."""
+        from acrud import StorageConfig
+        from acrud.storage.local import LocalStorage
+
+        compressed_storage = LocalStorage(
+            StorageConfig(
+                {"root": root_dir, "COMPRESSION": "gzip", "COMPRESSION_EXTENSIONS": "json,csv"}
+            )
+        )
+        test_data = {"values": list(range(1000))}
+        compressed_storage.create_file("tmp/compressed.json", test_data)
+        compressed_storage.create_file("tmp/plain.txt", "Hello, World!")
+
+        with open(os.path.join(root_dir, "tmp/compressed.json"), "rb") as f:
+            assert f.read(2) == b"\x1f\x8b"
+        with open(os.path.join(root_dir, "tmp/plain.txt"), "rb") as f:
+            assert f.read() == b"Hello, World!"
+
+        rows = "".join(f"{i},{i * 2}\n" for i in range(1000))
+        with compressed_storage.open_write("tmp/compressed.CSV") as f:
+            f.write(b"id,value\n")
+            f.write(rows.encode("utf-8"))
+        assert compressed_storage.read_csv_header("tmp/compressed.CSV") == ["id", "value"]
+        with compressed_storage.open_read("tmp/compressed.CSV") as f:
+            assert f.read() == f"id,value\n{rows}".encode("utf-8")
+        with open(os.path.join(root_dir, "tmp/compressed.CSV"), "rb") as f:
+            assert f.read(2) == b"\x1f\x8b"
+
+        # Files the settings do not apply to are never decompressed
+        archive = gzip.compress(b"archived")
+        with compressed_storage.open_write("tmp/archive.gz") as f:
+            f.write(archive)
+        with compressed_storage.open_read("tmp/archive.gz") as f:
+            assert f.read() == archive
+        with storage.open_read("tmp/compressed.json") as f:
+            assert f.read(2) == b"\x1f\x8b"
+
+        # Reads detect the format whatever method the reader is configured with
+        pytest.importorskip("zstandard")
+        zstd_storage = LocalStorage(StorageConfig({"root": root_dir, "COMPRESSION": "zstd"}))
+        assert zstd_storage.read_file("tmp/compressed.json") == (test_data, None)
+
+    def test_tables(self, root_dir, setup_teardown):
+        """Test Parquet and Arrow files with column projection and row filters."""
+        pa = pytest.importorskip("pyarrow")
+        from acrud.storage.tabular import csv_to_parquet
+
+        table = pa.table({"id": list(range(100)), "year": [2000 + i % 10 for i in range(100)]})
+        storage.create_file("tmp/table.parquet", table)
+        storage.create_file("tmp/table.arrow", table)
+        storage.create_file("tmp/upper.PARQUET", table)
+
+        assert storage.read_file("tmp/table.parquet")[0].equals(table)
+        assert storage.read_file("tmp/table.arrow")[0].equals(table)
+        for file_path in ("tmp/table.parquet", "tmp/table.arrow", "tmp/upper.PARQUET"):
+            result = storage.read_table(file_path, columns=["id"], filter={"year": 2003})
+            assert result.column_names == ["id"]
+            assert result["id"].to_pylist() == list(range(3, 100, 10))
+
+        storage.create_file("tmp/table.csv", "id,name\n1,a\n2,b\n", {"author": "Test"})
+        parquet_path = csv_to_parquet(storage, "tmp/table.csv")
+        assert parquet_path == "tmp/table.parquet"
+        assert storage.read_table(parquet_path).to_pydict() == {"id": [1, 2], "name": ["a", "b"]}
+        assert storage.read_file(parquet_path)[1] == {"author": "Test"}
+
+    def test_pdf(self, root_dir, setup_teardown):
+        """Test unchanged PDFs are saved as read and pages are read on their own."""
+        from io import BytesIO
+        from PyPDF2 import PdfWriter
+
+        writer = PdfWriter()
+        for i in range(5):
+            writer.add_blank_page(100 + i, 100)
+        writer.add_metadata({"/Title": "Test"})
+        buffer = BytesIO()
+        writer.write(buffer)
+        # Trailing bytes a rewrite would drop
+        original = buffer.getvalue() + b"%original"
+        os.makedirs(os.path.join(root_dir, "tmp"), exist_ok=True)
+        with open(os.path.join(root_dir, "tmp/original.pdf"), "wb") as f:
+            f.write(original)
+
+        reader, _ = storage.read_file("tmp/original.pdf")
+        storage.create_file("tmp/copy.pdf", reader)
+        with open(os.path.join(root_dir, "tmp/copy.pdf"), "rb") as f:
+            assert f.read() == original
+
+        info = storage.read_pdf_info("tmp/original.pdf")
+        assert info == {"pages": 5, "metadata": {"/Producer": "PyPDF2", "/Title": "Test"}}
+        with storage.read_pdf_pages("tmp/original.pdf", [1, -1]) as pages:
+            assert [page.mediabox.width for page in pages] == [101, 104]
+        assert pages.source.closed
+
+        # PDFs are stored as they are, so their pages can still be read in ranges
+        from acrud import StorageConfig
+        from acrud.storage.local import LocalStorage
+
+        compressed_storage = LocalStorage(StorageConfig({"root": root_dir, "COMPRESSION": "gzip"}))
+        compressed_storage.create_file("tmp/compressed.pdf", reader)
+        assert compressed_storage.read_pdf_info("tmp/compressed.pdf")["pages"] == 5
+
+    def test_copy_and_move(self, root_dir, setup_teardown):
+        """Test files and directories are copied and moved with their metadata."""
+        storage.create_file("tmp/src/a.pkl", lambda x: x + 1, {"a": 1})
+        storage.create_file("tmp/src/sub/b.txt", "b")
+        storage.create_file("tmp/dst/b.txt", "old", {"old": 1})
+
+        storage.copy_file("tmp/src/a.pkl", "tmp/copy.pkl")
+        with open(os.path.join(root_dir, "tmp/src/a.pkl"), "rb") as f:
+            with open(os.path.join(root_dir, "tmp/copy.pkl"), "rb") as g:
+                assert f.read() == g.read()
+        assert storage.read_meta_data("tmp/copy.pkl") == {"a": 1}
+
+        storage.move_file("tmp/src/sub/b.txt", "tmp/dst/b.txt")
+        assert storage.read_file("tmp/dst/b.txt") == ("b", None)
+        assert not os.path.exists(os.path.join(root_dir, "tmp/src/sub/b.txt"))
+
+        # Renamed in one step, then merged into a directory that exists
+        storage.move_directory("tmp/src", "tmp/moved")
+        assert storage.read_file("tmp/moved/a.pkl")[0](1) == 2
+        storage.move_directory("tmp/moved", "tmp/dst")
+        assert storage.read_meta_data("tmp/dst/a.pkl") == {"a": 1}
+        assert storage.read_file("tmp/dst/b.txt") == ("b", None)
+        assert not os.path.exists(os.path.join(root_dir, "tmp/moved"))
+
+        with pytest.raises(ValueError):
+            storage.move_directory("tmp/dst", "tmp/dst/inner")
+
+    def test_exists_and_stat(self, root_dir, setup_teardown):
+        """Test existence checks and stat, and that a miss raises straight away."""
+        from acrud.exception import NotFoundError
+
+        storage.create_file("tmp/stat.json", {"a": 1}, {"m": 1})
+        assert storage.exists("tmp/stat.json")
+        assert not storage.exists("tmp/missing.json")
+        assert not storage.exists("tmp")
+
+        stat = storage.stat("tmp/stat.json")
+        assert stat.size == os.path.getsize(os.path.join(root_dir, "tmp/stat.json"))
+        assert stat.content_type == "application/json"
+        assert stat.has_metadata
+        assert stat.version == storage.read_file_with_version("tmp/stat.json")[2]
+
+        with patch.object(storage, "list_subdirectories_in_directory") as listing:
+            with pytest.raises(NotFoundError):
+                storage.read_file("tmp/no/such/dir/file.json")
+            with pytest.raises(LookupError):
+                storage.stat("tmp/missing.json")
+            listing.assert_not_called()
+
+        with pytest.raises(NotFoundError) as error:
+            storage.delete_file("tmp/missing.json")
+        assert error.value.filename == "tmp/missing.json"
+
+    def test_lazy_import(self, root_dir, tmp_path):
+        """Test importing the package creates no storage and loads no backend."""
+        import subprocess
+        import sys
+
+        import acrud
+
+        code = (
+            "import sys, acrud; "
+            "assert not {'boto3', 'PyPDF2', 'dill'} & set(sys.modules), sys.modules"
+        )
+        # No storage.config is reachable from tmp_path, which importing must not need
+        subprocess.run(
+            [sys.executable, "-c", code],
+            cwd=tmp_path,
+            env={**os.environ, "PYTHONPATH": os.path.dirname(acrud.__path__[0])},
+            check=True,
+        )
+
+        # Importing submodules binds the subpackage, not a storage, to `acrud.storage`
+        code = (
+            "import acrud, acrud.storage.base; "
+            "assert acrud.storage.base.StorageBase is acrud.StorageBase"
+        )
+        subprocess.run(
+            [sys.executable, "-c", code],
+            cwd=tmp_path,
+            env={**os.environ, "PYTHONPATH": os.path.dirname(acrud.__path__[0])},
+            check=True,
+        )
+
+        assert acrud.default_storage() is storage
+        connected = acrud.connect({"storage_type": "local", "root": root_dir})
+        assert connected.ping() == {"response": "pong"}
+        assert connected is not storage
+
+
+class TestCachedStorage:
+    @pytest.fixture
+    def cached_storage(self):
+        from acrud.storage import CachedStorage
+
+        yield CachedStorage(storage, max_bytes=10_000)
+        tmp_path = os.path.join(os.getcwd(), "tmp")
+        if os.path.exists(tmp_path):
+            shutil.rmtree(tmp_path)
+
+    def test_hits_and_invalidation(self, cached_storage):
+        """Test repeated reads are served from the cache until the file is updated."""
+        file_path = "tmp/cached.json"
+        cached_storage.create_file(file_path, {"v": 1}, {"author": "Test"})
+
+        assert cached_storage.read_file(file_path) == ({"v": 1}, {"author": "Test"})
+        assert cached_storage.read_file(file_path) == ({"v": 1}, {"author": "Test"})
+        info = cached_storage.cache_info()
+        assert (info.hits, info.misses) == (1, 1)
+
+        cached_storage.update_file(file_path, {"v": 2})
+        assert cached_storage.read_file(file_path)[0] == {"v": 2}
+
+        cached_storage.delete_file(file_path)
+        assert cached_storage.cache_info().currsize == 0
+        with pytest.raises(LookupError):
+            cached_storage.read_file(file_path)
+
+    def test_revalidation_reads_new_metadata(self):
+        """Test an expired entry picks up metadata changed without the data."""
+        from acrud.storage import CachedStorage
+
+        cached_storage = CachedStorage(storage, ttl=0)
+        file_path = "tmp/revalidated.txt"
+        cached_storage.create_file(file_path, "data", {"author": "bob"})
+        assert cached_storage.read_file(file_path) == ("data", {"author": "bob"})
+
+        # Only the metadata file changes, so the data's version token does not
+        storage._write_meta_data(os.path.join(os.getcwd(), file_path), {"author": "carol"})
+        assert cached_storage.read_file(file_path) == ("data", {"author": "carol"})
+        shutil.rmtree(os.path.join(os.getcwd(), "tmp"))
+
+    def test_lru_eviction(self, cached_storage):
+        """Test the least recently used entries are evicted to stay within budget."""
+        paths = [f"tmp/lru/{i}.txt" for i in range(5)]
+        for path in paths:
+            cached_storage.create_file(path, "x" * 3000)
+            cached_storage.read_file(path)
+
+        info = cached_storage.cache_info()
+        assert info.currsize <= info.maxsize
+        cached_storage.read_file(paths[-1])
+        assert cached_storage.cache_info().hits == 1
+        cached_storage.read_file(paths[0])
+        assert cached_storage.cache_info().misses == len(paths) + 1
+
+    def test_read_file_with_version(self, cached_storage):
+        """Test the backend's version token is cached and returned with the entry."""
+        from acrud.storage.base import NOT_MODIFIED
+
+        file_path = "tmp/versioned.txt"
+        cached_storage.create_file(file_path, "v1", {"author": "Test"})
+        data, meta_data, version = cached_storage.read_file_with_version(file_path)
+        assert (data, meta_data) == ("v1", {"author": "Test"})
+        assert version == storage.stat(file_path).version
+
+        assert cached_storage.read_file_with_version(file_path) == (data, meta_data, version)
+        assert cached_storage.read_file_with_version(file_path, version) is NOT_MODIFIED
+        assert cached_storage.cache_info().hits == 2
+        assert cached_storage.read_file(file_path) == ("v1", {"author": "Test"})
+
+    def test_entry_size(self, cached_storage):
+        """Test objects that hide their buffers are charged their stored size."""
+        from types import SimpleNamespace
+
+        cached_storage.create_file("tmp/dict.json", {"payload": "x" * 5000})
+        cached_storage.read_file("tmp/dict.json")
+        assert cached_storage.cache_info().currsize > 5000
+
+        cached_storage.cache_clear()
+        cached_storage.create_file("tmp/object.pkl", SimpleNamespace(payload=b"x" * 5000))
+        assert cached_storage.read_file("tmp/object.pkl")[0].payload == b"x" * 5000
+        assert (
+            cached_storage.cache_info().currsize
+            >= storage.stat("tmp/object.pkl").size
+            > 5000
+        )
+
+
+class TestCoalescingStorage:
+    @pytest.fixture
+    def slow_storage(self):
+        """A local storage whose reads take long enough to overlap."""
+        import threading
+        import time
+        from acrud import StorageConfig
+        from acrud.storage import LocalStorage
+
+        class SlowStorage(LocalStorage):
+            calls = 0
+            lock = threading.Lock()
+
+            def read_file(self, file_path, *args, **kwargs):
+                with self.lock:
+                    SlowStorage.calls += 1
+                time.sleep(0.2)
+                return super().read_file(file_path, *args, **kwargs)
+
+        yield SlowStorage(StorageConfig({"STORAGE_TYPE": "local", "root": os.getcwd()}))
+        tmp_path = os.path.join(os.getcwd(), "tmp")
+        if os.path.exists(tmp_path):
+            shutil.rmtree(tmp_path)
+
+    def test_concurrent_reads_share_one_call(self, slow_storage):
+        """Test concurrent reads of a file make one call and share its result or error."""
+        from concurrent.futures import ThreadPoolExecutor
+        from acrud.storage import CoalescingStorage
+
+        coalescing = CoalescingStorage(slow_storage)
+        coalescing.create_file("tmp/hot.json", {"v": 1})
+
+        def read_missing(path):
+            try:
+                coalescing.read_file(path)
+            except LookupError as e:
+                return e
+
+        with ThreadPoolExecutor(max_workers=10) as executor:
+            results = list(executor.map(coalescing.read_file, ["tmp/hot.json"] * 10))
+            errors = list(executor.map(read_missing, ["tmp/missing.json"] * 5))
+
+        assert results == [({"v": 1}, None)] * 10
+        assert all(isinstance(e, LookupError) for e in errors)
+        assert type(slow_storage).calls == 2
+        info = coalescing.coalesce_info()
+        assert (info.calls, info.coalesced, info.in_flight) == (2, 13, 0)
+
+    def test_async_reads_share_one_call(self, slow_storage):
+        """Test the asyncio flavour shares a call and survives a cancelled caller."""
+        from acrud import StorageConfig
+        from acrud.storage import AsyncCoalescingStorage, AsyncLocalStorage
+
+        backend = AsyncLocalStorage(StorageConfig({"root": slow_storage.root_dir}))
+        backend._storage = slow_storage
+        coalescing = AsyncCoalescingStorage(backend)
+        slow_storage.create_file("tmp/hot.txt", "hot")
+
+        async def run():
+            cancelled = asyncio.ensure_future(coalescing.read_file("tmp/hot.txt"))
+            others = [coalescing.read_file("tmp/hot.txt") for _ in range(5)]
+            await asyncio.sleep(0)
+            cancelled.cancel()
+            return await asyncio.gather(*others)
+
+        assert asyncio.run(run()) == [("hot", None)] * 5
+        assert type(slow_storage).calls == 1
+        assert coalescing.coalesce_info().coalesced == 5
+
+
+class TestBufferedStorage:
+    @pytest.fixture
+    def buffered_storage(self):
+        from acrud.storage import BufferedStorage
+
+        # A long linger, so the writes below are queued together
+        yield BufferedStorage(storage, linger=0.5)
+        tmp_path = os.path.join(os.getcwd(), "tmp")
+        if os.path.exists(tmp_path):
+            shutil.rmtree(tmp_path)
+
+    def test_writes_are_queued_and_coalesced(self, buffered_storage):
+        """Test queued writes are coalesced, read back and flushed with their errors."""
+        with buffered_storage:
+            for i in range(10):
+                buffered_storage.create_file("tmp/buffered/hot.json", {"i": i}, {"m": 1})
+            buffered_storage.create_file("tmp/buffered/hot.json", {"i": 10})
+            assert buffered_storage.read_file("tmp/buffered/hot.json") == (
+                {"i": 10},
+                {"m": 1},
+            )
+
+            buffered_storage.delete_file("tmp/buffered/missing.json")
+            with pytest.raises(LookupError):
+                buffered_storage.flush()
+
+            buffered_storage.create_file("tmp/buffered/last.txt", "last")
+
+        assert storage.read_file("tmp/buffered/last.txt") == ("last", None)
+        info = buffered_storage.buffer_info()
+        assert (info.pending, info.written, info.coalesced, info.failed) == (0, 2, 10, 1)
+        with pytest.raises(ValueError):
+            buffered_storage.create_file("tmp/buffered/late.txt", "late")
+
+    def test_create_then_delete_of_a_new_file(self, buffered_storage):
+        """Test a new file created and deleted before it is written is not an error."""
+        with buffered_storage:
+            buffered_storage.create_file("tmp/buffered/gone.txt", "a")
+            buffered_storage.delete_file("tmp/buffered/gone.txt")
+            buffered_storage.create_file("tmp/buffered/back.txt", "a", {"m": 1})
+            buffered_storage.delete_file("tmp/buffered/back.txt")
+            buffered_storage.create_file("tmp/buffered/back.txt", "b")
+            buffered_storage.flush()
+
+        assert not storage.exists("tmp/buffered/gone.txt")
+        assert storage.read_file("tmp/buffered/back.txt") == ("b", None)
+        assert buffered_storage.buffer_info().failed == 0
+
+    def test_unclosed_buffer_is_collected(self):
+        """Test a buffer dropped without being closed is not kept alive."""
+        import gc
+        import weakref
+        from acrud.storage import BufferedStorage
+
+        buffered_storage = BufferedStorage(storage)
+        buffered_storage.create_file("tmp/buffered/dropped.txt", "a")
+        buffered_storage.flush()
+        reference = weakref.ref(buffered_storage)
+        del buffered_storage
+        gc.collect()
+        assert reference() is None
+
+    @pytest.mark.filterwarnings("ignore::pytest.PytestUnhandledThreadExceptionWarning")
+    def test_dead_worker_fails_fast(self, buffered_storage):
+        """Test waiting for queued writes raises once the background thread died."""
+
+        class Stop(BaseException):
+            pass
+
+        def stop(batch):
+            raise Stop()
+
+        with patch.object(buffered_storage, "_write", stop):
+            buffered_storage.create_file("tmp/buffered/lost.txt", "a")
+            with pytest.raises(RuntimeError):
+                buffered_storage.flush()
+            with pytest.raises(RuntimeError):
+                buffered_storage.read_file("tmp/buffered/lost.txt")
+            with pytest.raises(RuntimeError):
+                buffered_storage.close()
+
+
+class TestPackedStorage:
+    @pytest.fixture
+    def packed_storage(self):
+        from acrud.storage import PackedStorage
+
+        yield PackedStorage(storage, max_file_size=1024, compact_interval=0)
+        tmp_path = os.path.join(os.getcwd(), "tmp")
+        if os.path.exists(tmp_path):
+            shutil.rmtree(tmp_path)
+
+    def test_small_files_are_packed(self, packed_storage):
+        """Test small files share a pack, are listed and read back, and are compacted."""
+        results = packed_storage.create_files(
+            [(f"tmp/packed/{i}.json", {"i": i}, {"m": i}) for i in range(10)]
+            + [("tmp/packed/large.txt", "x" * 2048, None)]
+        )
+        assert results == [None] * 11
+        packs = os.listdir(os.path.join(os.getcwd(), "tmp/packed/.acrud_packs"))
+        assert len(packs) == 1
+        names = os.listdir(os.path.join(os.getcwd(), "tmp/packed"))
+        assert [name for name in names if not name.startswith(".")] == ["large.txt"]
+
+        assert packed_storage.read_file("tmp/packed/3.json") == ({"i": 3}, {"m": 3})
+        _, _, version = packed_storage.read_file_with_version("tmp/packed/3.json")
+        assert not packed_storage.read_file_with_version(
+            "tmp/packed/3.json", if_none_match=version
+        )
+        assert packed_storage.stat("tmp/packed/3.json").has_metadata
+        assert len(packed_storage.list_files_in_directory("tmp/packed")) == 11
+
+        assert packed_storage.delete_files(
+            [f"tmp/packed/{i}.json" for i in range(8)]
+        ) == [None] * 8
+        assert not packed_storage.exists("tmp/packed/0.json")
+        packed_storage.compact("tmp/packed")
+        new_packs = os.listdir(os.path.join(os.getcwd(), "tmp/packed/.acrud_packs"))
+        assert len(new_packs) == 1 and new_packs != packs
+        assert packed_storage.read_file("tmp/packed/9.json") == ({"i": 9}, {"m": 9})
+
+    def test_packing_removes_loose_copies(self, packed_storage):
+        """Test only files stored on their own before are deleted when packed."""
+        storage.create_file("tmp/loose/a.txt", "loose", {"m": 1})
+        deleted = []
+        delete_files = storage.delete_files
+
+        def recording_delete_files(file_paths):
+            deleted.append(list(file_paths))
+            return delete_files(file_paths)
+
+        with patch.object(storage, "delete_files", recording_delete_files):
+            packed_storage.create_files(
+                [("tmp/loose/a.txt", "packed", None), ("tmp/loose/b.txt", "b", None)]
+            )
+            assert deleted == [["tmp/loose/a.txt"]]
+            names = os.listdir(os.path.join(os.getcwd(), "tmp/loose"))
+            assert [name for name in names if not name.startswith(".")] == []
+            assert packed_storage.read_file("tmp/loose/a.txt") == ("packed", None)
+
+            # Files already packed have no copy of their own
+            packed_storage.create_files([("tmp/loose/a.txt", "again", None)])
+            assert deleted == [["tmp/loose/a.txt"]]
+
+
+class TestDiskCatalog:
+    def test_lru_eviction_and_write_back(self, tmp_path):
+        """Test that the tier catalog evicts by last read and keeps pending uploads."""
+        from acrud.storage.tiered.catalog import DiskCatalog
+
+        catalog = DiskCatalog(str(tmp_path / "catalog.db"))
+        for name in ("a", "b", "c"):
+            catalog.record(name, f'"{name}"', 10)
+        version = catalog.record("d", None, 10, dirty=True)
+        catalog.touch("a")
+
+        assert sorted(catalog.evict(25)) == ["b", "c"]
+        assert catalog.get("a").etag == '"a"'
+        assert catalog.dirty() == [("d", version)]
+
+        # An entry written again during its upload stays pending
+        catalog.record("d", None, 10, dirty=True)
+        assert not catalog.mark_clean("d", version, '"d"')
+        assert catalog.mark_clean("d", version + 1, '"d"')
+        assert catalog.dirty() == []
+        catalog.close()
+
+
+class TestAsyncLocalStorage:
+    @pytest.fixture
+    def async_storage(self):
+        from acrud import StorageConfig
+        from acrud.storage.local import AsyncLocalStorage
+
+        config = StorageConfig({"STORAGE_TYPE": "local", "root": os.getcwd()})
+        yield AsyncLocalStorage(config)
+        tmp_path = os.path.join(os.getcwd(), "tmp")
+        if os.path.exists(tmp_path):
+            shutil.rmtree(tmp_path)
+
+    def test_create_and_read_file(self, async_storage):
+        """Test a create/read round trip through the async API."""
+
+        async def run():
+            await async_storage.create_file("tmp/async.txt", "Hello", {"a": 1})
+            return await async_storage.read_file("tmp/async.txt")
+
+        assert asyncio.run(run()) == ("Hello", {"a": 1})
+
+    def test_batch_operations(self, async_storage):
+        """Test that batch results come back in input order."""
+        paths = [f"tmp/batch/{i}.txt" for i in range(20)]
+
+        async def run():
+            await async_storage.create_files((p, p, None) for p in paths)
+            results = await async_storage.read_files(paths)
+            await async_storage.delete_files(paths)
+            return results
+
+        results = asyncio.run(run())
+        assert [data for data, _ in results] == paths
+        assert not any(os.path.exists(p) for p in paths)
+
+    def test_factory_rejects_sync_wrappers(self):
+        """Test wrappers without an async flavour cannot be combined with ASYNC."""
+        from acrud import StorageConfig, StorageFactory
+        from acrud.storage.coalesce import AsyncCoalescingStorage
+
+        config = {"STORAGE_TYPE": "local", "root": os.getcwd(), "ASYNC": "true"}
+        for name in ("PACK", "BUFFERED_WRITES", "CACHE"):
+            with pytest.raises(ValueError, match=name):
+                StorageFactory.create_storage(StorageConfig({**config, name: "true"}))
+
+        coalescing = StorageFactory.create_storage(
+            StorageConfig({**config, "COALESCE": "true"})
+        )
+        assert isinstance(coalescing, AsyncCoalescingStorage)
@@ -0,0 +1,436 @@
+import asyncio
+import os
+
+import pytest
+
+pytest.importorskip("moto")
+
+import boto3
+from botocore.exceptions import ClientError
+from moto import mock_aws
+
+from acrud import StorageConfig, StorageFactory
+
+BUCKET = "acrud-test"
+
+
+@pytest.fixture(autouse=True)
+def s3(monkeypatch):
+    """Run every test against an empty mocked bucket."""
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    with mock_aws():
+        boto3.client("s3").create_bucket(Bucket=BUCKET)
+        yield
+
+
+def create_storage(storage_type: str = "s3", **options):
+    return StorageFactory.create_storage(
+        StorageConfig({"STORAGE_TYPE": storage_type, "bucket": BUCKET, **options})
+    )
+
+
+class TestTieredStorage:
+    @pytest.fixture
+    def origin(self):
+        return create_storage()
+
+    @pytest.fixture
+    def tiered_storage(self, tmp_path):
+        tiered_storage = create_storage("tiered", TIER_CACHE_DIR=str(tmp_path))
+        yield tiered_storage
+        tiered_storage.close()
+
+    @pytest.fixture
+    def write_back_storage(self, tmp_path):
+        tiered_storage = create_storage(
+            "tiered",
+            TIER_CACHE_DIR=str(tmp_path),
+            TIER_WRITE_MODE="back",
+            TIER_FLUSH_INTERVAL="0",
+        )
+        yield tiered_storage
+        tiered_storage.close()
+
+    def test_read_through(self, origin, tiered_storage, tmp_path):
+        """Test a file read from S3 is kept in the cache directory."""
+        origin.create_file("dir/a.txt", "hello", {"author": "bob"})
+
+        assert tiered_storage.read_file("dir/a.txt") == ("hello", {"author": "bob"})
+        assert (tmp_path / "dir" / "a.txt").read_bytes() == b"hello"
+        entry = tiered_storage.catalog.get("dir/a.txt")
+        assert entry.etag == origin.stat("dir/a.txt").version
+        assert not entry.dirty
+        assert tiered_storage.read_range("dir/a.txt", 0, 1) == b"h"
+
+    def test_etag_revalidation(self, origin, tiered_storage):
+        """Test a cached copy is kept while its ETag matches and fetched once it does not."""
+        origin.create_file("a.txt", "one", {"author": "bob"})
+        assert tiered_storage.read_file("a.txt") == ("one", {"author": "bob"})
+
+        reads = []
+        read_raw = tiered_storage.origin.read_raw
+        tiered_storage.origin.read_raw = lambda *args: reads.append(args) or read_raw(*args)
+
+        # Unchanged, so the conditional GET answers 304, but new metadata is still read
+        origin.create_file("a.txt", "one", {"author": "carol"})
+        assert tiered_storage.read_file("a.txt") == ("one", {"author": "carol"})
+        assert reads[-1] == ("a.txt", tiered_storage.catalog.get("a.txt").etag)
+
+        origin.create_file("a.txt", "two")
+        assert tiered_storage.read_file("a.txt") == ("two", {"author": "carol"})
+        assert tiered_storage.catalog.get("a.txt").etag == origin.stat("a.txt").version
+        assert len(reads) == 2
+
+    def test_write_back_and_flush(self, origin, write_back_storage):
+        """Test written-back files are listed before they are uploaded by `flush`."""
+        write_back_storage.create_file("dir/new.json", {"v": 1}, {"author": "bob"})
+        write_back_storage.create_file("dir/sub/deep.txt", "deep")
+
+        assert not origin.exists("dir/new.json")
+        assert write_back_storage.exists("dir/new.json")
+        assert write_back_storage.read_file("dir/new.json") == ({"v": 1}, {"author": "bob"})
+        assert write_back_storage.list_files_in_directory("dir") == ["new"]
+        assert write_back_storage.list_subdirectories_in_directory("dir") == ["sub"]
+        assert write_back_storage.list_meta_data("dir") == {
+            "dir/new.json": {"author": "bob"}
+        }
+        assert sorted(
+            (entry.path, entry.is_dir) for entry in write_back_storage.walk("dir")
+        ) == [
+            ("dir/new.json", False),
+            ("dir/sub", True),
+            ("dir/sub/deep.txt", False),
+        ]
+
+        write_back_storage.flush()
+        assert write_back_storage.catalog.dirty() == []
+        assert origin.read_file("dir/new.json") == ({"v": 1}, {"author": "bob"})
+        assert origin.read_file("dir/sub/deep.txt") == ("deep", None)
+        assert sorted(entry.path for entry in write_back_storage.walk("dir")) == [
+            "dir/new.json",
+            "dir/sub",
+            "dir/sub/deep.txt",
+        ]
+
+    def test_eviction(self, origin, tmp_path):
+        """Test the least recently read files are evicted, but never pending uploads."""
+        tiered_storage = create_storage(
+            "tiered",
+            TIER_CACHE_DIR=str(tmp_path),
+            TIER_MAX_BYTES="20",
+            TIER_WRITE_MODE="back",
+            TIER_FLUSH_INTERVAL="0",
+        )
+        for name in ("a", "b", "c"):
+            origin.create_file(f"{name}.txt", name * 8)
+            tiered_storage.read_file(f"{name}.txt")
+
+        assert tiered_storage.catalog.get("a.txt") is None
+        assert not (tmp_path / "a.txt").exists()
+        assert (tmp_path / "c.txt").exists()
+
+        # Evicted files are fetched again, and pending uploads push out the rest
+        assert tiered_storage.read_file("a.txt") == ("a" * 8, None)
+        tiered_storage.create_file("d.txt", "d" * 30)
+        assert tiered_storage.catalog.total_size() == 30
+        assert tiered_storage.read_file("d.txt") == ("d" * 30, None)
+
+        tiered_storage.close()
+        assert origin.read_file("d.txt") == ("d" * 30, None)
+
+
+class TestTransfer:
+    @pytest.fixture
+    def client(self):
+        """A client of its own, so tests can break its methods."""
+        return boto3.client("s3")
+
+    @staticmethod
+    def fail_part(client, monkeypatch, method: str, part_number: int = 2) -> None:
+        """Make one part of every multipart upload or copy fail."""
+        call = getattr(client, method)
+
+        def _call(**kwargs):
+            if kwargs["PartNumber"] == part_number:
+                raise ClientError(
+                    {"Error": {"Code": "AccessDenied", "Message": "Denied"}}, method
+                )
+            return call(**kwargs)
+
+        monkeypatch.setattr(client, method, _call)
+
+    def test_upload_and_download(self, client):
+        """Test a buffer above the threshold is sent in parts and read back in ranges."""
+        from acrud.storage.s3 import transfer
+
+        data = os.urandom(2 * transfer.MIN_PART_SIZE + 1000)
+        # Parts smaller than S3 allows are raised to the minimum
+        etag = transfer.upload(client, BUCKET, "big.bin", data, part_size=1024)
+        assert etag.endswith('-3"')
+
+        body, downloaded_etag = transfer.download(
+            client, BUCKET, "big.bin", part_size=1024 * 1024
+        )
+        assert bytes(body) == data
+        assert downloaded_etag == etag
+
+        with pytest.raises(ClientError) as error:
+            transfer.download(client, BUCKET, "big.bin", IfNoneMatch=etag)
+        assert error.value.response["ResponseMetadata"]["HTTPStatusCode"] == 304
+
+        client.put_object(Body=b"", Bucket=BUCKET, Key="empty.bin")
+        assert transfer.download(client, BUCKET, "empty.bin")[0] == b""
+
+    def test_upload_stays_within_part_limit(self, client, monkeypatch):
+        """Test parts grow so a large buffer needs at most `MAX_PART_COUNT` parts."""
+        from acrud.storage.s3 import transfer
+
+        monkeypatch.setattr(transfer, "MAX_PART_COUNT", 2)
+        data = os.urandom(2 * transfer.MIN_PART_SIZE + 1000)
+        etag = transfer.upload(client, BUCKET, "big.bin", data)
+        assert etag.endswith('-2"')
+        assert client.get_object(Bucket=BUCKET, Key="big.bin")["Body"].read() == data
+
+    def test_upload_aborts_on_error(self, client, monkeypatch):
+        """Test a failed part aborts the whole multipart upload."""
+        from acrud.storage.s3 import transfer
+
+        self.fail_part(client, monkeypatch, "upload_part")
+        with pytest.raises(ClientError):
+            transfer.upload(
+                client, BUCKET, "big.bin", os.urandom(2 * transfer.MIN_PART_SIZE + 1)
+            )
+        assert "Uploads" not in client.list_multipart_uploads(Bucket=BUCKET)
+        assert "Contents" not in client.list_objects_v2(Bucket=BUCKET)
+
+    def test_copy(self, client, monkeypatch):
+        """Test objects are copied whole below the threshold and in parts above it."""
+        from acrud.storage.s3 import transfer
+
+        data = os.urandom(2 * transfer.MIN_PART_SIZE + 1000)
+        client.put_object(
+            Body=data,
+            Bucket=BUCKET,
+            Key="big.bin",
+            ContentType="application/x-test",
+            Metadata={"author": "bob"},
+        )
+
+        transfer.copy(client, BUCKET, "big.bin", "whole.bin", size=len(data) + 1)
+        transfer.copy(
+            client, BUCKET, "big.bin", "parts.bin", multipart_threshold=1, part_size=1024
+        )
+
+        head = client.head_object(Bucket=BUCKET, Key="parts.bin")
+        assert head["ETag"].endswith('-3"')
+        assert head["ContentType"] == "application/x-test"
+        assert head["Metadata"] == {"author": "bob"}
+        for key in ("whole.bin", "parts.bin"):
+            assert client.get_object(Bucket=BUCKET, Key=key)["Body"].read() == data
+
+        self.fail_part(client, monkeypatch, "upload_part_copy")
+        with pytest.raises(ClientError):
+            transfer.copy(client, BUCKET, "big.bin", "failed.bin", multipart_threshold=1)
+        assert "Uploads" not in client.list_multipart_uploads(Bucket=BUCKET)
+        assert not any(
+            obj["Key"] == "failed.bin"
+            for obj in client.list_objects_v2(Bucket=BUCKET)["Contents"]
+        )
+
+    def test_multipart_writer(self, client):
+        """Test a stream is uploaded in parts, or with one `PutObject` when small."""
+        from acrud.storage.s3.stream import S3MultipartWriter
+        from acrud.storage.s3.transfer import MIN_PART_SIZE
+
+        data = os.urandom(2 * MIN_PART_SIZE + 1000)
+        writer = S3MultipartWriter(client, BUCKET, "big.bin", part_size=1024)
+        assert writer.part_size == MIN_PART_SIZE
+        for start in range(0, len(data), 1024 * 1024):
+            writer.write(data[start : start + 1024 * 1024])
+        writer.close()
+
+        obj = client.get_object(Bucket=BUCKET, Key="big.bin")
+        assert obj["ETag"].endswith('-3"')
+        assert obj["Body"].read() == data
+
+        writer = S3MultipartWriter(client, BUCKET, "small.bin")
+        writer.write(b"small")
+        writer.close()
+        obj = client.get_object(Bucket=BUCKET, Key="small.bin")
+        assert "-" not in obj["ETag"]
+        assert obj["Body"].read() == b"small"
+
+    def test_multipart_writer_aborts_on_error(self, client, monkeypatch):
+        """Test a failed part, or an aborted stream, aborts the multipart upload."""
+        from acrud.storage.s3.stream import S3MultipartWriter
+        from acrud.storage.s3.transfer import MIN_PART_SIZE
+
+        writer = S3MultipartWriter(client, BUCKET, "aborted.bin", part_size=1024)
+        writer.write(os.urandom(MIN_PART_SIZE))
+        assert len(client.list_multipart_uploads(Bucket=BUCKET)["Uploads"]) == 1
+        writer.abort()
+        writer.close()
+        assert "Uploads" not in client.list_multipart_uploads(Bucket=BUCKET)
+
+        self.fail_part(client, monkeypatch, "upload_part")
+        writer = S3MultipartWriter(client, BUCKET, "failed.bin", part_size=1024)
+        writer.write(os.urandom(2 * MIN_PART_SIZE + 1))
+        with pytest.raises(ClientError):
+            writer.close()
+        assert "Uploads" not in client.list_multipart_uploads(Bucket=BUCKET)
+        assert "Contents" not in client.list_objects_v2(Bucket=BUCKET)
+
+
+class TestS3Listing:
+    @pytest.fixture
+    def paged_storage(self, monkeypatch):
+        """A storage whose listings return two keys per page."""
+        s3_storage = create_storage(SHARE_CLIENT="false")
+        get_paginator = s3_storage.client.get_paginator
+        pages = []
+
+        class Paginator:
+            def __init__(self, name):
+                self.paginator = get_paginator(name)
+
+            def paginate(self, **kwargs):
+                for page in self.paginator.paginate(
+                    PaginationConfig={"PageSize": 2}, **kwargs
+                ):
+                    pages.append(page)
+                    yield page
+
+        monkeypatch.setattr(s3_storage.client, "get_paginator", Paginator)
+        s3_storage.pages = pages
+
+        s3_storage.create_file("dir/a.txt", "a", {"name": "a"})
+        s3_storage.create_file("dir/b.csv", "b")
+        s3_storage.create_file("dir/c.txt", "c", {"name": "c"})
+        s3_storage.create_file("dir/d.txt", "d")
+        s3_storage.create_file("dir/.hidden", "hidden")
+        s3_storage.create_file("dir/sub/x.txt", "x", {"name": "x"})
+        s3_storage.create_file("dir/sub/deep/y.txt", "y")
+        s3_storage.create_file("dir/other/z.txt", "z")
+        s3_storage.create_file("dirt.txt", "not in dir")
+        return s3_storage
+
+    def test_list_directory(self, paged_storage):
+        """Test files and subdirectories are listed across several pages."""
+        assert paged_storage.list_files_in_directory("dir") == ["a", "b", "c", "d"]
+        assert len(paged_storage.pages) > 2
+        assert paged_storage.list_subdirectories_in_directory("dir") == ["other", "sub"]
+        assert paged_storage.list_files_in_directory("dir/sub") == ["x"]
+        assert paged_storage.list_meta_data("dir") == {
+            "dir/a.txt": {"name": "a"},
+            "dir/c.txt": {"name": "c"},
+        }
+
+    def test_walk(self, paged_storage):
+        """Test a walk finds nested files and their metadata across page boundaries."""
+        entries = {entry.path: entry for entry in paged_storage.walk("dir")}
+        assert len(paged_storage.pages) > 2
+
+        assert sorted(entries) == [
+            "dir/a.txt",
+            "dir/b.csv",
+            "dir/c.txt",
+            "dir/d.txt",
+            "dir/other",
+            "dir/other/z.txt",
+            "dir/sub",
+            "dir/sub/deep",
+            "dir/sub/deep/y.txt",
+            "dir/sub/x.txt",
+        ]
+        assert {path for path, entry in entries.items() if entry.is_dir} == {
+            "dir/other",
+            "dir/sub",
+            "dir/sub/deep",
+        }
+        assert {path for path, entry in entries.items() if entry.has_metadata} == {
+            "dir/a.txt",
+            "dir/c.txt",
+            "dir/sub/x.txt",
+        }
+        assert entries["dir/a.txt"].meta_version is not None
+        assert entries["dir/b.csv"].size == 1
+
+        shallow = {entry.path: entry.is_dir for entry in paged_storage.walk("dir", False)}
+        assert shallow == {
+            "dir/a.txt": False,
+            "dir/b.csv": False,
+            "dir/c.txt": False,
+            "dir/d.txt": False,
+            "dir/other": True,
+            "dir/sub": True,
+        }
+
+
+class TestS3Client:
+    def test_shared_client(self):
+        """Test storages with the same options share a client and others do not."""
+        first = create_storage(MAX_WORKERS="4")
+        second = create_storage(MAX_WORKERS="4")
+        assert first.client is second.client
+
+        assert create_storage(MAX_WORKERS="4", READ_TIMEOUT="5").client is not first.client
+        assert create_storage(MAX_WORKERS="4", SHARE_CLIENT="false").client is not (
+            first.client
+        )
+
+        # Worker counts within botocore's default pool size need the same pool
+        assert create_storage(MAX_WORKERS="2").client is first.client
+        assert create_storage(MAX_WORKERS="32").client is not first.client
+
+
+class TestAsyncS3Storage:
+    @pytest.fixture(autouse=True)
+    def s3(self, monkeypatch):
+        """Serve the mocked bucket over HTTP, as moto cannot patch aiobotocore."""
+        pytest.importorskip("aiobotocore")
+        from moto.server import ThreadedMotoServer
+
+        monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+        monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+        monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+        server = ThreadedMotoServer(port=0, verbose=False)
+        server.start()
+        host, port = server.get_host_and_port()
+        monkeypatch.setenv("AWS_ENDPOINT_URL_S3", f"http://{host}:{port}")
+        boto3.client("s3").create_bucket(Bucket=BUCKET)
+        yield
+        server.stop()
+
+    def test_read_file_meta_data_errors(self, monkeypatch):
+        """Test only a missing metadata key reads as no metadata."""
+        from acrud.exception import NotFoundError
+
+        async_storage = create_storage(ASYNC="true")
+
+        async def run():
+            async with async_storage:
+                await async_storage.create_file("a.txt", "a", {"author": "bob"})
+                await async_storage.create_file("b.txt", "b")
+                assert await async_storage.read_file("a.txt") == ("a", {"author": "bob"})
+                assert await async_storage.read_file("b.txt") == ("b", None)
+                with pytest.raises(NotFoundError):
+                    await async_storage.read_file("missing.txt")
+
+                get_object_bytes = async_storage._get_object_bytes
+
+                async def _get_object_bytes(key):
+                    if key.endswith("_meta.json"):
+                        raise ClientError(
+                            {"Error": {"Code": "AccessDenied", "Message": "Denied"}},
+                            "GetObject",
+                        )
+                    return await get_object_bytes(key)
+
+                monkeypatch.setattr(async_storage, "_get_object_bytes", _get_object_bytes)
+                with pytest.raises(ClientError) as error:
+                    await async_storage.read_file("b.txt")
+                assert not isinstance(error.value, NotFoundError)
+
+        asyncio.run(run())